@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import FuelEntry
+from .models import FuelEntry, RequestProfile, SyncCursor, SyncJob
 
 
 @admin.register(FuelEntry)
@@ -8,3 +8,21 @@ class FuelEntryAdmin(admin.ModelAdmin):
     list_display = ("timestamp", "odometer_km", "fuel_liters", "cost_per_liter", "total_spend")
     list_filter = ("timestamp",)
     ordering = ("-timestamp",)
+
+
+@admin.register(SyncCursor)
+class SyncCursorAdmin(admin.ModelAdmin):
+    list_display = ("spreadsheet_id", "range_name", "rows_ingested", "updated_at")
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "status", "full", "created", "updated", "unchanged")
+    list_filter = ("status",)
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "method", "path", "status_code", "duration_ms", "trigger", "format")
+    list_filter = ("trigger", "format")
+    exclude = ("data",)
@@ -0,0 +1,145 @@
+"""Synthetic data and timing helpers for `manage.py benchmark`.
+
+Everything here writes through the normal sync pipeline, so the tables a
+benchmark runs against look exactly like synced data."""
+
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .derived import refresh_derived
+from .ingest import upsert_entries
+from .services import RANGE_PATTERN
+
+SHEET_TIMESTAMP_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+
+def synthetic_rows(count, seed=0):
+    """Parsed rows shaped like sync output, with realistic drift.
+
+    Fillups are 1-4 days apart, consumption wanders slowly around
+    2.7 l/100km, fuel bought covers the distance since the previous fillup,
+    and the pump price follows a bounded random walk. Spacing is kept tight
+    enough that a million rows still fit in the datetime range."""
+    rng = random.Random(seed)
+    timestamp = datetime(2000, 1, 1, 8, 0)
+    odometer = 0.0
+    consumption = 2.7
+    price = 1.80
+    rows = []
+    for _ in range(count):
+        distance = rng.uniform(40, 160)
+        timestamp += timedelta(hours=rng.randint(24, 96), minutes=rng.randint(0, 59))
+        odometer = round(odometer + distance, 1)
+        consumption = min(3.4, max(2.2, consumption + rng.gauss(0, 0.05)))
+        price = min(2.30, max(1.50, price + rng.gauss(0, 0.01)))
+        liters = round(distance * consumption / 100, 2)
+        cost_per_liter = round(price, 2)
+        rows.append(
+            {
+                "timestamp": timestamp,
+                "odometer_km": odometer,
+                "fuel_liters": liters,
+                "cost_per_liter": cost_per_liter,
+                "total_spend": round(liters * cost_per_liter, 2),
+                "notes": "",
+            }
+        )
+    return rows
+
+
+def sheet_rows(rows):
+    """Raw spreadsheet values for parsed rows, as the Sheets API returns them"""
+    return [
+        [
+            row["timestamp"].strftime(SHEET_TIMESTAMP_FORMAT),
+            str(row["odometer_km"]),
+            str(row["fuel_liters"]),
+            str(row["cost_per_liter"]),
+            str(row["total_spend"]),
+        ]
+        for row in rows
+    ]
+
+
+class StubSheetsClient:
+    """In-memory stand-in for the Sheets API client
+    (`service.spreadsheets().values().get(...)/.batchGet(...).execute()`).
+
+    `rows` are a sheet's values starting at `first_row`: either one list,
+    served for every spreadsheet and sheet, or a dict mapping
+    (spreadsheet_id, sheet name) to lists. Requests for a range starting
+    further down get the matching tail. Each request sleeps `latency`
+    seconds to stand in for the network round trip."""
+
+    def __init__(self, rows, first_row=2, latency=0):
+        self.rows = rows
+        self.first_row = first_row
+        self.latency = latency
+        # Every range requested, and (method, spreadsheet_id, ranges) per request
+        self.requests = []
+        self.calls = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range):
+        return _StubRequest(self, "get", spreadsheetId, [range])
+
+    def batchGet(self, spreadsheetId, ranges):
+        return _StubRequest(self, "batchGet", spreadsheetId, list(ranges))
+
+    def value_range(self, spreadsheet_id, range_name):
+        match = RANGE_PATTERN.match(range_name)
+        sheet = match["sheet"] if match else range_name.split("!")[0]
+        start = int(match["start_row"]) - self.first_row if match else 0
+        rows = self.rows if isinstance(self.rows, list) else self.rows.get((spreadsheet_id, sheet), [])
+        return {"range": range_name, "values": rows[start:]}
+
+    def respond(self, method, spreadsheet_id, ranges):
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls.append((method, spreadsheet_id, ranges))
+        self.requests.extend(ranges)
+        value_ranges = [self.value_range(spreadsheet_id, range_name) for range_name in ranges]
+        if method == "get":
+            return value_ranges[0]
+        return {"spreadsheetId": spreadsheet_id, "valueRanges": value_ranges}
+
+
+class _StubRequest:
+    def __init__(self, client, method, spreadsheet_id, ranges):
+        self.client = client
+        self.method = method
+        self.spreadsheet_id = spreadsheet_id
+        self.ranges = ranges
+
+    def execute(self, http=None):
+        return self.client.respond(self.method, self.spreadsheet_id, self.ranges)
+
+
+def populate(count, seed=0):
+    """Load `count` synthetic entries through the sync pipeline"""
+    result = upsert_entries(synthetic_rows(count, seed))
+    refresh_derived(full=True)
+    return result
+
+
+def measure(function, repeat=3):
+    """Run `function` `repeat` times.
+    Returns (median seconds, queries in the last run, last return value)."""
+    timings = []
+    value = None
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            value = function()
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings), len(queries), value
@@ -0,0 +1,76 @@
+"""Response caching for the analytics endpoints.
+
+Data only changes when a sync writes something, so responses are cached
+under the current sync generation and never need explicit invalidation:
+bumping the generation makes every older key unreachable, and the cache
+backend's own eviction (LRU for the local-memory backend) drops them.
+"""
+
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import SyncGeneration
+
+# Token while the row is missing (e.g. its table was flushed); the next bump creates the row
+NO_GENERATION_TOKEN = "none"
+
+
+def current_generation():
+    """The SyncGeneration row. Only read here, so read paths (including the read-only
+    connection) never write; the row comes from a migration, or from bump_generation()
+    if it has gone missing. Until then responses share a constant key."""
+    try:
+        return SyncGeneration.objects.get(pk=1)
+    except SyncGeneration.DoesNotExist:
+        return SyncGeneration(pk=1, token=NO_GENERATION_TOKEN)
+
+
+def bump_generation():
+    """Mark all cached responses as stale"""
+    if not SyncGeneration.objects.filter(pk=1).update(value=F("value") + 1, token=uuid.uuid4().hex):
+        SyncGeneration.objects.get_or_create(pk=1, defaults={"value": 1})
+
+
+def _etag_matches(request, etag):
+    header = request.headers.get("If-None-Match", "")
+    return any(tag.strip() in (etag, "*") for tag in header.split(","))
+
+
+def cached_response(view_method):
+    """Cache a read-only viewset action per sync generation, with a strong ETag.
+
+    Requests carrying a matching If-None-Match get an empty 304 without the
+    view or the cache being touched."""
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        generation = current_generation()
+        key = f"moped:{generation.key}:{request.get_full_path()}"
+        # The ETag covers the rendered representation, so it also depends on the negotiated media type
+        etag = '"%s"' % hashlib.sha256(f"{key}:{request.accepted_media_type}".encode()).hexdigest()[:32]
+
+        if _etag_matches(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache = caches[settings.MOPED_RESPONSE_CACHE]
+            cached = cache.get(key)
+            if cached is None:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code < 500:
+                    cache.set(key, (response.status_code, response.data))
+            else:
+                status_code, data = cached
+                response = Response(data, status=status_code)
+
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"  # clients may keep it, but must revalidate
+        return response
+
+    return wrapper
@@ -1,84 +1,166 @@
+import logging
 from collections import defaultdict
 from decimal import Decimal
 
+from django.conf import settings
+from django.db.models import Count, F, FloatField, Func, Max, Min, Q, RowRange, Subquery, Sum, ValueRange, Window
+from django.db.models.functions import FirstValue, Lag
+
+from .metrics import calculation_seconds, timed_function
+
+logger = logging.getLogger(__name__)
+
+# Times each call into moped_calculation_seconds. Per-row helpers and pure arithmetic on totals
+# are left alone (timing them would cost more than they do), as is rolling_efficiency, which
+# only builds a lazy queryset.
+instrumented = timed_function(calculation_seconds)
+
+# Decimal places liters and spend are recorded with. Totals are rounded to them before dividing, so a float sum
+# and an exact difference of running totals (EntryPrefix) give the same ratio, also when it lands on a rounding tie
+LITER_PLACES = 3
+SPEND_PLACES = 2
+
+# Rows fetched per database round trip by entry_pass()
+PASS_CHUNK_SIZE = 2000
+
 SERVICE_INTERVALS = {
     "oil_change": 1000,
     "warranty_service": 3000,
 }
 
-def fuel_efficiency(qs):
-    """Calculate l/100km for a queryset of FuelEntry objects.
-    Returns None if not enough data."""
-    entries = qs.order_by("odometer_km")
-    if entries.count() < 2:
+
+@instrumented
+def entry_totals(qs):
+    """Aggregate distance, liters and spend for a queryset in one query.
+
+    The first entry by odometer is excluded from the fuel and spend sums
+    (its fuel was burned before the range started), matching the per-entry
+    logic the endpoints have always used. Returns None if not enough data."""
+    first_pk = qs.order_by("odometer_km").values("pk")[:1]
+    after_first = ~Q(pk=Subquery(first_pk))
+    totals = qs.aggregate(
+        count=Count("pk"),
+        min_km=Min("odometer_km"),
+        max_km=Max("odometer_km"),
+        liters=Sum("fuel_liters", filter=after_first),
+        spend=Sum("total_spend", filter=after_first),
+    )
+    if totals["count"] < 2:
         return None
 
-    first = entries.first()
-    last = entries.last()
-    distance = last.odometer_km - first.odometer_km
+    distance = totals["max_km"] - totals["min_km"]
     if distance <= 0:
         return None
 
-    total_liters = sum(e.fuel_liters for e in entries.exclude(pk=first.pk))
-    return round((total_liters / distance) * 100, 2)
+    return {
+        "distance_km": distance,
+        "fuel_liters": totals["liters"] or 0,
+        "total_spend": float(totals["spend"] or 0),
+    }
+
+
+@instrumented
+def window_totals(start, end):
+    """entry_totals() for the entries from `start` to `end` (EntryPrefix rows), from their running totals.
+
+    `start`'s own fuel and spend are left out, as entry_totals() leaves out
+    the first entry's. Returns None if not enough data."""
+    if start is None or end is None:
+        return None
+    distance = end.odometer_km - start.odometer_km
+    if distance <= 0:
+        return None
+    return {
+        "distance_km": distance,
+        "fuel_liters": float(end.cumulative_fuel_liters - start.cumulative_fuel_liters),
+        "total_spend": float(end.cumulative_spend - start.cumulative_spend),
+    }
 
 
+def efficiency_from_totals(totals):
+    """l/100km from an entry_totals() result"""
+    if totals is None:
+        return None
+    return round((round(totals["fuel_liters"], LITER_PLACES) / totals["distance_km"]) * 100, 2)
+
+
+def cost_per_km_from_totals(totals):
+    """Cost per km from an entry_totals() result"""
+    if totals is None:
+        return None
+    return round(round(totals["total_spend"], SPEND_PLACES) / totals["distance_km"], 3)
+
+
+@instrumented
+def fuel_efficiency(qs):
+    """Calculate l/100km for a queryset of FuelEntry objects.
+    Returns None if not enough data."""
+    return efficiency_from_totals(entry_totals(qs))
+
+
+@instrumented
 def cost_per_km(qs):
     """Calculate cost per km driven.
     Returns None if not enough data."""
-    entries = qs.order_by("odometer_km")
-    if entries.count() < 2:
-        return None
+    return cost_per_km_from_totals(entry_totals(qs))
 
-    first = entries.first()
-    last = entries.last()
-    distance = last.odometer_km - first.odometer_km
-    if distance <= 0:
+
+def segment_stats(prev, curr):
+    """Stats for the segment driven between two consecutive fillups.
+    The fuel bought at `curr` is what was burned since `prev`."""
+    distance = curr.odometer_km - prev.odometer_km
+    days = (curr.timestamp - prev.timestamp).days
+    l_per_100km = round((curr.fuel_liters / distance) * 100, 2) if distance > 0 else 0
+    cost_km = round(float(curr.total_spend) / distance, 3) if distance > 0 and curr.total_spend else None
+
+    return {
+        "date": curr.timestamp.date().isoformat(),
+        "distance_km": round(distance, 1),
+        "fuel_liters": curr.fuel_liters,
+        "l_per_100km": l_per_100km,
+        "cost": float(curr.total_spend) if curr.total_spend else None,
+        "cost_per_km": cost_km,
+        "days": days,
+    }
+
+
+def vectorized_engine():
+    """The NumPy engine if CALCULATION_ENGINE=numpy and NumPy is installed, else None"""
+    if settings.MOPED_CALCULATION_ENGINE != "numpy":
         return None
+    from . import vectorized
 
-    total_cost = sum(
-        float(e.total_spend) for e in entries.exclude(pk=first.pk) if e.total_spend
-    )
-    return round(total_cost / distance, 3)
+    if not vectorized.available():
+        logger.warning("CALCULATION_ENGINE=numpy but NumPy is not installed; using the Python engine")
+        return None
+    return vectorized
 
 
+@instrumented
 def fillup_pairs(qs):
     """Analyze each segment between consecutive fillups.
     Returns a list of dicts with per-segment stats."""
-    entries = list(qs.order_by("odometer_km"))
-    if len(entries) < 2:
-        return []
-
-    pairs = []
-    for i in range(1, len(entries)):
-        prev = entries[i - 1]
-        curr = entries[i]
-
-        distance = curr.odometer_km - prev.odometer_km
-        days = (curr.timestamp - prev.timestamp).days
-        l_per_100km = round((curr.fuel_liters / distance) * 100, 2) if distance > 0 else 0
-        cost_km = round(float(curr.total_spend) / distance, 3) if distance > 0 and curr.total_spend else None
+    engine = vectorized_engine()
+    if engine is not None:
+        return engine.fillup_pairs(qs)
 
-        pairs.append({
-            "date": curr.timestamp.date().isoformat(),
-            "distance_km": round(distance, 1),
-            "fuel_liters": curr.fuel_liters,
-            "l_per_100km": l_per_100km,
-            "cost": float(curr.total_spend) if curr.total_spend else None,
-            "cost_per_km": cost_km,
-            "days": days,
-        })
-
-    return pairs
+    entries = list(qs.order_by("odometer_km", "pk"))
+    return [segment_stats(prev, curr) for prev, curr in zip(entries, entries[1:])]
 
 
+@instrumented
 def monthly_summary(qs):
     """Group fillup data by month.
     Uses fillup_pairs so first entry's fuel is excluded."""
-    pairs = fillup_pairs(qs)
-    if not pairs:
-        return []
+    engine = vectorized_engine()
+    if engine is not None:
+        return engine.monthly_summary(qs)
+    return summarise_months(fillup_pairs(qs))
+
 
+@instrumented
+def month_totals(pairs):
+    """Running sums of distance, fuel and cost per month for per-segment stats"""
     months = defaultdict(lambda: {"distance": 0, "fuel": 0, "cost": Decimal("0")})
 
     for pair in pairs:
@@ -88,17 +170,149 @@ def monthly_summary(qs):
         if pair["cost"]:
             months[month_key]["cost"] += Decimal(str(pair["cost"]))
 
+    return months
+
+
+def month_summary(month, distance, fuel, cost):
+    """One /monthly/ item from a month's running sums"""
+    return {
+        "month": month,
+        "total_distance_km": round(distance, 1),
+        "total_fuel_liters": round(fuel, 2),
+        "l_per_100km": round((fuel / distance) * 100, 2) if distance > 0 else 0,
+        "total_cost": float(round(cost, 2)),
+    }
+
+
+@instrumented
+def summarise_months(pairs):
+    """Group per-segment stats (as returned by fillup_pairs) by month"""
+    months = month_totals(pairs)
     return [
-        {
-            "month": month,
-            "total_distance_km": round(data["distance"], 1),
-            "total_fuel_liters": round(data["fuel"], 2),
-            "l_per_100km": round((data["fuel"] / data["distance"]) * 100, 2) if data["distance"] > 0 else 0,
-            "total_cost": float(round(data["cost"], 2)),
-        }
-        for month, data in sorted(months.items())
+        month_summary(month, data["distance"], data["fuel"], data["cost"]) for month, data in sorted(months.items())
     ]
 
+
+# Sections of the dashboard, in response order
+DASHBOARD_SECTIONS = ("last_fillup", "efficiency", "fillups", "monthly", "service_status")
+
+
+@instrumented
+def entry_pass(qs, want_pairs=True):
+    """entry_totals() and, if `want_pairs`, fillup_pairs() for `qs`, from one ordered read of its entries.
+    Returns (totals, pairs)."""
+    engine = vectorized_engine()
+    if engine is not None:
+        return engine.entry_pass(qs, want_pairs)
+
+    # Only the columns the pass needs: converting timestamps and decimals is most of its cost
+    columns = ["odometer_km", "fuel_liters", "total_spend"]
+    if want_pairs:
+        columns.append("timestamp")
+    entries = qs.order_by("odometer_km", "pk").values_list(*columns, named=True)
+    first = prev = None
+    fuel = 0.0
+    spend = Decimal("0")
+    pairs = []
+    for entry in entries.iterator(chunk_size=PASS_CHUNK_SIZE):
+        if prev is None:
+            first = entry
+        else:
+            # As in entry_totals(), the first entry's fuel and spend were used before the data starts
+            fuel += entry.fuel_liters
+            spend += entry.total_spend or 0
+            if want_pairs:
+                pairs.append(segment_stats(prev, entry))
+        prev = entry
+
+    totals = None
+    if first is not None and prev.odometer_km > first.odometer_km:
+        totals = {"distance_km": prev.odometer_km - first.odometer_km, "fuel_liters": fuel, "total_spend": float(spend)}
+    return totals, pairs
+
+
+@instrumented
+def dashboard(totals, pairs, newest, sections=DASHBOARD_SECTIONS):
+    """The requested dashboard sections, from an entry_pass() over every entry and the newest entry (or None).
+
+    Each section matches its own endpoint: "last_fillup" is `newest`
+    itself, for the caller to serialize, "efficiency" the /efficiency/ body,
+    "fillups" fillup_pairs(), "monthly" summarise_months() and
+    "service_status" service_status() at `newest`. Sections without enough
+    data are None."""
+    efficiency = efficiency_from_totals(totals)
+
+    results = {
+        "last_fillup": newest,
+        "efficiency": None
+        if efficiency is None
+        else {
+            "l_per_100km": efficiency,
+            "km_per_liter": round(100 / efficiency, 2),
+            "cost_per_km": cost_per_km_from_totals(totals),
+        },
+        "fillups": pairs,
+        "monthly": summarise_months(pairs) if "monthly" in sections else None,
+        "service_status": service_status(newest.odometer_km) if newest is not None else None,
+    }
+    return {section: results[section] for section in sections}
+
+
+class _JulianDay(Func):
+    """Days since 4714 BC as a float, so a timestamp can order a RANGE frame measured in days (SQLite)"""
+
+    function = "julianday"
+    output_field = FloatField()
+
+
+def rolling_efficiency(qs, fillups=None, days=None):
+    """Rolling l/100km at each entry, computed with window functions in the database.
+
+    With `fillups=N`, the window is the last N segments: the distance since
+    the reading N entries back (Lag) and the fuel bought at the N entries
+    since (Sum over a ROWS frame). Entries without N segments before them
+    are left out.
+
+    With `days=N`, the window is every entry in the N days up to and
+    including this one (a RANGE frame over the timestamp), with the first
+    one's fuel left out as in entry_totals(). Windows with a single entry
+    are left out.
+
+    Returns a values() queryset in odometer order with `timestamp`,
+    `odometer_km`, `window_km` and `window_liters`; see rolling_row()."""
+    if days is not None:
+        # A RANGE frame with an offset takes exactly one (numeric) ORDER BY expression
+        by_time = {"order_by": _JulianDay("timestamp").asc()}
+        frame = ValueRange(start=-days, end=0)
+        qs = qs.annotate(
+            window_km=F("odometer_km") - Window(FirstValue("odometer_km"), frame=frame, **by_time),
+            window_liters=Window(Sum("fuel_liters"), frame=frame, **by_time)
+            - Window(FirstValue("fuel_liters"), frame=frame, **by_time),
+            window_entries=Window(Count("pk"), frame=frame, **by_time),
+        ).filter(window_entries__gt=1)
+    else:
+        by_odometer = {"order_by": [F("odometer_km").asc(), F("pk").asc()]}
+        qs = qs.annotate(
+            window_km=F("odometer_km") - Window(Lag("odometer_km", fillups), **by_odometer),
+            window_liters=Window(Sum("fuel_liters"), frame=RowRange(start=-(fillups - 1), end=0), **by_odometer),
+        ).filter(window_km__isnull=False)
+    return qs.order_by("odometer_km", "pk").values("timestamp", "odometer_km", "window_km", "window_liters")
+
+
+def rolling_row(values):
+    """API shape of one rolling_efficiency() row"""
+    distance = values["window_km"]
+    liters = values["window_liters"]
+    return {
+        "date": values["timestamp"].date().isoformat(),
+        "odometer_km": values["odometer_km"],
+        "distance_km": round(distance, 1),
+        "fuel_liters": round(liters, 2),
+        "l_per_100km": round((liters / distance) * 100, 2) if distance > 0 else None,
+    }
+
+
+@instrumented
 def service_status(current_odometer_km):
     return [
         {
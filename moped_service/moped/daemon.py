@@ -0,0 +1,117 @@
+"""Resident sync loop, for `manage.py sync_daemon`.
+
+Instead of booting Django for every cron run, the daemon stays up and
+syncs on an adaptive schedule. The Sheets client, its token and its
+connections are shared process-wide (see sheets.py), so they are reused
+by every poll. Each poll goes through the same single-flight SyncJob as
+POST /sync/, so the daemon never runs alongside a sync started from the API.
+
+Polling drops to SYNC_POLL_MIN after a sync that found new form
+submissions and doubles after each one that did not, up to SYNC_POLL_MAX.
+A failed sync is retried after an exponentially growing, jittered delay
+capped at SYNC_BACKOFF_MAX, and never sooner than a Retry-After the API
+sent. SIGTERM or SIGINT lets the running sync finish and then exits; a
+second one exits at once.
+"""
+
+import logging
+import random
+import signal
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from . import jobs
+from .metrics import sync_daemon_failures, sync_daemon_heartbeat, sync_daemon_last_success, sync_daemon_next_poll
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after(error):
+    """Seconds a failed API request asked the caller to wait (its Retry-After header), or None"""
+    # googleapiclient's HttpError carries the httplib2 response, a dict of lower-cased headers
+    response = getattr(error, "resp", None)
+    value = response.get("retry-after") if isinstance(response, dict) else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        # An HTTP date rather than seconds; the backoff alone will do
+        return None
+
+
+class PollSchedule:
+    """How long to wait before the next poll, given how the last one went"""
+
+    def __init__(self, minimum=None, maximum=None, backoff_max=None):
+        self.minimum = minimum or settings.MOPED_SYNC_POLL_MIN
+        self.maximum = max(self.minimum, maximum or settings.MOPED_SYNC_POLL_MAX)
+        self.backoff_max = max(self.minimum, backoff_max or settings.MOPED_SYNC_BACKOFF_MAX)
+        self.interval = self.minimum
+        self.failures = 0
+
+    def succeeded(self, found_rows):
+        """Poll fast while rows are coming in, and back off towards the maximum while the sheet is idle"""
+        self.failures = 0
+        self.interval = self.minimum if found_rows else min(self.maximum, self.interval * 2)
+        return self.interval
+
+    def failed(self, wait_at_least=None):
+        """Exponential backoff with jitter: a random delay between half and all of the current ceiling,
+        so several daemons hitting the same quota do not retry in step"""
+        self.failures += 1
+        ceiling = min(self.backoff_max, self.minimum * 2 ** min(self.failures - 1, 32))
+        delay = random.uniform(ceiling / 2, ceiling)
+        return max(delay, wait_at_least or 0)
+
+
+class SyncDaemon:
+    def __init__(self, schedule=None):
+        self.schedule = schedule or PollSchedule()
+        self.stopping = threading.Event()
+
+    def stop(self, signum=None, frame=None):
+        """Finish the current poll and exit. Installed as the SIGTERM/SIGINT handler."""
+        if signum is not None:
+            # A second signal gets the default behaviour, for when the running sync hangs
+            signal.signal(signum, signal.SIG_DFL)
+            logger.info("Received %s, stopping after the current sync", signal.Signals(signum).name)
+        self.stopping.set()
+
+    def install_signal_handlers(self):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self.stop)
+
+    def poll(self):
+        """Run one sync, unless one is already in flight. Returns the seconds to wait before the next poll."""
+        # As between requests: drop connections that errored or outlived CONN_MAX_AGE
+        close_old_connections()
+        try:
+            job, started = jobs.claim_job()
+            if started:
+                job = jobs.run_job(job.pk, raise_errors=True)
+        except Exception as e:
+            delay = self.schedule.failed(retry_after(e))
+            logger.warning("Sync failed (%d in a row): %s; retrying in %.0fs", self.schedule.failures, e, delay)
+        else:
+            if started:
+                delay = self.schedule.succeeded(found_rows=job.created > 0)
+                sync_daemon_last_success.set_to_current_time()
+                logger.info("Synced %d new and %d updated entries; next poll in %ds", job.created, job.updated, delay)
+            else:
+                delay = self.schedule.minimum
+                logger.info("Sync job %s is already in flight; next poll in %ds", job.pk, delay)
+
+        sync_daemon_failures.set(self.schedule.failures)
+        sync_daemon_next_poll.set(delay)
+        sync_daemon_heartbeat.set_to_current_time()
+        return delay
+
+    def run(self):
+        """Poll until stopped"""
+        logger.info("Sync daemon started, polling every %d-%ds", self.schedule.minimum, self.schedule.maximum)
+        while not self.stopping.is_set():
+            delay = self.poll()
+            self.stopping.wait(delay)
+        connections.close_all()
+        logger.info("Sync daemon stopped")
@@ -0,0 +1,45 @@
+"""SQLite connection profile.
+
+Every new SQLite connection gets MOPED_SQLITE_PRAGMAS. The main one is WAL
+journaling, under which readers see the last committed state while a sync
+is writing, instead of waiting on it or failing with "database is locked".
+With SQLITE_READ_CONNECTION=true, ReadRouter sends reads made outside a
+transaction to a separate alias whose connections are query-only.
+"""
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply the pragmas on the raw connection, so they never show up as queries"""
+    if connection.vendor != "sqlite":
+        return
+    for name, value in settings.MOPED_SQLITE_PRAGMAS.items():
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+    if connection.alias == settings.MOPED_READ_DATABASE:
+        connection.connection.execute("PRAGMA query_only = ON")
+
+
+class ReadRouter:
+    """Reads go to the read-only alias unless this thread is inside a transaction on the
+    default database, which must see its own uncommitted writes. Writes and migrations
+    stay on the default database."""
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return settings.MOPED_READ_DATABASE
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases point at the same file
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,314 @@
+"""Tables derived from FuelEntry, refreshed by the sync pipeline after entries are written.
+
+Every entry write also marks its odometer and time range stale on the
+SyncGeneration row (mark_stale()), in the same transaction. refresh_derived()
+recomputes only the rows inside that range and clears the mark once it has
+committed, so writes whose sync failed before the refresh are picked up by
+the next one. Entries saved or deleted one at a time (in the admin, or
+through the ORM) are marked the same way and refreshed once their
+transaction commits, which also moves cached responses to a new
+generation."""
+
+import logging
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import bump_generation
+from .calculations import entry_totals, month_totals, segment_stats, vectorized_engine
+from .models import EntryPrefix, FillupSegment, FuelEntry, MonthlyRollup, SyncGeneration
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_FIELDS = [
+    "start_entry",
+    "odometer_km",
+    "date",
+    "timestamp",
+    "distance_km",
+    "fuel_liters",
+    "l_per_100km",
+    "cost",
+    "cost_per_km",
+    "days",
+]
+BATCH_SIZE = 500
+STALE_FIELDS = ["stale_from_km", "stale_to_km", "stale_from", "stale_to"]
+
+
+def _widen(field, value, output_field, lowest):
+    """`field` moved out to `value` if that lies beyond it (or if it is null)"""
+    value = models.Value(value, output_field=output_field)
+    bound = Least if lowest else Greatest
+    return bound(Coalesce(field, value), value)
+
+
+def mark_stale(entries):
+    """Widen the stale range to cover `entries` (FuelEntry instances about to be written).
+    Call it in the same transaction as the write, so the mark holds until refresh_derived() has caught up."""
+    odometers = [entry.odometer_km for entry in entries]
+    timestamps = [entry.timestamp for entry in entries]
+    if not odometers:
+        return
+    bounds = {
+        "stale_from_km": (min(odometers), models.FloatField(), True),
+        "stale_to_km": (max(odometers), models.FloatField(), False),
+        "stale_from": (min(timestamps), models.DateTimeField(), True),
+        "stale_to": (max(timestamps), models.DateTimeField(), False),
+    }
+    widened = {field: _widen(field, *bound) for field, bound in bounds.items()}
+    if not SyncGeneration.objects.filter(pk=1).update(**widened):
+        SyncGeneration.objects.get_or_create(pk=1, defaults={field: bound[0] for field, bound in bounds.items()})
+
+
+def _segment(start_pk, end_pk, odometer_km, timestamp, stats):
+    stats = dict(stats)
+    del stats["date"]
+    return FillupSegment(
+        start_entry_id=start_pk,
+        end_entry_id=end_pk,
+        odometer_km=odometer_km,
+        date=timestamp.date(),
+        timestamp=timestamp,
+        **stats,
+    )
+
+
+def _build_segment(prev, curr):
+    return _segment(prev.pk, curr.pk, curr.odometer_km, curr.timestamp, segment_stats(prev, curr))
+
+
+def _write_segments(segments):
+    FillupSegment.objects.bulk_create(
+        segments,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["end_entry"],
+        update_fields=SEGMENT_FIELDS,
+    )
+
+
+def _write_segments_along(entries):
+    """Write the segment ending at each of `entries` (a queryset, read in odometer order) but the first,
+    holding BATCH_SIZE at a time. Returns how many were written and the months they end in."""
+    written = 0
+    months = set()
+    segments = []
+    prev = None
+    for curr in entries.order_by("odometer_km", "pk").iterator(chunk_size=BATCH_SIZE):
+        if prev is not None:
+            segments.append(_build_segment(prev, curr))
+            months.add(month_key(segments[-1].date))
+        if len(segments) >= BATCH_SIZE:
+            _write_segments(segments)
+            written += len(segments)
+            segments = []
+        prev = curr
+    _write_segments(segments)
+    return written + len(segments), months
+
+
+@transaction.atomic
+def refresh_segments(from_km, to_km):
+    """Recompute the segments that start or end at an odometer reading between `from_km` and `to_km`.
+    Returns how many were written and the months they end in."""
+    entries = FuelEntry.objects.order_by("odometer_km", "pk")
+    before = entries.filter(odometer_km__lt=from_km).last()
+    after = entries.filter(odometer_km__gt=to_km).first()
+    return _write_segments_along(
+        entries.filter(
+            odometer_km__gte=before.odometer_km if before else from_km,
+            odometer_km__lte=after.odometer_km if after else to_km,
+        )
+    )
+
+
+@transaction.atomic
+def rebuild_segments():
+    """Recompute every segment from scratch, with the NumPy engine if it is selected"""
+    FillupSegment.objects.all().delete()
+    engine = vectorized_engine()
+    if engine is not None:
+        _write_segments([_segment(*row) for row in engine.segment_rows(FuelEntry.objects.all())])
+        return
+    _write_segments_along(FuelEntry.objects.all())
+
+
+def _write_prefixes(prefixes):
+    EntryPrefix.objects.bulk_create(
+        prefixes,
+        batch_size=BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=["entry"],
+        update_fields=["odometer_km", "timestamp", "cumulative_fuel_liters", "cumulative_spend"],
+    )
+
+
+def _accumulate_prefixes(entries, fuel=Decimal("0"), spend=Decimal("0")):
+    """Write running totals for `entries` (in odometer order), continuing from the given totals.
+    Returns the number of rows written."""
+    written = 0
+    prefixes = []
+    for entry in entries:
+        fuel += Decimal(str(entry.fuel_liters))
+        spend += entry.total_spend or 0
+        prefixes.append(
+            EntryPrefix(
+                entry_id=entry.pk,
+                odometer_km=entry.odometer_km,
+                timestamp=entry.timestamp,
+                cumulative_fuel_liters=fuel,
+                cumulative_spend=spend,
+            )
+        )
+        if len(prefixes) >= BATCH_SIZE:
+            _write_prefixes(prefixes)
+            written += len(prefixes)
+            prefixes = []
+    _write_prefixes(prefixes)
+    return written + len(prefixes)
+
+
+@transaction.atomic
+def refresh_prefixes(start_km):
+    """Recompute running totals from the odometer reading `start_km` onwards.
+    Appended entries only touch their own rows; an edit rewrites every row after it.
+    Returns the number of rows written."""
+    base = EntryPrefix.objects.filter(odometer_km__lt=start_km).order_by("-odometer_km", "-entry_id").first()
+    totals = (base.cumulative_fuel_liters, base.cumulative_spend) if base else ()
+    entries = FuelEntry.objects.filter(odometer_km__gte=start_km).order_by("odometer_km", "pk")
+    return _accumulate_prefixes(entries.iterator(chunk_size=BATCH_SIZE), *totals)
+
+
+@transaction.atomic
+def rebuild_prefixes():
+    """Recompute every running total from scratch"""
+    EntryPrefix.objects.all().delete()
+    _accumulate_prefixes(FuelEntry.objects.order_by("odometer_km", "pk").iterator(chunk_size=BATCH_SIZE))
+
+
+def month_key(value):
+    """Month key such as "2025-01", for a date or (current timezone) datetime"""
+    if isinstance(value, datetime):
+        value = timezone.localtime(value)
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+def months_between(first, last):
+    """Every "YYYY-MM" month from the one holding `first` to the one holding `last`"""
+    year, month = map(int, month_key(first).split("-"))
+    months = []
+    while (key := f"{year:04d}-{month:02d}") <= month_key(last):
+        months.append(key)
+        year, month = year + month // 12, month % 12 + 1
+    return months
+
+
+def month_bounds(month):
+    """First day of the month and of the month after it"""
+    year, month = map(int, month.split("-"))
+    start = date(year, month, 1)
+    end = date(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+def refresh_rollups(months, segment_sums=None):
+    """Recompute the MonthlyRollup rows for the given "YYYY-MM" months.
+    `segment_sums` ({month: (segment count, month_totals() sums)}) stands in for reading each month's segments."""
+    for month in sorted(months):
+        start, end = month_bounds(month)
+        if segment_sums is None:
+            pairs = [segment.as_pair() for segment in FillupSegment.objects.filter(date__gte=start, date__lt=end)]
+            count, sums = len(pairs), month_totals(pairs).get(month)
+        else:
+            count, sums = segment_sums.get(month, (0, None))
+        entries = FuelEntry.objects.filter(
+            timestamp__gte=timezone.make_aware(datetime.combine(start, time.min)),
+            timestamp__lt=timezone.make_aware(datetime.combine(end, time.min)),
+        )
+        totals = entry_totals(entries)
+        if not count and not entries.exists():
+            MonthlyRollup.objects.filter(month=month).delete()
+            continue
+
+        sums = sums or {"distance": 0, "fuel": 0, "cost": 0}
+        MonthlyRollup.objects.update_or_create(
+            month=month,
+            defaults={
+                "segment_count": count,
+                "distance_km": sums["distance"],
+                "fuel_liters": sums["fuel"],
+                "cost": sums["cost"],
+                "entry_distance_km": totals["distance_km"] if totals else None,
+                "entry_fuel_liters": totals["fuel_liters"] if totals else None,
+                "entry_total_spend": totals["total_spend"] if totals else None,
+            },
+        )
+
+
+@transaction.atomic
+def rebuild_rollups():
+    """Recompute every month from scratch, with the NumPy engine if it is selected"""
+    MonthlyRollup.objects.all().delete()
+    engine = vectorized_engine()
+    segment_sums = engine.month_segments(FuelEntry.objects.all()) if engine is not None else None
+    refresh_rollups({month_key(day) for day in FuelEntry.objects.dates("timestamp", "month")}, segment_sums)
+
+
+@transaction.atomic
+def _refreshed(stale):
+    """Clear the stale range a refresh started from, unless writes have widened it since, and move to a new
+    sync generation"""
+    if stale is not None:
+        SyncGeneration.objects.filter(pk=1, **stale).update(**dict.fromkeys(STALE_FIELDS))
+    bump_generation()
+
+
+def refresh_derived(full=False):
+    """Bring derived tables in line with the entries written since they were last refreshed,
+    and move to a new sync generation if anything changed. full=True rebuilds them from scratch."""
+    stale = SyncGeneration.objects.filter(pk=1).values(*STALE_FIELDS).first()
+    if full:
+        rebuild_segments()
+        rebuild_rollups()
+        rebuild_prefixes()
+        _refreshed(stale)
+        logger.info("Rebuilt fillup segments, monthly rollups and running totals")
+        return
+    if stale is None or stale["stale_from_km"] is None:
+        return
+
+    segments, segment_months = refresh_segments(stale["stale_from_km"], stale["stale_to_km"])
+    refresh_prefixes(stale["stale_from_km"])
+    months = set(months_between(stale["stale_from"], stale["stale_to"])) | segment_months
+    with transaction.atomic():
+        refresh_rollups(months)
+    _refreshed(stale)
+    logger.info("Refreshed %d fillup segments and %d monthly rollups", segments, len(months))
+
+
+@receiver(pre_save, sender=FuelEntry)
+@receiver(pre_delete, sender=FuelEntry)
+def _entry_changing(sender, instance, **kwargs):
+    """Mark an entry saved or deleted by hand stale before the write, at its old position too if it moved"""
+    entries = [instance]
+    if timezone.is_naive(instance.timestamp):
+        # Saved as the database will store it, so the mark compares with the rows around it
+        entries = [FuelEntry(odometer_km=instance.odometer_km, timestamp=timezone.make_aware(instance.timestamp))]
+    if instance.pk is not None:
+        stored = FuelEntry.objects.filter(pk=instance.pk).only("odometer_km", "timestamp").first()
+        if stored is not None:
+            entries.append(stored)
+    mark_stale(entries)
+
+
+@receiver(post_save, sender=FuelEntry)
+@receiver(post_delete, sender=FuelEntry)
+def _entry_changed(sender, instance, **kwargs):
+    # A failed refresh leaves the mark for the next sync, so it must not fail the save itself
+    transaction.on_commit(refresh_derived, robust=True)
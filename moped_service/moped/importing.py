@@ -0,0 +1,94 @@
+"""Bulk import of fuel entries from local files, for `manage.py import_entries`.
+
+Files are read a line at a time and go through the same RowParser and
+upsert_entries() as a sync, so validation and de-duplication are identical.
+Two layouts are accepted:
+
+- CSV with the sheet's columns (timestamp, odometer, liters, cost per
+  liter, total spend, notes), with or without a header row.
+- NDJSON, one entry per line: either a JSON array of those cells, or an
+  object as written by /export/ (ISO timestamps), so an export can be
+  loaded straight back in.
+
+Derived tables are left alone; refresh them once when the import is done.
+"""
+
+import csv
+import json
+from datetime import datetime
+from itertools import chain, islice
+
+from django.utils import timezone
+
+from .ingest import DEFAULT_BATCH_SIZE, SyncResult, upsert_entries
+from .parsing import DETECTION_SAMPLE, TIMESTAMP_FORMATS, TIMESTAMP_PATTERN, RowParser
+
+# Cell order of a sheet row, and the keys of an exported entry in that order
+ENTRY_COLUMNS = ("timestamp", "odometer_km", "fuel_liters", "cost_per_liter", "total_spend", "notes")
+
+FORMATS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".json": "ndjson"}
+
+
+def _cell(value):
+    return "" if value is None else str(value)
+
+
+def csv_rows(lines):
+    """Sheet rows from CSV lines; a first row that does not start with a timestamp is taken as the header"""
+    rows = csv.reader(lines)
+    first = next(rows, None)
+    if first and TIMESTAMP_PATTERN.fullmatch(first[0].strip()):
+        yield first
+    yield from rows
+
+
+def _sheet_timestamp(value):
+    """An exported ISO timestamp written the way the sheet writes it, or the value unchanged if it is not one"""
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return _cell(value)
+    if timezone.is_aware(timestamp):
+        timestamp = timezone.make_naive(timestamp)
+    return timestamp.strftime(TIMESTAMP_FORMATS[0])
+
+
+def ndjson_rows(lines):
+    """Sheet rows from NDJSON lines holding cell arrays or exported entries. Blank lines are skipped;
+    a line that is not JSON becomes an empty row, so the parser counts it as rejected."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield []
+            continue
+        if isinstance(record, dict):
+            yield [_sheet_timestamp(record.get("timestamp"))] + [_cell(record.get(key)) for key in ENTRY_COLUMNS[1:]]
+        elif isinstance(record, list):
+            yield [_cell(value) for value in record]
+        else:
+            yield []
+
+
+def import_rows(rows, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Parse and upsert sheet rows `batch_size` at a time, holding only one batch in memory.
+
+    The timestamp format is detected from the first rows. `progress`, if
+    given, is called with (rows read, SyncResult, RowParser) after every
+    batch. Returns the merged SyncResult and the parser, whose `rejected`
+    counts the rows that were skipped."""
+    rows = iter(rows)
+    sample = list(islice(rows, DETECTION_SAMPLE))
+    parser = RowParser.for_rows(sample)
+    rows = chain(sample, rows)
+
+    result = SyncResult()
+    read = 0
+    while batch := list(islice(rows, batch_size)):
+        read += len(batch)
+        result.merge(upsert_entries(parser.parse_chunk(batch), batch_size=batch_size))
+        if progress is not None:
+            progress(read, result, parser)
+    return result, parser
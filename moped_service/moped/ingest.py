@@ -0,0 +1,118 @@
+import logging
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .derived import mark_stale
+from .models import FuelEntry, content_hash
+
+logger = logging.getLogger(__name__)
+
+UNIQUE_FIELDS = ["timestamp", "odometer_km"]
+UPDATE_FIELDS = ["fuel_liters", "cost_per_liter", "total_spend", "notes", "content_hash"]
+DEFAULT_BATCH_SIZE = 500
+
+CENTS = Decimal("0.01")
+
+
+@dataclass
+class SyncResult:
+    """Outcome of writing a batch of parsed rows to the database"""
+
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    @property
+    def total(self):
+        return self.created + self.updated + self.unchanged
+
+    def merge(self, other):
+        """Add another result's counts to this one"""
+        self.created += other.created
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+
+    def as_dict(self):
+        return {"created": self.created, "updated": self.updated, "unchanged": self.unchanged}
+
+
+def _to_decimal(value):
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(CENTS)
+
+
+def _normalise(parsed):
+    """Bring a parsed row into the shape the database hands back, with its content hash,
+    so a stored row can be compared with an incoming one by hash alone."""
+    timestamp = parsed["timestamp"]
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    row = {
+        "timestamp": timestamp,
+        "odometer_km": float(parsed["odometer_km"]),
+        "fuel_liters": float(parsed["fuel_liters"]),
+        "cost_per_liter": _to_decimal(parsed["cost_per_liter"]),
+        "total_spend": _to_decimal(parsed["total_spend"]),
+        "notes": parsed["notes"],
+    }
+    row["content_hash"] = content_hash(**row)
+    return row
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def upsert_entries(rows, batch_size=DEFAULT_BATCH_SIZE):
+    """Insert or update parsed rows keyed on (timestamp, odometer_km).
+
+    Rows are written in chunks, each in its own short transaction, so
+    readers are never blocked for the length of a whole sync. Each chunk
+    marks its rows stale for derived.refresh_derived() as it commits. Only the
+    stored content hashes are read back, and rows whose hash matches are
+    not written at all. When the same key appears more than once, the last
+    row wins."""
+    by_key = {}
+    for parsed in rows:
+        row = _normalise(parsed)
+        by_key[(row["timestamp"], row["odometer_km"])] = row
+    unique_rows = list(by_key.values())
+
+    result = SyncResult()
+    for chunk in _chunks(unique_rows, batch_size):
+        existing = {
+            (timestamp, odometer_km): stored_hash
+            for timestamp, odometer_km, stored_hash in FuelEntry.objects.filter(
+                timestamp__in={row["timestamp"] for row in chunk}
+            ).values_list(*UNIQUE_FIELDS, "content_hash")
+        }
+
+        to_write = []
+        for row in chunk:
+            stored_hash = existing.get((row["timestamp"], row["odometer_km"]))
+            if stored_hash is None:
+                result.created += 1
+            elif stored_hash != row["content_hash"]:
+                result.updated += 1
+            else:
+                result.unchanged += 1
+                continue
+            to_write.append(FuelEntry(**row))
+
+        if to_write:
+            with transaction.atomic():
+                mark_stale(to_write)
+                FuelEntry.objects.bulk_create(
+                    to_write,
+                    update_conflicts=True,
+                    unique_fields=UNIQUE_FIELDS,
+                    update_fields=UPDATE_FIELDS,
+                )
+
+    logger.info("Upserted %d rows: %s", result.total, result.as_dict())
+    return result
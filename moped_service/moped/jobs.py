@@ -0,0 +1,112 @@
+"""Background sync jobs.
+
+POST /sync/ starts a job on an in-process thread pool instead of syncing in
+the request thread. Sync is single-flight: while a job is pending or
+running, further triggers get that job back rather than starting another.
+A partial unique index allows only one active SyncJob row, so the check
+holds across gunicorn workers and the sync_daemon/sync_sheets commands: of
+two processes claiming at once, one insert fails (or finds the database
+locked) and that caller gets the other's job. A job that has been active
+for longer than MOPED_SYNC_JOB_TIMEOUT is assumed to belong to a dead
+worker and is marked failed."""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.utils import timezone
+
+from .metrics import entries_synced_last, sync_operations_total
+from .models import SyncJob
+from .services import GoogleSheetsService
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = [SyncJob.Status.PENDING, SyncJob.Status.RUNNING]
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="moped-sync")
+_lock = threading.Lock()
+
+# Tries at claiming, for when the job that blocked an insert finished before it could be read
+CLAIM_ATTEMPTS = 3
+
+
+def _expire_abandoned():
+    cutoff = timezone.now() - timedelta(seconds=settings.MOPED_SYNC_JOB_TIMEOUT)
+    SyncJob.objects.filter(status__in=ACTIVE_STATUSES, created_at__lt=cutoff).update(
+        status=SyncJob.Status.FAILED, error="Abandoned: did not finish in time", finished_at=timezone.now()
+    )
+
+
+def _active_job():
+    return SyncJob.objects.filter(status__in=ACTIVE_STATUSES).order_by("created_at").first()
+
+
+def claim_job(full=False):
+    """A new pending job for the caller to run, unless one is already in flight.
+    Returns (job, created); when not created, `job` is the one in flight."""
+    with _lock:
+        for _ in range(CLAIM_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    _expire_abandoned()
+                    job = _active_job()
+                    if job is not None:
+                        return job, False
+                    return SyncJob.objects.create(full=full), True
+            except (IntegrityError, OperationalError) as e:
+                # Another process claimed first, or holds SQLite's write lock while it does
+                error = e
+                job = _active_job()
+                if job is not None:
+                    return job, False
+        raise error
+
+
+def start_sync(full=False):
+    """Start a background sync, or join the one already in flight.
+    Returns (job, started)."""
+    job, started = claim_job(full=full)
+    if started:
+        _executor.submit(_worker, job.pk)
+    return job, started
+
+
+def run_job(job_id, raise_errors=False):
+    """Run a pending job to completion, recording the outcome on it. Returns the job.
+    With raise_errors, a failed sync's exception is re-raised once the failure is recorded."""
+    job = SyncJob.objects.get(pk=job_id)
+    job.status = SyncJob.Status.RUNNING
+    job.started_at = timezone.now()
+    job.save(update_fields=["status", "started_at"])
+
+    error = None
+    try:
+        result = GoogleSheetsService().sync_from_sheets(full=job.full)
+    except Exception as e:
+        logger.exception("Sync job %s failed", job.pk)
+        sync_operations_total.labels(status="error").inc()
+        job.status = SyncJob.Status.FAILED
+        job.error = str(e)
+        error = e
+    else:
+        sync_operations_total.labels(status="success").inc()
+        entries_synced_last.set(result.created + result.updated)
+        job.status = SyncJob.Status.SUCCEEDED
+        job.created, job.updated, job.unchanged = result.created, result.updated, result.unchanged
+    job.finished_at = timezone.now()
+    job.save()
+    if error is not None and raise_errors:
+        raise error
+    return job
+
+
+def _worker(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        # Each pool thread has its own connection; don't leave it open between jobs
+        connection.close()
@@ -0,0 +1,234 @@
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from moped import calculations, derived, vectorized
+from moped.benchmarks import StubSheetsClient, measure, populate, sheet_rows, synthetic_rows
+from moped.ingest import DEFAULT_BATCH_SIZE, upsert_entries
+from moped.models import FuelEntry
+from moped.parsing import RowParser, detect_timestamp_format
+from moped.renderers import FastJSONRenderer, orjson
+from moped.serializers import FuelEntrySerializer, ValuesSerializer
+from moped.services import GoogleSheetsService, SheetSource
+from moped.views import FuelEntryViewSet
+
+TARGETS = ["parse", "upsert", "calculations", "serialize", "views", "sync"]
+
+# (label, viewset action, query params)
+VIEW_CASES = [
+    ("list", "list", {}),
+    ("list ?page=last", "list", {"page": "last"}),
+    ("list ?pagination=cursor", "list", {"pagination": "cursor"}),
+    ("retrieve", "retrieve", {}),
+    ("export ndjson", "export", {}),
+    ("export csv", "export", {"format": "csv"}),
+    ("last-fillup", "last_fillup", {}),
+    ("efficiency", "efficiency", {}),
+    ("efficiency ?month", "efficiency", {"month": "2000-06"}),
+    ("efficiency ?from&to", "efficiency", {"from": "2000-03-01", "to": "2000-09-01"}),
+    ("efficiency ?from_km&to_km", "efficiency", {"from_km": "1000", "to_km": "50000"}),
+    ("fillups", "fillups", {}),
+    ("fillups ?page=1", "fillups", {"page": "1"}),
+    ("monthly", "monthly", {}),
+    ("monthly ?from&to", "monthly", {"from": "2000-03-01", "to": "2000-09-01"}),
+    ("service-status", "service_reminder", {}),
+    ("rolling ?fillups=5", "rolling", {}),
+    ("rolling ?days=30", "rolling", {"days": "30"}),
+    ("dashboard", "dashboard", {}),
+    ("dashboard ?fields=efficiency", "dashboard", {"fields": "efficiency"}),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Time calculations, API actions and sync against synthetic data, in a throwaway SQLite database "
+        "(never the live one: the benchmark holds its write lock for minutes)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            help="New SQLite file to benchmark in, kept afterwards (default: a temporary file that is deleted)",
+        )
+        parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+        parser.add_argument("--only", nargs="+", choices=TARGETS, default=TARGETS)
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (the median is reported)")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    def _report(self, label, seconds, queries, extra=""):
+        self.stdout.write(f"  {label:<32} {seconds * 1000:12.2f} ms {queries:8d} queries  {extra}")
+
+    def _measure(self, label, function, repeat=None):
+        seconds, queries, value = measure(function, repeat=repeat or self.repeat)
+        self._report(label, seconds, queries)
+        return value
+
+    def bench_parse(self, count):
+        values = sheet_rows(synthetic_rows(count))
+        # Every 100th row is damaged, so the rejection path is part of the measurement
+        for index in range(0, count, 100):
+            values[index] = [values[index][0], "n/a", values[index][2]]
+
+        detected = self._measure("detect format", lambda: detect_timestamp_format(values))
+        seconds, _, parser = measure(lambda: self._parse_all(RowParser(detected), values), repeat=self.repeat)
+        self._report("parse", seconds, 0, f"{count / seconds:,.0f} rows/s rejected={dict(parser.rejected)}")
+
+    @staticmethod
+    def _parse_all(parser, values):
+        for _ in parser.parse(values):
+            pass
+        return parser
+
+    def bench_upsert(self, count):
+        rows = synthetic_rows(count)
+        edited = [dict(row, fuel_liters=row["fuel_liters"] + 0.1) if i % 10 == 0 else row for i, row in enumerate(rows)]
+        for label, batch in (("initial", rows), ("no-op", rows), ("10% edit", edited)):
+            seconds, queries, result = measure(lambda: upsert_entries(batch, batch_size=self.batch_size), repeat=1)
+            self._report(f"upsert {label}", seconds, queries, f"{count / seconds:,.0f} rows/s {result.as_dict()}")
+
+    def bench_calculations(self, count):
+        populate(count)
+        qs = FuelEntry.objects.all()
+        last_km = FuelEntry.objects.first().odometer_km
+        self._measure("entry_totals", lambda: calculations.entry_totals(qs))
+        self._measure("fuel_efficiency", lambda: calculations.fuel_efficiency(qs))
+        self._measure("cost_per_km", lambda: calculations.cost_per_km(qs))
+        self._measure("service_status", lambda: calculations.service_status(last_km))
+        pairs = calculations.fillup_pairs(qs)
+        self._measure("summarise_months", lambda: calculations.summarise_months(pairs))
+
+        engines = ["python", "numpy"] if vectorized.available() else ["python"]
+        for engine in engines:
+            with override_settings(MOPED_CALCULATION_ENGINE=engine):
+                self._measure(f"fillup_pairs ({engine})", lambda: calculations.fillup_pairs(qs))
+                self._measure(f"monthly_summary ({engine})", lambda: calculations.monthly_summary(qs))
+                self._measure(f"entry_pass ({engine})", lambda: calculations.entry_pass(qs))
+                self._measure(f"rebuild_segments ({engine})", derived.rebuild_segments)
+                self._measure(f"rebuild_rollups ({engine})", derived.rebuild_rollups)
+
+    def _rate(self, label, function, count):
+        seconds, queries, _ = measure(function, repeat=self.repeat)
+        self._report(label, seconds, queries, f"{count / seconds:,.0f} rows/s")
+
+    def bench_serialize(self, count):
+        populate(count)
+        values = ValuesSerializer(FuelEntrySerializer)
+        # Fresh querysets each run, so no run reuses another's fetched rows
+        self._rate("ModelSerializer", lambda: FuelEntrySerializer(FuelEntry.objects.all(), many=True).data, count)
+        self._rate("ValuesSerializer", lambda: values.many(values.rows(FuelEntry.objects.all())), count)
+
+        data = values.many(values.rows(FuelEntry.objects.all()))
+        engines = ["json", "orjson"] if orjson is not None else ["json"]
+        for engine in engines:
+            with override_settings(MOPED_JSON_ENGINE=engine):
+                self._rate(f"render ({engine})", lambda: FastJSONRenderer().render(data), count)
+
+    def bench_views(self, count):
+        populate(count)
+        factory = APIRequestFactory()
+        cache = caches[settings.MOPED_RESPONSE_CACHE]
+        entry_pk = FuelEntry.objects.first().pk
+
+        def call(action, params):
+            # Extra actions carry their own initkwargs (e.g. export's renderers), as the router would pass them
+            view = FuelEntryViewSet.as_view({"get": action}, **getattr(getattr(FuelEntryViewSet, action), "kwargs", {}))
+            kwargs = {"pk": entry_pk} if action == "retrieve" else {}
+            response = view(factory.get("/api/moped-entries/", params), **kwargs)
+            if response.streaming:
+                return sum(len(chunk) for chunk in response.streaming_content)
+            return len(response.render().content)
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            for label, action, params in VIEW_CASES:
+                # Cold runs clear the response cache first; warm runs show the cached path
+                self._measure(f"{label} (cold)", lambda: (cache.clear(), call(action, params)))
+                self._measure(f"{label} (warm)", lambda: call(action, params))
+
+    def bench_sync(self, count):
+        rows = synthetic_rows(count)
+        extra = synthetic_rows(count + max(1, count // 100))[count:]
+        stub = StubSheetsClient(sheet_rows(rows))
+        service = GoogleSheetsService(service=stub, spreadsheet_id="benchmark", range_name="Form Responses 1!A2:E")
+
+        self._measure("sync initial", service.sync_from_sheets, repeat=1)
+        self._measure("sync no changes", service.sync_from_sheets)
+        stub.rows = stub.rows + sheet_rows(extra)
+        self._measure(f"sync +{len(extra)} rows", service.sync_from_sheets, repeat=1)
+        self._measure("sync --full", lambda: service.sync_from_sheets(full=True), repeat=1)
+        # A range without a start row is always read in full; its digest lets an unchanged read stop after the fetch
+        whole = GoogleSheetsService(service=stub, spreadsheet_id="benchmark", range_name="Form Responses 1")
+        self._measure("sync whole range", whole.sync_from_sheets, repeat=1)
+        self._measure("sync whole range, no changes", whole.sync_from_sheets)
+
+        # The same rows split over several spreadsheets and ranges, with a simulated round trip per request
+        sources = [
+            SheetSource(f"vehicle-{number}", f"{sheet}!A2:E")
+            for number in range(3)
+            for sheet in ("Form Responses 1", "Archive")
+        ]
+        all_rows = rows + extra
+        sheets = {
+            (source.spreadsheet_id, source.range_name.split("!")[0]): sheet_rows(all_rows[index :: len(sources)])
+            for index, source in enumerate(sources)
+        }
+        latency = 0.05
+        multi = GoogleSheetsService(service=StubSheetsClient(sheets, latency=latency), sources=sources)
+        self._measure(
+            f"sync --full 6 ranges ({latency * 1000:.0f}ms rtt)",
+            lambda: multi.sync_from_sheets(full=True),
+            repeat=1,
+        )
+
+    @contextmanager
+    def _throwaway_database(self, path):
+        """Point the connections to the live database at a new SQLite file and migrate it"""
+        live = os.path.abspath(settings.DATABASES[DEFAULT_DB_ALIAS]["NAME"])
+        if os.path.abspath(path) == live:
+            raise CommandError("--database must not be the live database")
+        if os.path.exists(path):
+            raise CommandError(f"{path} already exists; the benchmark only runs in a new database")
+
+        # Every alias on the live file (the read connection mirrors the default one)
+        aliases = [alias for alias in connections if os.path.abspath(settings.DATABASES[alias]["NAME"]) == live]
+        for alias in aliases:
+            connections[alias].close()
+            connections[alias].settings_dict["NAME"] = path
+        try:
+            call_command("migrate", verbosity=0, interactive=False)
+            yield
+        finally:
+            for alias in aliases:
+                connections[alias].close()
+                connections[alias].settings_dict["NAME"] = settings.DATABASES[alias]["NAME"]
+
+    def handle(self, *args, **options):
+        # Per-sync info logging would drown out the results
+        logging.getLogger("moped").setLevel(logging.WARNING)
+        self.repeat = options["repeat"]
+        self.batch_size = options["batch_size"]
+
+        # Cold view runs clear the response cache, which may be a file cache shared with the live workers
+        private_cache = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "moped-benchmark"}
+        with tempfile.TemporaryDirectory(prefix="moped-benchmark-") as directory:
+            path = options["database"] or os.path.join(directory, "benchmark.sqlite3")
+            with (
+                self._throwaway_database(path),
+                override_settings(CACHES={**settings.CACHES, settings.MOPED_RESPONSE_CACHE: private_cache}),
+            ):
+                self.stdout.write(f"Benchmarking in {path}")
+                for count in options["rows"]:
+                    for target in options["only"]:
+                        self.stdout.write(f"{target} - {count:,} rows")
+                        # Each target starts from an empty database
+                        with transaction.atomic():
+                            getattr(self, f"bench_{target}")(count)
+                            transaction.set_rollback(True)
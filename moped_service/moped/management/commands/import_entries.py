@@ -0,0 +1,84 @@
+import logging
+import sys
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from moped.derived import refresh_derived
+from moped.importing import FORMATS, csv_rows, import_rows, ndjson_rows
+from moped.ingest import DEFAULT_BATCH_SIZE
+from moped.models import FuelEntry
+
+READERS = {"csv": csv_rows, "ndjson": ndjson_rows}
+
+
+class Command(BaseCommand):
+    help = "Import fuel entries from a CSV or NDJSON file (or - for stdin), validated like a sync"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, or - for standard input")
+        parser.add_argument("--format", choices=READERS, help="Defaults to the file extension (.csv, .ndjson, .jsonl)")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per bulk insert")
+        parser.add_argument("--progress-every", type=int, default=50_000, help="Rows between progress lines")
+
+    def _format(self, path, requested):
+        if requested:
+            return requested
+        fmt = FORMATS.get(Path(path).suffix.lower())
+        if fmt is None:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format csv or --format ndjson")
+        return fmt
+
+    def _progress(self, every, start):
+        next_report = every
+
+        def report(read, result, parser):
+            nonlocal next_report
+            if read < next_report:
+                return
+            next_report = read + every
+            elapsed = max(time.perf_counter() - start, 1e-9)
+            self.stdout.write(
+                f"  {read:,} rows read, {parser.parsed:,} valid, {parser.rejected_total:,} rejected"
+                f" - {read / elapsed:,.0f} rows/s"
+            )
+
+        return report
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = self._format(path, options["format"])
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        # One "Upserted ..." line per batch would drown out the progress lines
+        logging.getLogger("moped.ingest").setLevel(logging.WARNING)
+
+        entries_before = FuelEntry.objects.count()
+        start = time.perf_counter()
+        try:
+            lines = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        with lines:
+            result, parser = import_rows(
+                READERS[fmt](lines),
+                batch_size=options["batch_size"],
+                progress=self._progress(options["progress_every"], start),
+            )
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        read = parser.parsed + parser.rejected_total
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {result.total:,} entries ({result.created:,} created, {result.updated:,} updated, "
+                f"{result.unchanged:,} unchanged) from {read:,} rows in {elapsed:.1f}s ({read / elapsed:,.0f} rows/s)"
+            )
+        )
+        if parser.rejected:
+            self.stdout.write(self.style.WARNING(f"Skipped {parser.rejected_total:,} rows: {dict(parser.rejected)}"))
+
+        # Derived tables are brought up to date once; rebuilding is cheaper when most of the table changed
+        start = time.perf_counter()
+        refresh_derived(full=result.created + result.updated > entries_before)
+        self.stdout.write(f"Refreshed derived tables in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from prometheus_client import start_http_server
+
+from moped.daemon import PollSchedule, SyncDaemon
+
+
+class Command(BaseCommand):
+    help = "Keep syncing from Google Sheets, polling faster while new rows arrive (stop with SIGTERM)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-interval", type=int, default=settings.MOPED_SYNC_POLL_MIN, help="Seconds")
+        parser.add_argument("--max-interval", type=int, default=settings.MOPED_SYNC_POLL_MAX, help="Seconds")
+        parser.add_argument("--backoff-max", type=int, default=settings.MOPED_SYNC_BACKOFF_MAX, help="Seconds")
+        parser.add_argument(
+            "--metrics-port",
+            type=int,
+            default=settings.MOPED_SYNC_DAEMON_METRICS_PORT,
+            help="Port to serve Prometheus metrics on, 0 for none",
+        )
+
+    def handle(self, *args, **options):
+        if options["min_interval"] < 1:
+            raise CommandError("--min-interval must be at least 1")
+        if options["max_interval"] < options["min_interval"]:
+            raise CommandError("--max-interval must not be below --min-interval")
+
+        if options["metrics_port"]:
+            start_http_server(options["metrics_port"])
+            self.stdout.write(f"Serving metrics on :{options['metrics_port']}/metrics")
+
+        daemon = SyncDaemon(PollSchedule(options["min_interval"], options["max_interval"], options["backoff_max"]))
+        daemon.install_signal_handlers()
+        daemon.run()
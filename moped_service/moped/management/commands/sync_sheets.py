@@ -1,27 +1,24 @@
 from django.core.management.base import BaseCommand
-from django.utils import timezone
 
-from moped.calculations import cost_per_km
-from moped.metrics import cost_per_km_gauge, current_odometer, days_since_last_fueling
-from moped.models import FuelEntry
-from moped.services import GoogleSheetsService
+from moped.jobs import claim_job, run_job
 
 
 class Command(BaseCommand):
     help = "Sync fuel entries from Google Sheets"
 
-    def handle(self, *args, **options):
-        service = GoogleSheetsService()
-        count = service.sync_from_sheets()
-        self.stdout.write(self.style.SUCCESS(f"Synced {count} entries"))
-
-        last_entry = FuelEntry.objects.first()
-        if last_entry:
-            current_odometer.set(last_entry.odometer_km)
-            days = (timezone.now() - last_entry.timestamp).days
-            days_since_last_fueling.set(days)
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Re-read the whole sheet instead of only new rows")
 
-        qs = FuelEntry.objects.all()
-        cost = cost_per_km(qs)
-        if cost is not None:
-            cost_per_km_gauge.set(cost)
+    def handle(self, *args, **options):
+        # Runs as a sync job, so it never overlaps a sync started from the API or sync_daemon
+        job, started = claim_job(full=options["full"])
+        if not started:
+            self.stdout.write(self.style.WARNING(f"Sync job {job.pk} is already {job.status}; not starting another"))
+            return
+        job = run_job(job.pk, raise_errors=True)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Synced {job.created + job.updated + job.unchanged} entries "
+                f"({job.created} created, {job.updated} updated, {job.unchanged} unchanged)"
+            )
+        )
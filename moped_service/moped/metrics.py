@@ -1,4 +1,15 @@
-from prometheus_client import Counter, Gauge
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
 
 # Counter: only goes up. Good for "how many times did X happen?"
 sync_operations_total = Counter(
@@ -10,26 +21,202 @@ sync_operations_total = Counter(
 # Gauge: can go up or down. Good for "what is the current value of X?"
 entries_synced_last = Gauge(
     "moped_entries_synced_last",
-    "Number of entries synced in the last sync operation",
+    "Number of entries created or updated by the last sync operation",
+)
+
+sync_rows_total = Counter(
+    "moped_sync_rows_total",
+    "Parsed sheet rows handled by syncs, by what was done with them",
+    ["result"],  # label: "created", "updated" or "unchanged" (not written)
+)
+
+sync_ranges_skipped_total = Counter(
+    "moped_sync_ranges_skipped_total",
+    "Sheet ranges read in full whose content matched the last sync, so nothing was parsed or written",
+)
+
+sync_rows_rejected_total = Counter(
+    "moped_sync_rows_rejected_total",
+    "Sheet rows skipped during sync because they could not be parsed",
+    ["reason"],  # label: "too_short", "invalid_timestamp" or "invalid_number"
+)
+
+sync_daemon_heartbeat = Gauge(
+    "moped_sync_daemon_heartbeat_timestamp_seconds",
+    "Unix time the sync daemon last finished a poll, successful or not; stale means the loop is stuck or dead",
+)
+
+sync_daemon_last_success = Gauge(
+    "moped_sync_daemon_last_success_timestamp_seconds",
+    "Unix time of the sync daemon's last successful sync",
 )
 
-km_until_service = Gauge(
-    "moped_km_until_service",
-    "Kilometers remaining until next service",
-    ["service_type"],
+sync_daemon_failures = Gauge(
+    "moped_sync_daemon_consecutive_failures",
+    "Syncs that have failed in a row in the sync daemon (0 after a success)",
 )
 
-current_odometer = Gauge(
-    "moped_current_odometer_km",
-    "Current odometer reading in kilometers",
+sync_daemon_next_poll = Gauge(
+    "moped_sync_daemon_next_poll_seconds",
+    "Seconds the sync daemon waits before its next poll",
 )
 
-days_since_last_fueling = Gauge(
-    "moped_days_since_last_fueling",
-    "Days since the last fuel entry",
+# Histogram: counts observations into buckets. Good for "how long did X take?"
+sync_phase_seconds = Histogram(
+    "moped_sync_phase_seconds",
+    "Time spent in each phase of a sync, per spreadsheet for fetch and per source for parse and write",
+    ["phase"],  # label: "fetch", "parse", "write" or "refresh" (derived tables and the cache generation)
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
 )
 
-cost_per_km_gauge = Gauge(
-    "moped_cost_per_km",
-    "Cost per kilometer in euros",
+calculation_seconds = Histogram(
+    "moped_calculation_seconds",
+    "Time spent in each calculation function",
+    ["function"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
 )
+
+request_db_queries = Histogram(
+    "moped_request_db_queries",
+    "Database queries run while handling an API request",
+    ["action"],  # label: the viewset action, e.g. "list" or "efficiency"
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+
+request_db_seconds = Histogram(
+    "moped_request_db_seconds",
+    "Time spent in database queries while handling an API request",
+    ["action"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+def timed(histogram, **labels):
+    """Observe the seconds a block or function takes into `histogram`.
+
+    Works both as `with timed(sync_phase_seconds, phase="fetch"):` and as
+    a decorator, `@timed(calculation_seconds, function="entry_totals")`."""
+    return (histogram.labels(**labels) if labels else histogram).time()
+
+
+def timed_function(histogram, label="function"):
+    """Decorator timing every call into `histogram`, labelled with the function's name"""
+
+    def decorator(function):
+        return timed(histogram, **{label: function.__name__})(function)
+
+    return decorator
+
+
+class QueryTracker:
+    """Count and time the queries this thread runs, on every database alias,
+    and observe them into the request_db_* histograms for `action` when stopped.
+
+    Usable as a context manager, or started and stopped by hand when the work
+    continues past the block (e.g. while a streaming response is consumed)."""
+
+    def __init__(self, action):
+        self.action = action
+        self.queries = 0
+        self.seconds = 0.0
+        self._stack = None
+
+    def _wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.seconds += time.perf_counter() - start
+
+    def start(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self._wrapper))
+        return self
+
+    def stop(self):
+        if self._stack is None:
+            return
+        self._stack.close()
+        self._stack = None
+        request_db_queries.labels(action=self.action).observe(self.queries)
+        request_db_seconds.labels(action=self.action).observe(self.seconds)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+# Collector: computes its values on demand. Good for values derived from the database.
+class MopedCollector:
+    """Data-derived gauges, computed when Prometheus scrapes rather than at startup or sync time.
+
+    Values are cached for MOPED_METRICS_TTL seconds and recomputed early when
+    the sync generation changes, so a scrape right after a sync is never stale.
+    Days since last fueling is always worked out at scrape time from the cached timestamp."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cached = None  # (generation key, monotonic time, values)
+
+    def describe(self):
+        # Declared up front so registering the collector never touches the database
+        return [
+            GaugeMetricFamily("moped_current_odometer_km", "Current odometer reading in kilometers"),
+            GaugeMetricFamily("moped_days_since_last_fueling", "Days since the last fuel entry"),
+            GaugeMetricFamily("moped_cost_per_km", "Cost per kilometer in euros"),
+            GaugeMetricFamily(
+                "moped_km_until_service", "Kilometers remaining until next service", labels=["service_type"]
+            ),
+        ]
+
+    def _compute(self):
+        from .calculations import cost_per_km_from_totals, entry_totals
+        from .models import FuelEntry
+
+        last_entry = FuelEntry.objects.only("odometer_km", "timestamp").first()
+        return {
+            "odometer_km": last_entry.odometer_km if last_entry else None,
+            "last_timestamp": last_entry.timestamp if last_entry else None,
+            "cost_per_km": cost_per_km_from_totals(entry_totals(FuelEntry.objects.all())),
+        }
+
+    def _values(self):
+        from .caching import current_generation
+
+        generation = current_generation().key
+        with self._lock:
+            if self._cached is not None:
+                cached_generation, computed_at, values = self._cached
+                if cached_generation == generation and time.monotonic() - computed_at < settings.MOPED_METRICS_TTL:
+                    return values
+            values = self._compute()
+            self._cached = (generation, time.monotonic(), values)
+            return values
+
+    def collect(self):
+        from .calculations import service_status
+
+        try:
+            values = self._values()
+        except DatabaseError as e:
+            logger.warning("Could not compute moped metrics: %s", e)
+            return
+
+        families = {family.name: family for family in self.describe()}
+        if values["odometer_km"] is not None:
+            families["moped_current_odometer_km"].add_metric([], values["odometer_km"])
+            days = (timezone.now() - values["last_timestamp"]).days
+            families["moped_days_since_last_fueling"].add_metric([], days)
+            for item in service_status(values["odometer_km"]):
+                families["moped_km_until_service"].add_metric([item["service"]], item["km_remaining"])
+        if values["cost_per_km"] is not None:
+            families["moped_cost_per_km"].add_metric([], values["cost_per_km"])
+        yield from families.values()
+
+
+moped_collector = MopedCollector()
+REGISTRY.register(moped_collector)
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:32
+
+from django.db import migrations, models
+
+
+def remove_duplicate_readings(apps, schema_editor):
+    """Keep only the newest row for each (timestamp, odometer_km) pair"""
+    FuelEntry = apps.get_model("moped", "FuelEntry")
+    seen = set()
+    duplicates = []
+    for pk, timestamp, odometer_km in FuelEntry.objects.order_by("-pk").values_list("pk", "timestamp", "odometer_km"):
+        key = (timestamp, odometer_km)
+        if key in seen:
+            duplicates.append(pk)
+        else:
+            seen.add(key)
+    FuelEntry.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0002_rename_cost_fuelentry_cost_per_liter_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_readings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="fuelentry",
+            constraint=models.UniqueConstraint(fields=("timestamp", "odometer_km"), name="unique_fuel_entry_reading"),
+        ),
+    ]
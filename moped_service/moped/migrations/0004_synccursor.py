@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0003_fuelentry_unique_reading"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncCursor",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("spreadsheet_id", models.CharField(max_length=255)),
+                ("range_name", models.CharField(max_length=255)),
+                ("rows_ingested", models.PositiveIntegerField(default=0)),
+                ("tail_fingerprint", models.CharField(blank=True, max_length=64)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="synccursor",
+            constraint=models.UniqueConstraint(
+                fields=("spreadsheet_id", "range_name"), name="unique_sync_cursor_source"
+            ),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_segments(apps, schema_editor):
+    """Fill the table for data that was synced before it existed"""
+    FuelEntry = apps.get_model("moped", "FuelEntry")
+    FillupSegment = apps.get_model("moped", "FillupSegment")
+
+    segments = []
+    prev = None
+    for curr in FuelEntry.objects.order_by("odometer_km", "pk").iterator():
+        if prev is not None:
+            distance = curr.odometer_km - prev.odometer_km
+            spend = float(curr.total_spend) if curr.total_spend else None
+            segments.append(
+                FillupSegment(
+                    start_entry_id=prev.pk,
+                    end_entry_id=curr.pk,
+                    odometer_km=curr.odometer_km,
+                    date=curr.timestamp.date(),
+                    distance_km=round(distance, 1),
+                    fuel_liters=curr.fuel_liters,
+                    l_per_100km=round((curr.fuel_liters / distance) * 100, 2) if distance > 0 else 0,
+                    cost=spend,
+                    cost_per_km=round(spend / distance, 3) if distance > 0 and spend else None,
+                    days=(curr.timestamp - prev.timestamp).days,
+                )
+            )
+        prev = curr
+    FillupSegment.objects.bulk_create(segments, batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0004_synccursor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FillupSegment",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("odometer_km", models.FloatField(db_index=True)),
+                ("date", models.DateField(db_index=True)),
+                ("distance_km", models.FloatField()),
+                ("fuel_liters", models.FloatField()),
+                ("l_per_100km", models.FloatField()),
+                ("cost", models.FloatField(blank=True, null=True)),
+                ("cost_per_km", models.FloatField(blank=True, null=True)),
+                ("days", models.IntegerField()),
+                (
+                    "end_entry",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="segment", to="moped.fuelentry"
+                    ),
+                ),
+                (
+                    "start_entry",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="+", to="moped.fuelentry"
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["odometer_km", "end_entry_id"],
+            },
+        ),
+        migrations.RunPython(build_segments, migrations.RunPython.noop),
+    ]
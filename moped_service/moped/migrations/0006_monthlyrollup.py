@@ -0,0 +1,68 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:36
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def build_rollups(apps, schema_editor):
+    """Fill the table for data that was synced before it existed"""
+    FuelEntry = apps.get_model("moped", "FuelEntry")
+    FillupSegment = apps.get_model("moped", "FillupSegment")
+    MonthlyRollup = apps.get_model("moped", "MonthlyRollup")
+
+    rollups = {}
+
+    def rollup(month):
+        if month not in rollups:
+            rollups[month] = MonthlyRollup(month=month, cost=Decimal("0"))
+        return rollups[month]
+
+    for segment in FillupSegment.objects.order_by("odometer_km", "end_entry_id"):
+        row = rollup(segment.date.strftime("%Y-%m"))
+        row.segment_count += 1
+        row.distance_km += segment.distance_km
+        row.fuel_liters += segment.fuel_liters
+        if segment.cost:
+            row.cost += Decimal(str(segment.cost))
+
+    entries_by_month = defaultdict(list)
+    for entry in FuelEntry.objects.order_by("odometer_km", "pk"):
+        entries_by_month[entry.timestamp.strftime("%Y-%m")].append(entry)
+    for month, entries in entries_by_month.items():
+        row = rollup(month)
+        distance = entries[-1].odometer_km - entries[0].odometer_km
+        if len(entries) >= 2 and distance > 0:
+            row.entry_distance_km = distance
+            row.entry_fuel_liters = sum(entry.fuel_liters for entry in entries[1:])
+            row.entry_total_spend = float(sum(entry.total_spend for entry in entries[1:] if entry.total_spend))
+
+    MonthlyRollup.objects.bulk_create(rollups.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0005_fillupsegment"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyRollup",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("month", models.CharField(max_length=7, unique=True)),
+                ("segment_count", models.PositiveIntegerField(default=0)),
+                ("distance_km", models.FloatField(default=0)),
+                ("fuel_liters", models.FloatField(default=0)),
+                ("cost", models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ("entry_distance_km", models.FloatField(blank=True, null=True)),
+                ("entry_fuel_liters", models.FloatField(blank=True, null=True)),
+                ("entry_total_spend", models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["month"],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:38
+
+from django.db import migrations, models
+
+import moped.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0006_monthlyrollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncGeneration",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("value", models.PositiveBigIntegerField(default=0)),
+                ("token", models.CharField(default=moped.models._new_generation_token, max_length=32)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
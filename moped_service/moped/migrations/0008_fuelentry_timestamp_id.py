@@ -0,0 +1,16 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0007_syncgeneration"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="fuelentry",
+            index=models.Index(fields=["timestamp", "id"], name="fuelentry_timestamp_id"),
+        ),
+    ]
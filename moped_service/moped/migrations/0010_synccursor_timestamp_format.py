@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0009_syncjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="synccursor",
+            name="timestamp_format",
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
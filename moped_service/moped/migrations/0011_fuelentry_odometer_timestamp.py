@@ -0,0 +1,16 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0010_synccursor_timestamp_format"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="fuelentry",
+            index=models.Index(fields=["odometer_km", "timestamp"], name="fuelentry_odometer_timestamp"),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:55
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_prefixes(apps, schema_editor):
+    """Fill the table for data that was synced before it existed"""
+    FuelEntry = apps.get_model("moped", "FuelEntry")
+    EntryPrefix = apps.get_model("moped", "EntryPrefix")
+
+    prefixes = []
+    fuel = 0.0
+    spend = Decimal("0")
+    for entry in FuelEntry.objects.order_by("odometer_km", "pk").iterator():
+        fuel += entry.fuel_liters
+        spend += entry.total_spend or 0
+        prefixes.append(
+            EntryPrefix(
+                entry_id=entry.pk,
+                odometer_km=entry.odometer_km,
+                timestamp=entry.timestamp,
+                cumulative_fuel_liters=fuel,
+                cumulative_spend=spend,
+            )
+        )
+    EntryPrefix.objects.bulk_create(prefixes, batch_size=500)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0011_fuelentry_odometer_timestamp"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EntryPrefix",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("odometer_km", models.FloatField()),
+                ("timestamp", models.DateTimeField()),
+                ("cumulative_fuel_liters", models.FloatField()),
+                ("cumulative_spend", models.DecimalField(decimal_places=2, max_digits=14)),
+                (
+                    "entry",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="prefix", to="moped.fuelentry"
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["odometer_km", "entry_id"],
+                "indexes": [
+                    models.Index(fields=["odometer_km", "entry"], name="entryprefix_odometer"),
+                    models.Index(fields=["timestamp", "odometer_km"], name="entryprefix_timestamp"),
+                ],
+            },
+        ),
+        migrations.RunPython(build_prefixes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:09
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0012_entryprefix"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RequestProfile",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ("method", models.CharField(max_length=8)),
+                ("path", models.CharField(max_length=2048)),
+                ("status_code", models.PositiveSmallIntegerField()),
+                ("duration_ms", models.FloatField()),
+                (
+                    "trigger",
+                    models.CharField(choices=[("requested", "Requested"), ("sampled", "Sampled")], max_length=16),
+                ),
+                ("format", models.CharField(choices=[("pstats", "Pstats"), ("collapsed", "Collapsed")], max_length=16)),
+                ("data", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "ordering": ["-created_at"],
+            },
+        ),
+    ]
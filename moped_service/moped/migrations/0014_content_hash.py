@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:30
+
+import hashlib
+from datetime import timezone as dt_timezone
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def _content_hash(entry):
+    """moped.models.content_hash() as of this migration, frozen so later changes to it do not alter the backfill"""
+    text = "\x1f".join(
+        (
+            entry.timestamp.astimezone(dt_timezone.utc).isoformat(),
+            repr(float(entry.odometer_km)),
+            repr(float(entry.fuel_liters)),
+            "" if entry.cost_per_liter is None else f"{entry.cost_per_liter:.2f}",
+            "" if entry.total_spend is None else f"{entry.total_spend:.2f}",
+            entry.notes,
+        )
+    )
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def hash_entries(apps, schema_editor):
+    """Hash the entries synced before hashes were stored, so the next sync does not rewrite them all"""
+    FuelEntry = apps.get_model("moped", "FuelEntry")
+    batch = []
+    for entry in FuelEntry.objects.only(
+        "timestamp", "odometer_km", "fuel_liters", "cost_per_liter", "total_spend", "notes"
+    ).iterator(chunk_size=BATCH_SIZE):
+        entry.content_hash = _content_hash(entry)
+        batch.append(entry)
+        if len(batch) == BATCH_SIZE:
+            FuelEntry.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    if batch:
+        FuelEntry.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0013_requestprofile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fuelentry",
+            name="content_hash",
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name="synccursor",
+            name="range_digest",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(hash_entries, migrations.RunPython.noop),
+    ]
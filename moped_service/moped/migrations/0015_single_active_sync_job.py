@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:42
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_extra_active_jobs(apps, schema_editor):
+    """Keep only the oldest pending/running job, as claims already did, so the constraint can be added"""
+    SyncJob = apps.get_model("moped", "SyncJob")
+    active = SyncJob.objects.filter(status__in=["pending", "running"]).order_by("created_at")
+    extra = list(active.values_list("pk", flat=True)[1:])
+    SyncJob.objects.filter(pk__in=extra).update(
+        status="failed", error="Superseded: another sync was already in flight", finished_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0014_content_hash"),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_extra_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="syncjob",
+            constraint=models.UniqueConstraint(
+                models.Value(True),
+                condition=models.Q(("status__in", ["pending", "running"])),
+                name="single_active_sync_job",
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:55
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_end_timestamps(apps, schema_editor):
+    """Fill the column for segments stored before it existed"""
+    FuelEntry = apps.get_model("moped", "FuelEntry")
+    FillupSegment = apps.get_model("moped", "FillupSegment")
+    FillupSegment.objects.update(
+        timestamp=Subquery(FuelEntry.objects.filter(pk=OuterRef("end_entry_id")).values("timestamp")[:1])
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0015_single_active_sync_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fillupsegment",
+            name="timestamp",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(copy_end_timestamps, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="fillupsegment",
+            name="timestamp",
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name="fillupsegment",
+            index=models.Index(fields=["timestamp", "odometer_km"], name="fillupsegment_timestamp"),
+        ),
+    ]
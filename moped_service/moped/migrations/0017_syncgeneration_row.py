@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:05
+
+import uuid
+
+from django.db import migrations
+
+
+def create_generation(apps, schema_editor):
+    """Create the single SyncGeneration row, so reading it never has to write"""
+    SyncGeneration = apps.get_model("moped", "SyncGeneration")
+    SyncGeneration.objects.get_or_create(pk=1, defaults={"token": uuid.uuid4().hex})
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0016_fillupsegment_timestamp"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_generation, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0017_syncgeneration_row"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="syncgeneration",
+            name="stale_from",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="syncgeneration",
+            name="stale_from_km",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="syncgeneration",
+            name="stale_to",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="syncgeneration",
+            name="stale_to_km",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:03
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def accumulate_liters(apps, schema_editor):
+    """Recompute the running liters exactly; the float sums they were kept as carried rounding drift"""
+    EntryPrefix = apps.get_model("moped", "EntryPrefix")
+    fuel = Decimal("0")
+    batch = []
+    prefixes = EntryPrefix.objects.select_related("entry").order_by("odometer_km", "entry_id")
+    for prefix in prefixes.iterator(chunk_size=BATCH_SIZE):
+        fuel += Decimal(str(prefix.entry.fuel_liters))
+        prefix.cumulative_fuel_liters = fuel
+        batch.append(prefix)
+        if len(batch) == BATCH_SIZE:
+            EntryPrefix.objects.bulk_update(batch, ["cumulative_fuel_liters"])
+            batch = []
+    if batch:
+        EntryPrefix.objects.bulk_update(batch, ["cumulative_fuel_liters"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("moped", "0018_syncgeneration_stale"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="entryprefix",
+            name="cumulative_fuel_liters",
+            field=models.DecimalField(decimal_places=3, max_digits=14),
+        ),
+        migrations.RunPython(accumulate_liters, migrations.RunPython.noop),
+    ]
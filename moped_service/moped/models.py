@@ -1,6 +1,26 @@
+import hashlib
+import uuid
+from datetime import timezone as dt_timezone
+
 from django.db import models
 
 
+def content_hash(timestamp, odometer_km, fuel_liters, cost_per_liter, total_spend, notes):
+    """Hash of an entry's values as stored, for telling whether a sheet row changed without reading it back.
+    Timestamps are hashed in UTC and amounts at two decimal places, as the database holds them."""
+    text = "\x1f".join(
+        (
+            timestamp.astimezone(dt_timezone.utc).isoformat(),
+            repr(float(odometer_km)),
+            repr(float(fuel_liters)),
+            "" if cost_per_liter is None else f"{cost_per_liter:.2f}",
+            "" if total_spend is None else f"{total_spend:.2f}",
+            notes,
+        )
+    )
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
 class FuelEntry(models.Model):
     """Model to cache fuel entries from Google Sheets"""
 
@@ -10,9 +30,242 @@ class FuelEntry(models.Model):
     cost_per_liter = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     total_spend = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     notes = models.TextField(blank=True)
+    # content_hash() of the fields above, kept current by save() and the sync's bulk writes
+    content_hash = models.CharField(max_length=32, blank=True, editable=False)
 
     class Meta:
         ordering = ["-timestamp"]
+        constraints = [
+            # A sheet row is identified by when it was submitted and the odometer reading
+            models.UniqueConstraint(fields=["timestamp", "odometer_km"], name="unique_fuel_entry_reading"),
+        ]
+        indexes = [
+            # Keyset pagination and exports walk the table in (timestamp, id) order
+            models.Index(fields=["timestamp", "id"], name="fuelentry_timestamp_id"),
+            # Odometer-ordered walks (fillup pairs, segment windows) restricted to a time range
+            models.Index(fields=["odometer_km", "timestamp"], name="fuelentry_odometer_timestamp"),
+        ]
 
     def __str__(self):
         return f"{self.timestamp.date()} - {self.odometer_km}km"
+
+    def save(self, *args, **kwargs):
+        self.content_hash = content_hash(
+            self.timestamp, self.odometer_km, self.fuel_liters, self.cost_per_liter, self.total_spend, self.notes
+        )
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "content_hash"}
+        super().save(*args, **kwargs)
+
+
+class SyncCursor(models.Model):
+    """How far into a sheet range previous syncs have read.
+    Form responses are append-only, so later syncs only fetch rows past this point."""
+
+    spreadsheet_id = models.CharField(max_length=255)
+    range_name = models.CharField(max_length=255)
+    rows_ingested = models.PositiveIntegerField(default=0)
+    tail_fingerprint = models.CharField(max_length=64, blank=True)
+    # strptime format of the sheet's timestamps, detected when the whole range is read
+    timestamp_format = models.CharField(max_length=32, blank=True)
+    # Fingerprint of the whole range as last read and written, cleared once rows are appended without a full read
+    range_digest = models.CharField(max_length=64, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["spreadsheet_id", "range_name"], name="unique_sync_cursor_source"),
+        ]
+
+    def __str__(self):
+        return f"{self.range_name} - {self.rows_ingested} rows"
+
+
+class FillupSegment(models.Model):
+    """Stats for the stretch driven between two consecutive fuel entries (by odometer).
+    Derived from FuelEntry and kept up to date by the sync pipeline."""
+
+    start_entry = models.ForeignKey(FuelEntry, on_delete=models.CASCADE, related_name="+")
+    end_entry = models.OneToOneField(FuelEntry, on_delete=models.CASCADE, related_name="segment")
+    odometer_km = models.FloatField(db_index=True)  # at end_entry
+    date = models.DateField(db_index=True)
+    # end_entry's timestamp, so ?from=&to= select segments without joining the entries
+    timestamp = models.DateTimeField()
+    distance_km = models.FloatField()
+    fuel_liters = models.FloatField()
+    l_per_100km = models.FloatField()
+    cost = models.FloatField(null=True, blank=True)
+    cost_per_km = models.FloatField(null=True, blank=True)
+    days = models.IntegerField()
+
+    class Meta:
+        ordering = ["odometer_km", "end_entry_id"]
+        indexes = [
+            models.Index(fields=["timestamp", "odometer_km"], name="fillupsegment_timestamp"),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.distance_km}km"
+
+    def as_pair(self):
+        """Same shape as calculations.fillup_pairs() items"""
+        return {
+            "date": self.date.isoformat(),
+            "distance_km": self.distance_km,
+            "fuel_liters": self.fuel_liters,
+            "l_per_100km": self.l_per_100km,
+            "cost": self.cost,
+            "cost_per_km": self.cost_per_km,
+            "days": self.days,
+        }
+
+
+class EntryPrefix(models.Model):
+    """Running fuel and spend totals over every entry in odometer order, up to and including `entry`.
+
+    The totals between two entries are the difference of their rows (the
+    odometer reading is already the running distance), so any window costs
+    two index lookups. Derived from FuelEntry and kept up to date by the sync pipeline."""
+
+    entry = models.OneToOneField(FuelEntry, on_delete=models.CASCADE, related_name="prefix")
+    odometer_km = models.FloatField()
+    timestamp = models.DateTimeField()
+    # Decimal, so the difference of two rows is exact however large the running totals grow
+    cumulative_fuel_liters = models.DecimalField(max_digits=14, decimal_places=3)
+    cumulative_spend = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        ordering = ["odometer_km", "entry_id"]
+        indexes = [
+            models.Index(fields=["odometer_km", "entry"], name="entryprefix_odometer"),
+            models.Index(fields=["timestamp", "odometer_km"], name="entryprefix_timestamp"),
+        ]
+
+    def __str__(self):
+        return f"{self.odometer_km}km - {self.cumulative_fuel_liters}L"
+
+
+class MonthlyRollup(models.Model):
+    """Per-month totals derived from FuelEntry and FillupSegment.
+    The sync pipeline recomputes only the months it touched."""
+
+    month = models.CharField(max_length=7, unique=True)  # "2025-01"
+
+    # Sums over the segments ending in the month (what /monthly/ reports)
+    segment_count = models.PositiveIntegerField(default=0)
+    distance_km = models.FloatField(default=0)
+    fuel_liters = models.FloatField(default=0)
+    cost = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    # calculations.entry_totals() over the entries recorded in the month (what /efficiency/?month= reports);
+    # null when the month has too few entries
+    entry_distance_km = models.FloatField(null=True, blank=True)
+    entry_fuel_liters = models.FloatField(null=True, blank=True)
+    entry_total_spend = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["month"]
+
+    def __str__(self):
+        return self.month
+
+    def entry_totals(self):
+        if self.entry_distance_km is None:
+            return None
+        return {
+            "distance_km": self.entry_distance_km,
+            "fuel_liters": self.entry_fuel_liters,
+            "total_spend": self.entry_total_spend,
+        }
+
+
+def _new_generation_token():
+    return uuid.uuid4().hex
+
+
+class SyncGeneration(models.Model):
+    """Single row bumped whenever a sync changes data. Cached responses are keyed on it.
+    The random token changes on every bump too, so a recreated database never reuses old cache keys."""
+
+    value = models.PositiveBigIntegerField(default=0)
+    token = models.CharField(max_length=32, default=_new_generation_token)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Odometer and time range of entries written since the derived tables were last refreshed, all null when
+    # they are current. Widened in the same transaction as each write and cleared once the refresh has committed,
+    # so a sync that fails part way is caught up by the next one.
+    stale_from_km = models.FloatField(null=True, blank=True)
+    stale_to_km = models.FloatField(null=True, blank=True)
+    stale_from = models.DateTimeField(null=True, blank=True)
+    stale_to = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"generation {self.value}"
+
+    @property
+    def key(self):
+        return f"{self.value}.{self.token}"
+
+
+class SyncJob(models.Model):
+    """A sync from Google Sheets running (or run) in the background"""
+
+    class Status(models.TextChoices):
+        PENDING = "pending"
+        RUNNING = "running"
+        SUCCEEDED = "succeeded"
+        FAILED = "failed"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    full = models.BooleanField(default=False)
+    created = models.PositiveIntegerField(null=True, blank=True)
+    updated = models.PositiveIntegerField(null=True, blank=True)
+    unchanged = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        constraints = [
+            # At most one job pending or running, enforced by the database so it holds across processes
+            models.UniqueConstraint(
+                models.Value(True),
+                condition=models.Q(status__in=["pending", "running"]),
+                name="single_active_sync_job",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d %H:%M} - {self.status}"
+
+
+class RequestProfile(models.Model):
+    """A request profile captured by moped.profiling.ProfilingMiddleware"""
+
+    class Trigger(models.TextChoices):
+        REQUESTED = "requested"  # a staff user asked for it
+        SAMPLED = "sampled"  # picked at random (PROFILE_SAMPLE_RATE)
+
+    class Format(models.TextChoices):
+        PSTATS = "pstats"  # marshalled cProfile stats, as written by Profile.dump_stats()
+        COLLAPSED = "collapsed"  # "outer;...;inner count" lines, as read by flamegraph.pl
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    method = models.CharField(max_length=8)
+    path = models.CharField(max_length=2048)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    trigger = models.CharField(max_length=16, choices=Trigger.choices)
+    format = models.CharField(max_length=16, choices=Format.choices)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"{self.created_at:%Y-%m-%d %H:%M} - {self.method} {self.path}"
@@ -0,0 +1,76 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class EntryPagination(PageNumberPagination):
+    """Page-number pagination, plus a keyset mode for walking the whole table.
+
+    ?pagination=cursor (or any ?cursor=) switches to keyset paging on
+    (timestamp, id), newest first. Each page is a single indexed range
+    query with no COUNT(*) or OFFSET, so deep pages cost the same as the first.
+    The response has `next` and `results` only. Keyset paging walks
+    FuelEntry columns, so it applies to the entry list alone; other actions
+    that paginate (e.g. fillups) always page by number."""
+
+    cursor_query_param = "cursor"
+    mode_query_param = "pagination"
+    invalid_cursor_message = "Invalid cursor"
+
+    def _keyset_mode(self, request, view):
+        if getattr(view, "action", None) != "list":
+            return False
+        return self.cursor_query_param in request.query_params or (
+            request.query_params.get(self.mode_query_param) == "cursor"
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self._keyset_mode(request, view)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by("-timestamp", "-id")
+        position = self.decode_cursor(request)
+        if position is not None:
+            timestamp, pk = position
+            queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+        # One extra row tells us whether there is a next page
+        rows = list(queryset[: page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page_rows = rows[:page_size]
+        return self.page_rows
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            timestamp, pk = base64.urlsafe_b64decode(encoded.encode()).decode().rsplit("|", 1)
+            return datetime.fromisoformat(timestamp), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, entry):
+        """Cursor after `entry`, a model instance or a named values_list() row"""
+        return base64.urlsafe_b64encode(f"{entry.timestamp.isoformat()}|{entry.id}".encode()).decode()
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page_rows[-1]))
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({"next": self.get_next_link(), "results": data})
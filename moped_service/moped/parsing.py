@@ -0,0 +1,151 @@
+"""Turning raw sheet rows into field values.
+
+A sheet's timestamps all come from the same Google Forms locale, so the
+format is detected once from a sample of rows rather than tried row by row.
+Timestamps and numbers are checked against compiled patterns up front;
+rows that do not fit are counted by reason instead of raising.
+"""
+
+import calendar
+import re
+from collections import Counter
+from datetime import datetime
+
+# Formats Google Forms writes timestamps in, in order of preference when a sample is ambiguous
+TIMESTAMP_FORMATS = ("%d/%m/%Y %H:%M:%S", "%m/%d/%Y %H:%M:%S")
+
+# Positions of the day and month among the first two date fields, per format
+_DAY_MONTH = {
+    "%d/%m/%Y %H:%M:%S": (0, 1),
+    "%m/%d/%Y %H:%M:%S": (1, 0),
+}
+
+TIMESTAMP_PATTERN = re.compile(r"(\d{1,2})/(\d{1,2})/(\d{4})\s+(\d{1,2}):(\d{1,2}):(\d{1,2})")
+NUMBER_PATTERN = re.compile(r"\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\s*")
+
+# Rows looked at when detecting a sheet's timestamp format
+DETECTION_SAMPLE = 500
+PARSE_CHUNK_SIZE = 5_000
+
+# Rejection reasons, also used as the metric label
+TOO_SHORT = "too_short"
+INVALID_TIMESTAMP = "invalid_timestamp"
+INVALID_NUMBER = "invalid_number"
+
+_DAYS_IN_MONTH = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _build_timestamp(fields, day_index, month_index):
+    """datetime from the six matched fields, or None if they are out of range"""
+    year, hour, minute, second = fields[2], fields[3], fields[4], fields[5]
+    day, month = fields[day_index], fields[month_index]
+    if not 1 <= month <= 12 or year < 1 or hour > 23 or minute > 59 or second > 59:
+        return None
+    if not 1 <= day <= _DAYS_IN_MONTH[month] or (month == 2 and day == 29 and not calendar.isleap(year)):
+        return None
+    return datetime(year, month, day, hour, minute, second)
+
+
+def _is_number(value):
+    """Whether float() accepts `value` as a plain decimal number"""
+    # Most cells are unsigned decimals; only the rest go through the full pattern
+    return value.replace(".", "", 1).isdecimal() or NUMBER_PATTERN.fullmatch(value) is not None
+
+
+def _timestamp_fields(value):
+    match = TIMESTAMP_PATTERN.fullmatch(value)
+    if match is None:
+        return None
+    return tuple(map(int, match.groups()))
+
+
+def detect_timestamp_format(rows, sample=DETECTION_SAMPLE):
+    """The format in TIMESTAMP_FORMATS that parses the most timestamps among
+    the first `sample` rows. Ties go to the earlier format."""
+    counts = dict.fromkeys(TIMESTAMP_FORMATS, 0)
+    for row in rows[:sample]:
+        fields = _timestamp_fields(row[0]) if row else None
+        if fields is None:
+            continue
+        for fmt in TIMESTAMP_FORMATS:
+            if _build_timestamp(fields, *_DAY_MONTH[fmt]) is not None:
+                counts[fmt] += 1
+    return max(TIMESTAMP_FORMATS, key=counts.__getitem__)
+
+
+class RowParser:
+    """Parses the rows of one sheet.
+
+    Timestamps are read in `timestamp_format` first; one that only fits
+    another known format is still accepted. `parsed` and `rejected`
+    (a Counter keyed by reason) accumulate over every row handled."""
+
+    def __init__(self, timestamp_format=TIMESTAMP_FORMATS[0]):
+        self.timestamp_format = timestamp_format
+        self._orders = [_DAY_MONTH[timestamp_format]] + [
+            _DAY_MONTH[fmt] for fmt in TIMESTAMP_FORMATS if fmt != timestamp_format
+        ]
+        self.parsed = 0
+        self.rejected = Counter()
+
+    @classmethod
+    def for_rows(cls, rows):
+        """A parser for the format detected from `rows`"""
+        return cls(detect_timestamp_format(rows))
+
+    def parse_timestamp(self, value):
+        """Naive datetime, or None if `value` is not a known timestamp format"""
+        fields = _timestamp_fields(value)
+        if fields is None:
+            return None
+        for day_index, month_index in self._orders:
+            timestamp = _build_timestamp(fields, day_index, month_index)
+            if timestamp is not None:
+                return timestamp
+        return None
+
+    def parse_row(self, row):
+        """Parse a single spreadsheet row into field values.
+        Returns a dict of fields, or None (counted in `rejected`) if the row is malformed."""
+        if len(row) < 3:
+            self.rejected[TOO_SHORT] += 1
+            return None
+        timestamp = self.parse_timestamp(row[0])
+        if timestamp is None:
+            self.rejected[INVALID_TIMESTAMP] += 1
+            return None
+
+        cost_per_liter = row[3] if len(row) > 3 and row[3] else None
+        total_spend = row[4] if len(row) > 4 and row[4] else None
+        if not (
+            _is_number(row[1])
+            and _is_number(row[2])
+            and (cost_per_liter is None or _is_number(cost_per_liter))
+            and (total_spend is None or _is_number(total_spend))
+        ):
+            self.rejected[INVALID_NUMBER] += 1
+            return None
+
+        self.parsed += 1
+        return {
+            "timestamp": timestamp,
+            "odometer_km": float(row[1]),
+            "fuel_liters": float(row[2]),
+            "cost_per_liter": float(cost_per_liter) if cost_per_liter is not None else None,
+            "total_spend": float(total_spend) if total_spend is not None else None,
+            "notes": row[5] if len(row) > 5 else "",
+        }
+
+    def parse_chunk(self, rows):
+        """Parsed values of `rows`, malformed rows left out"""
+        parse_row = self.parse_row
+        return [parsed for parsed in map(parse_row, rows) if parsed is not None]
+
+    def parse(self, rows, chunk_size=PARSE_CHUNK_SIZE):
+        """Yield parsed rows, working through `rows` a chunk at a time"""
+        for start in range(0, len(rows), chunk_size):
+            yield from self.parse_chunk(rows[start : start + chunk_size])
+
+    @property
+    def rejected_total(self):
+        return sum(self.rejected.values())
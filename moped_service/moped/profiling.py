@@ -0,0 +1,150 @@
+"""On-demand request profiling.
+
+ProfilingMiddleware profiles a request when a staff user asks for it, with
+an `X-Moped-Profile` header or a `?profile=` query parameter, or at random
+for a PROFILE_SAMPLE_RATE fraction of requests. The value picks the
+profiler: "cprofile" records every call (downloaded as a pstats file, for
+`python -m pstats` or snakeviz), "sampler" records the thread's stack every
+few milliseconds (downloaded as collapsed stacks, for flamegraph.pl or
+speedscope); anything else uses PROFILER.
+
+Profiles are stored as RequestProfile rows, the newest PROFILES_KEPT kept,
+and served to admins at /api/profiles/. With PROFILING off the middleware
+removes itself from the chain when Django starts, so it costs nothing.
+A streamed response is profiled up to the point its content starts.
+"""
+
+import cProfile
+import logging
+import marshal
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError
+
+from .models import RequestProfile
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Moped-Profile"
+PROFILE_PARAM = "profile"
+
+
+class CallProfiler:
+    """Deterministic profiling with cProfile; dumps in the pstats file format"""
+
+    format = RequestProfile.Format.PSTATS
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def runcall(self, function, *args):
+        return self.profiler.runcall(function, *args)
+
+    def dump(self):
+        self.profiler.create_stats()
+        return marshal.dumps(self.profiler.stats)
+
+
+def _frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+class StackSampler:
+    """Statistical profiling: a background thread records the calling
+    thread's stack every `interval` seconds. Dumps collapsed stacks, one
+    "outer;...;inner count" line per distinct stack."""
+
+    format = RequestProfile.Format.COLLAPSED
+
+    def __init__(self, interval=None):
+        self.interval = interval or settings.MOPED_PROFILE_SAMPLER_INTERVAL
+        self.stacks = Counter()
+        self._stop = threading.Event()
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def runcall(self, function, *args):
+        sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), name="moped-profiler", daemon=True
+        )
+        sampler.start()
+        try:
+            return function(*args)
+        finally:
+            self._stop.set()
+            sampler.join()
+
+    def dump(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items())).encode()
+
+
+PROFILERS = {"cprofile": CallProfiler, "sampler": StackSampler}
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        if not settings.MOPED_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def _trigger(self, request):
+        """(trigger, profiler name) if this request is to be profiled, else None"""
+        flag = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+        if flag:
+            # Only consults the session when asked, and only staff may ask
+            user = getattr(request, "user", None)
+            if user is not None and user.is_staff:
+                return RequestProfile.Trigger.REQUESTED, flag if flag in PROFILERS else settings.MOPED_PROFILER
+        if random.random() < settings.MOPED_PROFILE_SAMPLE_RATE:
+            return RequestProfile.Trigger.SAMPLED, settings.MOPED_PROFILER
+        return None
+
+    def __call__(self, request):
+        trigger = self._trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+
+        profiler = PROFILERS[trigger[1]]()
+        start = time.perf_counter()
+        try:
+            response = profiler.runcall(self.get_response, request)
+        except ValueError:
+            # Another profiler is already active on this interpreter (Python 3.12+ allows only one)
+            logger.warning("Could not profile %s %s: a profiler is already running", request.method, request.path)
+            return self.get_response(request)
+        duration = time.perf_counter() - start
+        self._save(request, response, trigger[0], profiler, duration)
+        return response
+
+    def _save(self, request, response, trigger, profiler, duration):
+        try:
+            profile = RequestProfile.objects.create(
+                method=request.method,
+                path=request.get_full_path()[:2048],
+                status_code=response.status_code,
+                duration_ms=duration * 1000,
+                trigger=trigger,
+                format=profiler.format,
+                data=profiler.dump(),
+            )
+            stale = RequestProfile.objects.values_list("pk", flat=True)[settings.MOPED_PROFILES_KEPT :]
+            RequestProfile.objects.filter(pk__in=list(stale)).delete()
+        except DatabaseError as e:
+            # Profiling must never break the request it observed
+            logger.warning("Could not store profile of %s %s: %s", request.method, request.path, e)
+            return
+        response["X-Moped-Profile-Id"] = str(profile.pk)
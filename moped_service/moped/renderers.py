@@ -0,0 +1,82 @@
+import csv
+import io
+import json
+import logging
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised only without orjson
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _orjson_engine():
+    """orjson if JSON_ENGINE=orjson and it is installed, else None"""
+    if settings.MOPED_JSON_ENGINE != "orjson":
+        return None
+    if orjson is None:
+        logger.warning("JSON_ENGINE=orjson but orjson is not installed; using json")
+    return orjson
+
+
+class FastJSONRenderer(JSONRenderer):
+    """DRF's JSONRenderer, encoding with orjson when JSON_ENGINE=orjson.
+
+    The bytes match JSONRenderer's compact output, except that floats below
+    1e-4 or from 1e16 up are written as 1e-5 rather than 1e-05 (none of this
+    API's values are). Types orjson does not handle natively go through
+    DRF's encoder, so dates, decimals and lazy strings come out the same.
+    Indented output (the browsable API, `; indent=` media types) uses json."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        engine = _orjson_engine()
+        if engine is None or data is None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        options = engine.OPT_PASSTHROUGH_DATETIME | engine.OPT_NON_STR_KEYS
+        try:
+            rendered = engine.dumps(data, default=self.encoder_class().default, option=options)
+        except engine.JSONEncodeError:
+            # e.g. integers beyond 64 bits, which json handles
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like JSONRenderer, escape the two line separators JavaScript does not accept in strings
+        return rendered.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline-delimited JSON, one object per line.
+    Exports stream their rows directly; this only renders non-streamed (e.g. error) responses."""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return (json.dumps(data, cls=JSONEncoder) + "\n").encode()
+
+
+class CSVRenderer(BaseRenderer):
+    """CSV with a header row. Like NDJSONRenderer, only used directly for non-streamed responses."""
+
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not data:
+            return b""
+        rows = data if isinstance(data, list) else [data]
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode()
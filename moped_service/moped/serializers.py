@@ -1,9 +1,103 @@
-from rest_framework import serializers
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
-from .models import FuelEntry
+from .models import FuelEntry, RequestProfile, SyncJob
 
 
 class FuelEntrySerializer(serializers.ModelSerializer):
     class Meta:
         model = FuelEntry
         fields = ["id", "timestamp", "odometer_km", "fuel_liters", "cost_per_liter", "total_spend", "notes"]
+
+
+def _iso_datetime(field):
+    """DateTimeField.to_representation for aware datetimes in ISO 8601, without the per-call setting lookups"""
+    field_timezone = field.timezone if hasattr(field, "timezone") else field.default_timezone()
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if field_timezone is None or output_format is None or output_format.lower() != ISO_8601:
+        return field.to_representation
+
+    def convert(value):
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+    return convert
+
+
+def _decimal_string(field, model_field):
+    """DecimalField.to_representation for values the database already rounded to the field's places"""
+    coerce_to_string = getattr(field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.decimal_places != model_field.decimal_places:
+        return field.to_representation
+    return "{:f}".format
+
+
+def _converter(field, model_field):
+    """A function turning a database value into the field's representation, or None if it already is one"""
+    # The database already returns ints, floats and strs for these model fields
+    if type(field) in (serializers.IntegerField, serializers.FloatField, serializers.CharField):
+        return None
+    if type(field) is serializers.DateTimeField:
+        return _iso_datetime(field)
+    if type(field) is serializers.DecimalField:
+        return _decimal_string(field, model_field)
+    return field.to_representation
+
+
+class ValuesSerializer:
+    """Fast read path for a ModelSerializer made of plain model fields.
+
+    Serializes values_list() rows instead of model instances: the columns
+    and a converter per field are worked out once, and fields the database
+    already returns in their final form are copied as they are. The output
+    is the same as serializer_class(instance).data, key for key."""
+
+    def __init__(self, serializer_class):
+        fields = serializer_class().fields
+        model = serializer_class.Meta.model
+        self.names = tuple(fields)
+        self.columns = tuple(field.source for field in fields.values())
+        self.converters = []
+        for name, field in fields.items():
+            convert = _converter(field, model._meta.get_field(field.source))
+            if convert is not None:
+                self.converters.append((name, convert))
+
+    def rows(self, queryset):
+        """`queryset` as named values_list() rows with the serializer's columns"""
+        return queryset.values_list(*self.columns, named=True)
+
+    def to_representation(self, row):
+        data = dict(zip(self.names, row))
+        for name, convert in self.converters:
+            value = data[name]
+            if value is not None:
+                data[name] = convert(value)
+        return data
+
+    def many(self, rows):
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
+
+
+class SyncJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SyncJob
+        fields = [
+            "id",
+            "status",
+            "full",
+            "created",
+            "updated",
+            "unchanged",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+
+
+class RequestProfileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RequestProfile
+        fields = ["id", "method", "path", "status_code", "duration_ms", "trigger", "format", "created_at"]
@@ -1,81 +1,241 @@
+import hashlib
+import json
 import logging
-from datetime import datetime
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import NamedTuple
 
 from decouple import config
-from django.db import transaction
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from django.conf import settings
 
-from .models import FuelEntry
+from .derived import refresh_derived
+from .ingest import SyncResult, upsert_entries
+from .metrics import sync_phase_seconds, sync_ranges_skipped_total, sync_rows_rejected_total, sync_rows_total, timed
+from .models import SyncCursor
+from .parsing import RowParser, detect_timestamp_format
+from .sheets import get_client
 
 logger = logging.getLogger(__name__)
 
+# "Form Responses 1!A2:E" -> sheet, first column, first row, last column
+RANGE_PATTERN = re.compile(r"^(?P<sheet>.+)!(?P<start_col>[A-Z]+)(?P<start_row>\d+):(?P<end_col>[A-Z]+)$")
+
+# How many already-ingested rows are re-read to check that nothing before the cursor was edited
+TAIL_ROWS = 5
+
+
+def rows_fingerprint(rows):
+    """Stable hash of raw sheet rows"""
+    return hashlib.sha256(json.dumps(rows).encode()).hexdigest()
+
+
+class SheetSource(NamedTuple):
+    spreadsheet_id: str
+    range_name: str
+
+    def __str__(self):
+        return f"{self.spreadsheet_id}/{self.range_name}"
+
+
+class _FetchPlan(NamedTuple):
+    source: SheetSource
+    range_name: str
+    offset: int
+    tail_size: int
+    fingerprint: str
+
+
+def parse_sources(value):
+    """Parse GOOGLE_SHEET_SOURCES: `spreadsheet_id:range` entries separated by `;`.
+    Spreadsheet IDs never contain a colon, so the range may."""
+    sources = []
+    for entry in value.split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        spreadsheet_id, separator, range_name = entry.partition(":")
+        if not separator or not spreadsheet_id.strip() or not range_name.strip():
+            raise ValueError(f"Invalid sheet source {entry!r}, expected 'spreadsheet_id:range'")
+        sources.append(SheetSource(spreadsheet_id.strip(), range_name.strip()))
+    return sources
+
+
+def _range_from_row(range_name, offset):
+    """`range_name`, starting `offset` rows below its first row.
+    Returns None if the range has no explicit start row."""
+    match = RANGE_PATTERN.match(range_name)
+    if match is None:
+        return None
+    start_row = int(match["start_row"]) + offset
+    return f"{match['sheet']}!{match['start_col']}{start_row}:{match['end_col']}"
+
+
 class GoogleSheetsService:
     """Service to interact with Google Sheets"""
 
-    def __init__(self):
-        self.spreadsheet_id = config("GOOGLE_SHEET_ID")
-        self.range_name = config("GOOGLE_SHEET_RANGE", default="Form Responses 1!A2:E")
+    def __init__(self, service=None, spreadsheet_id=None, range_name=None, sources=None, client=None):
+        """Pass `service` (anything shaped like the Sheets API client) to skip
+        loading credentials, e.g. for benchmarks against a stub, or `client`
+        (a sheets.SheetsClient) to use something other than the shared client.
 
-        # Load credentials from service account JSON
-        credentials = service_account.Credentials.from_service_account_file(
-            config("GOOGLE_SERVICE_ACCOUNT_FILE"), scopes=["https://www.googleapis.com/auth/spreadsheets.readonly"]
-        )
+        Sources default to GOOGLE_SHEET_SOURCES, or the single
+        GOOGLE_SHEET_ID/GOOGLE_SHEET_RANGE pair when that is not set."""
+        if sources is None:
+            if spreadsheet_id is None and range_name is None and settings.MOPED_SHEET_SOURCES:
+                sources = parse_sources(settings.MOPED_SHEET_SOURCES)
+            else:
+                sources = [
+                    SheetSource(
+                        spreadsheet_id or config("GOOGLE_SHEET_ID"),
+                        range_name or config("GOOGLE_SHEET_RANGE", default="Form Responses 1!A2:E"),
+                    )
+                ]
+        self.sources = list(sources)
 
-        self.service = build("sheets", "v4", credentials=credentials)
+        self.client = None
+        if service is None:
+            # Shared by every sync in the process: credentials, token and connections are reused
+            self.client = client or get_client(config("GOOGLE_SERVICE_ACCOUNT_FILE"))
+            service = self.client.resource
 
-    def _parse_timestamp(self, value):
-        """Parse timestamp, trying multiple date formats"""
-        for fmt in ("%d/%m/%Y %H:%M:%S", "%m/%d/%Y %H:%M:%S"):
-            try:
-                return datetime.strptime(value, fmt)
-            except ValueError:
-                continue
-        raise ValueError(f"Unable to parse timestamp: {value}")
+        self.service = service
 
     def _parse_row(self, row):
-        """Parse a single spreadsheet row into field values.
+        """Parse a single spreadsheet row into field values, trying each known timestamp format.
         Returns a dict of fields, or None if the row is malformed."""
-        if len(row) < 3:
-            return None
-        try:
-            return {
-                "timestamp": self._parse_timestamp(row[0]),
-                "odometer_km": float(row[1]),
-                "fuel_liters": float(row[2]),
-                "cost_per_liter": float(row[3]) if len(row) > 3 and row[3] else None,
-                "total_spend": float(row[4]) if len(row) > 4 and row[4] else None,
-                "notes": row[5] if len(row) > 5 else "",
-            }
-        except (ValueError, IndexError) as e:
-            logger.warning("Skipping row due to error: %s", e)
-            return None
-
-    @transaction.atomic
-    def sync_from_sheets(self):
-        """Fetch data from Google Sheets and sync to database"""
-        sheet = self.service.spreadsheets()
-        result = sheet.values().get(spreadsheetId=self.spreadsheet_id, range=self.range_name).execute()
-
-        values = result.get("values", [])
-
-        count = 0
-        for row in values:
-            parsed = self._parse_row(row)
-            if parsed is None:
-                continue
-
-            FuelEntry.objects.update_or_create(
-                timestamp=parsed["timestamp"],
-                odometer_km=parsed["odometer_km"],
-                defaults={
-                    "fuel_liters": parsed["fuel_liters"],
-                    "cost_per_liter": parsed["cost_per_liter"],
-                    "total_spend": parsed["total_spend"],
-                    "notes": parsed["notes"],
-                },
+        return RowParser().parse_row(row)
+
+    def _execute(self, request):
+        """Run an API request, on a pooled connection unless a stub service was passed in"""
+        if self.client is None:
+            return request.execute()
+        return self.client.execute(request)
+
+    def _fetch_ranges(self, spreadsheet_id, ranges):
+        """Fetch the raw row values for each range of one spreadsheet.
+        Several ranges are fetched with a single batchGet request."""
+        values = self.service.spreadsheets().values()
+        if len(ranges) == 1:
+            result = self._execute(values.get(spreadsheetId=spreadsheet_id, range=ranges[0]))
+            return [result.get("values", [])]
+        result = self._execute(values.batchGet(spreadsheetId=spreadsheet_id, ranges=list(ranges)))
+        return [value_range.get("values", []) for value_range in result.get("valueRanges", [])]
+
+    def _plan(self, source, cursor, full=False):
+        """Decide which range to request for a source.
+
+        With a cursor, only the last few already-ingested rows plus anything
+        after them are requested."""
+        tail_size = min(TAIL_ROWS, cursor.rows_ingested)
+        offset = cursor.rows_ingested - tail_size
+        tail_range = _range_from_row(source.range_name, offset)
+        if not full and tail_size and tail_range:
+            return _FetchPlan(source, tail_range, offset, tail_size, cursor.tail_fingerprint)
+        return _FetchPlan(source, source.range_name, 0, 0, "")
+
+    @timed(sync_phase_seconds, phase="fetch")
+    def _fetch_spreadsheet(self, spreadsheet_id, plans):
+        """Fetch every planned range of one spreadsheet. Runs on a worker thread.
+
+        If a source's tail rows no longer match the stored fingerprint,
+        earlier rows were edited and its whole range is fetched again.
+        Returns (source, rows, offset, new_from) per source: the fetched rows,
+        the position of the first one within the range, and the index of the
+        first row that has not been ingested yet."""
+        fetched = []
+        resync = []
+        for plan, values in zip(plans, self._fetch_ranges(spreadsheet_id, [plan.range_name for plan in plans])):
+            if plan.tail_size and rows_fingerprint(values[: plan.tail_size]) != plan.fingerprint:
+                logger.info("Rows of %s before row %d changed, running a full resync", plan.source, plan.offset)
+                resync.append(plan.source)
+            else:
+                fetched.append((plan.source, values, plan.offset, plan.tail_size))
+
+        if resync:
+            full_values = self._fetch_ranges(spreadsheet_id, [source.range_name for source in resync])
+            fetched.extend((source, values, 0, 0) for source, values in zip(resync, full_values))
+        return fetched
+
+    def _parser_for(self, source, cursor, values, new_from):
+        """A row parser for the source's timestamp format.
+
+        The format is detected whenever the whole range was read and kept on
+        the cursor, so a tail fetch with only ambiguous dates (day <= 12) is
+        read the same way as the rows before it."""
+        if new_from == 0 or not cursor.timestamp_format:
+            cursor.timestamp_format = detect_timestamp_format(values)
+            logger.debug("Detected timestamp format %r for %s", cursor.timestamp_format, source)
+        return RowParser(cursor.timestamp_format)
+
+    def _record_rejections(self, source, parser):
+        """Log and count the rows a parser skipped, once per source rather than per row"""
+        if not parser.rejected:
+            return
+        logger.warning("Skipped %d malformed rows from %s: %s", parser.rejected_total, source, dict(parser.rejected))
+        for reason, count in parser.rejected.items():
+            sync_rows_rejected_total.labels(reason=reason).inc(count)
+
+    def _unchanged_range(self, source, cursor, values, new_from, full):
+        """Whether a whole-range read matches the range as it was last written, keeping the cursor's digest current.
+        The digest stops describing what is stored once rows are appended from a tail read, so it is dropped."""
+        if new_from:
+            if len(values) > new_from:
+                cursor.range_digest = ""
+            return False
+        digest = rows_fingerprint(values)
+        if not full and digest == cursor.range_digest:
+            return True
+        cursor.range_digest = digest
+        return False
+
+    def sync_from_sheets(self, full=False):
+        """Fetch new rows from every configured source and sync them to the database.
+        Pass full=True to ignore the sync cursors and re-read every row.
+        Returns a SyncResult with created/updated/unchanged counts.
+
+        A range read in full whose digest matches the last sync is not
+        parsed at all; otherwise only rows whose content hash changed are
+        written.
+
+        Spreadsheets are fetched concurrently on a small thread pool; each
+        one's rows are parsed and written as soon as they arrive, while the
+        others are still downloading. Database access stays on this thread.
+        Each phase is timed into moped_sync_phase_seconds."""
+        cursors = {}
+        plans = defaultdict(list)
+        for source in self.sources:
+            cursor, _ = SyncCursor.objects.get_or_create(
+                spreadsheet_id=source.spreadsheet_id, range_name=source.range_name
             )
-            count += 1
+            cursors[source] = cursor
+            plans[source.spreadsheet_id].append(self._plan(source, cursor, full=full))
+
+        result = SyncResult()
+        workers = max(1, min(settings.MOPED_SHEETS_FETCH_WORKERS, len(plans)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="moped-sheets") as pool:
+            futures = [pool.submit(self._fetch_spreadsheet, sheet_id, group) for sheet_id, group in plans.items()]
+            for future in as_completed(futures):
+                for source, values, offset, new_from in future.result():
+                    cursor = cursors[source]
+                    if self._unchanged_range(source, cursor, values, new_from, full):
+                        logger.info("%s is unchanged since the last sync, skipping it", source)
+                        sync_ranges_skipped_total.inc()
+                        continue
+                    with timed(sync_phase_seconds, phase="parse"):
+                        parser = self._parser_for(source, cursor, values, new_from)
+                        entries = list(parser.parse(values[new_from:]))
+                    with timed(sync_phase_seconds, phase="write"):
+                        result.merge(upsert_entries(entries, batch_size=settings.MOPED_SYNC_BATCH_SIZE))
+                    self._record_rejections(source, parser)
 
-        return count
+                    cursor.rows_ingested = offset + len(values)
+                    cursor.tail_fingerprint = rows_fingerprint(values[-TAIL_ROWS:])
 
+        with timed(sync_phase_seconds, phase="refresh"):
+            refresh_derived(full=full)
+        for cursor in cursors.values():
+            cursor.save()
+        for outcome, count in result.as_dict().items():
+            sync_rows_total.labels(result=outcome).inc(count)
+        return result
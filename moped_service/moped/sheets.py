@@ -0,0 +1,95 @@
+"""Process-wide Google Sheets API client.
+
+Loading the service-account file and building the API resource is slow.
+Both happen once per process and are shared by every sync. The resource is
+built from the discovery document bundled with google-api-python-client, so
+no discovery request is ever made. The access token lives on the shared
+credentials and is refreshed only when it has expired. HTTP connections are
+kept in a pool and reused across syncs; each request checks one out, because
+an httplib2 connection must not be used by two threads at once.
+
+The transport is pluggable. Pass any factory returning an httplib2.Http-like
+object, and an `api_root` (SHEETS_API_ROOT) to send requests to another
+server, e.g. a local stub in tests.
+"""
+
+import queue
+import threading
+from functools import cache
+
+import httplib2
+from django.conf import settings
+from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp, Request
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+@cache
+def discovery_document():
+    """The Sheets v4 discovery document shipped with google-api-python-client"""
+    return get_static_doc("sheets", "v4")
+
+
+class SheetsClient:
+    """Sheets API resource plus a pool of authorised HTTP connections"""
+
+    def __init__(self, credentials, transport=httplib2.Http, api_root=None):
+        self.credentials = credentials
+        self.transport = transport
+        self._connections = queue.LifoQueue()
+        self._refresh_lock = threading.Lock()
+        client_options = {"api_endpoint": api_root} if api_root else None
+        # Requests are always executed on a pooled connection, so the resource's own http is never used
+        self.resource = build_from_document(discovery_document(), http=transport(), client_options=client_options)
+
+    @classmethod
+    def from_service_account_file(cls, path, **kwargs):
+        credentials = service_account.Credentials.from_service_account_file(path, scopes=SCOPES)
+        return cls(credentials, **kwargs)
+
+    def _checkout(self):
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            return AuthorizedHttp(self.credentials, http=self.transport())
+
+    def _ensure_token(self, http):
+        """Refresh the shared access token once, rather than on every thread that notices it expired"""
+        if self.credentials.valid:
+            return
+        with self._refresh_lock:
+            if not self.credentials.valid:
+                self.credentials.refresh(Request(http.http))
+
+    def execute(self, request):
+        """Execute an API request on a pooled connection"""
+        http = self._checkout()
+        try:
+            self._ensure_token(http)
+            return request.execute(http=http)
+        finally:
+            self._connections.put(http)
+
+
+def get_client(credentials_file):
+    """The shared client for a service-account file, created on first use"""
+    with _clients_lock:
+        client = _clients.get(credentials_file)
+        if client is None:
+            client = SheetsClient.from_service_account_file(
+                credentials_file, api_root=settings.MOPED_SHEETS_API_ROOT or None
+            )
+            _clients[credentials_file] = client
+        return client
+
+
+def reset_clients():
+    """Forget every shared client, e.g. after credentials were rotated"""
+    with _clients_lock:
+        _clients.clear()
@@ -1,10 +1,94 @@
-from datetime import datetime
-from unittest.mock import MagicMock, patch
+import csv
+import importlib
+import io
+import json
+import os
+import pstats
+import random
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest.mock import patch
+from urllib.parse import parse_qs, unquote, urlsplit
 
-from django.test import TestCase
+import httplib2
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from google.auth.credentials import Credentials
+from googleapiclient.errors import HttpError
+from prometheus_client import REGISTRY
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
+from rest_framework.utils.encoders import JSONEncoder
 
-from .models import FuelEntry
+from . import vectorized
+from .benchmarks import StubSheetsClient, populate, sheet_rows, synthetic_rows
+from .calculations import (
+    cost_per_km,
+    entry_pass,
+    entry_totals,
+    fillup_pairs,
+    fuel_efficiency,
+    monthly_summary,
+    service_status,
+    summarise_months,
+)
+from .daemon import PollSchedule, SyncDaemon
+from .derived import (
+    SEGMENT_FIELDS,
+    rebuild_prefixes,
+    rebuild_rollups,
+    rebuild_segments,
+    refresh_derived,
+    refresh_segments,
+)
+from .ingest import SyncResult, upsert_entries
+from .jobs import claim_job, run_job
+from .metrics import MopedCollector
+from .models import (
+    EntryPrefix,
+    FillupSegment,
+    FuelEntry,
+    MonthlyRollup,
+    RequestProfile,
+    SyncCursor,
+    SyncGeneration,
+    SyncJob,
+    content_hash,
+)
+from .pagination import EntryPagination
+from .parsing import RowParser, detect_timestamp_format
+from .profiling import ProfilingMiddleware, StackSampler
+from .renderers import FastJSONRenderer, orjson
+from .serializers import FuelEntrySerializer, ValuesSerializer
+from .services import GoogleSheetsService, SheetSource, parse_sources
+from .sheets import SheetsClient, reset_clients
+
+
+class MopedAPITestCase(APITestCase):
+    """The SyncGeneration row outlives each test, and entries saved through the ORM only bump it once their
+    transaction commits, which never happens inside a test, so cached responses are dropped after every test"""
+
+    def tearDown(self):
+        caches[settings.MOPED_RESPONSE_CACHE].clear()
+        super().tearDown()
 
 
 class FuelEntryModelTest(TestCase):
@@ -35,8 +119,23 @@ class FuelEntryModelTest(TestCase):
         self.assertEqual(entries[0], self.entry)  # newer first
         self.assertEqual(entries[1], older)
 
+    def test_content_hash_backfill(self):
+        """The migration's frozen hash should match what save() and the sync store"""
+        migration = importlib.import_module("moped.migrations.0014_content_hash")
+        FuelEntry.objects.update(content_hash="")
+
+        migration.hash_entries(apps, None)
+
+        entry = FuelEntry.objects.get(pk=self.entry.pk)
+        self.assertEqual(
+            entry.content_hash,
+            content_hash(
+                entry.timestamp, entry.odometer_km, entry.fuel_liters, entry.cost_per_liter, entry.total_spend, ""
+            ),
+        )
+
 
-class FuelEntryAPITest(APITestCase):
+class FuelEntryAPITest(MopedAPITestCase):
     """Tests for the API endpoints"""
 
     def setUp(self):
@@ -81,47 +180,85 @@ class FuelEntryAPITest(APITestCase):
         response = self.client.get("/api/moped-entries/last-fillup/")
         self.assertEqual(response.status_code, 404)
 
+    def test_keyset_pagination_walks_all_entries(self):
+        """?pagination=cursor should page newest-first via next links without overlap"""
+        FuelEntry.objects.create(timestamp=self.entry3.timestamp, odometer_km=1121.0, fuel_liters=0.1)
+
+        with patch.object(EntryPagination, "page_size", 2):
+            response = self.client.get("/api/moped-entries/", {"pagination": "cursor"})
+            seen = [row["id"] for row in response.data["results"]]
+            self.assertNotIn("count", response.data)
+            while response.data["next"]:
+                response = self.client.get(response.data["next"])
+                seen += [row["id"] for row in response.data["results"]]
+
+        expected = list(FuelEntry.objects.order_by("-timestamp", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        """A garbled cursor should be a 404, like DRF's own cursor pagination"""
+        response = self.client.get("/api/moped-entries/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_ndjson(self):
+        """GET /export/ should stream one serialized entry per line"""
+        response = self.client.get("/api/moped-entries/export/")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.client.get("/api/moped-entries/").data["results"])
+
+    def test_export_csv(self):
+        """GET /export/?format=csv should stream a header plus one row per entry"""
+        response = self.client.get("/api/moped-entries/export/", {"format": "csv"})
+        self.assertEqual(response["Content-Type"], "text/csv")
+        rows = list(csv.DictReader(b"".join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]["odometer_km"], "1120.0")
+        self.assertEqual(rows[0]["total_spend"], "6.65")
+
+
 class SyncServiceTest(TestCase):
     """Tests for Google Sheets sync service"""
 
-    def _mock_sheets_service(self, rows):
-        """Helper: creates a mock Google Sheets service returning given rows"""
-        mock_service = MagicMock()
-        mock_service.spreadsheets().values().get().execute.return_value = {
-            "values": rows
-        }
-        return mock_service
+    def setUp(self):
+        # The API client is shared per process; start each test with a fresh (mocked) one
+        reset_clients()
+        self.addCleanup(reset_clients)
+
+    def _mock_sheets_service(self, mock_build, rows):
+        """Helper: makes the mocked Google Sheets service return the given rows"""
+        mock_build.return_value.spreadsheets().values().get().execute.return_value = {"values": rows}
 
     @patch("moped.services.config", return_value="test-value")
-    @patch("moped.services.build")
-    @patch("moped.services.service_account.Credentials.from_service_account_file")
+    @patch("moped.sheets.build_from_document")
+    @patch("moped.sheets.service_account.Credentials.from_service_account_file")
     def test_sync_creates_entries(self, mock_creds, mock_build, mock_config):
         """Sync should create FuelEntry records from sheet data"""
-        from .services import GoogleSheetsService
-
-        mock_build.return_value = self._mock_sheets_service([
-            ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
-            ["01/15/2025 10:00:00", "1050", "2.5", "1.85", "4.63"],
-        ])
+        self._mock_sheets_service(
+            mock_build,
+            [
+                ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
+                ["01/15/2025 10:00:00", "1050", "2.5", "1.85", "4.63"],
+            ],
+        )
 
         service = GoogleSheetsService()
-        count = service.sync_from_sheets()
+        result = service.sync_from_sheets()
 
-        self.assertEqual(count, 2)
+        self.assertEqual(result.total, 2)
+        self.assertEqual(result.created, 2)
         self.assertEqual(FuelEntry.objects.count(), 2)
 
     @patch("moped.services.config", return_value="test-value")
-    @patch("moped.services.build")
-    @patch("moped.services.service_account.Credentials.from_service_account_file")
+    @patch("moped.sheets.build_from_document")
+    @patch("moped.sheets.service_account.Credentials.from_service_account_file")
     def test_sync_no_duplicates(self, mock_creds, mock_build, mock_config):
         """Syncing the same data twice should not create duplicates"""
-        from .services import GoogleSheetsService
-
         rows = [
             ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
             ["01/15/2025 10:00:00", "1050", "2.5", "1.85", "4.63"],
         ]
-        mock_build.return_value = self._mock_sheets_service(rows)
+        self._mock_sheets_service(mock_build, rows)
 
         service = GoogleSheetsService()
         service.sync_from_sheets()
@@ -130,50 +267,466 @@ class SyncServiceTest(TestCase):
         self.assertEqual(FuelEntry.objects.count(), 2)  # still 2, not 4
 
     @patch("moped.services.config", return_value="test-value")
-    @patch("moped.services.build")
-    @patch("moped.services.service_account.Credentials.from_service_account_file")
+    @patch("moped.sheets.build_from_document")
+    @patch("moped.sheets.service_account.Credentials.from_service_account_file")
     def test_sync_adds_new_rows(self, mock_creds, mock_build, mock_config):
         """Syncing with new data should add new entries without losing old ones"""
-        from .services import GoogleSheetsService
-
         # First sync: 2 rows
-        mock_build.return_value = self._mock_sheets_service([
-            ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
-            ["01/15/2025 10:00:00", "1050", "2.5", "1.85", "4.63"],
-        ])
+        self._mock_sheets_service(
+            mock_build,
+            [
+                ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
+                ["01/15/2025 10:00:00", "1050", "2.5", "1.85", "4.63"],
+            ],
+        )
         service = GoogleSheetsService()
         service.sync_from_sheets()
 
         # Second sync: 3 rows (original 2 + 1 new)
-        mock_build.return_value = self._mock_sheets_service([
-            ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
-            ["01/15/2025 10:00:00", "1050", "2.5", "1.85", "4.63"],
-            ["01/20/2025 10:00:00", "1120", "3.5", "1.90", "6.65"],
-        ])
+        self._mock_sheets_service(
+            mock_build,
+            [
+                ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
+                ["01/15/2025 10:00:00", "1050", "2.5", "1.85", "4.63"],
+                ["01/20/2025 10:00:00", "1120", "3.5", "1.90", "6.65"],
+            ],
+        )
         service = GoogleSheetsService()
         service.sync_from_sheets()
 
         self.assertEqual(FuelEntry.objects.count(), 3)
 
     @patch("moped.services.config", return_value="test-value")
-    @patch("moped.services.build")
-    @patch("moped.services.service_account.Credentials.from_service_account_file")
+    @patch("moped.sheets.build_from_document")
+    @patch("moped.sheets.service_account.Credentials.from_service_account_file")
     def test_sync_skips_malformed_rows(self, mock_creds, mock_build, mock_config):
         """Rows with bad data should be skipped, good rows still saved"""
-        from .services import GoogleSheetsService
-
-        mock_build.return_value = self._mock_sheets_service([
-            ["01/10/2025 10:00:00", "1000", "3.0"],
-            ["bad-date", "nope", "nah"],  # malformed
-            ["01/15/2025 10:00:00", "1050", "2.5"],
-        ])
+        self._mock_sheets_service(
+            mock_build,
+            [
+                ["01/10/2025 10:00:00", "1000", "3.0"],
+                ["bad-date", "nope", "nah"],  # malformed
+                ["01/15/2025 10:00:00", "1050", "2.5"],
+            ],
+        )
 
         service = GoogleSheetsService()
-        count = service.sync_from_sheets()
+        result = service.sync_from_sheets()
 
-        self.assertEqual(count, 2)  # only 2 valid rows
+        self.assertEqual(result.total, 2)  # only 2 valid rows
         self.assertEqual(FuelEntry.objects.count(), 2)
 
+    @patch("moped.services.config", return_value="test-value")
+    @patch("moped.sheets.build_from_document")
+    @patch("moped.sheets.service_account.Credentials.from_service_account_file")
+    def test_sync_reports_updated_and_unchanged(self, mock_creds, mock_build, mock_config):
+        """A re-sync should only rewrite rows whose values changed"""
+        self._mock_sheets_service(
+            mock_build,
+            [
+                ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
+                ["01/15/2025 10:00:00", "1050", "2.5", "1.85", "4.63"],
+            ],
+        )
+        GoogleSheetsService().sync_from_sheets()
+
+        self._mock_sheets_service(
+            mock_build,
+            [
+                ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
+                ["01/15/2025 10:00:00", "1050", "2.6", "1.85", "4.81"],  # corrected in the sheet
+                ["01/20/2025 10:00:00", "1120", "3.5", "1.90", "6.65"],
+            ],
+        )
+        result = GoogleSheetsService().sync_from_sheets()
+
+        self.assertEqual((result.created, result.updated, result.unchanged), (1, 1, 1))
+        self.assertEqual(FuelEntry.objects.get(odometer_km=1050).fuel_liters, 2.6)
+
+    def test_upsert_writes_in_batches(self):
+        """Rows should be written in chunks of batch_size"""
+        rows = [
+            {
+                "timestamp": datetime(2025, 1, day, 10, 0),
+                "odometer_km": 1000.0 + day * 50,
+                "fuel_liters": 3.0,
+                "cost_per_liter": 1.8,
+                "total_spend": 5.4,
+                "notes": "",
+            }
+            for day in range(1, 11)
+        ]
+        # Per batch: one lookup of existing rows, then marking them stale and the insert (with their savepoint)
+        with self.assertNumQueries(4 * 5):
+            result = upsert_entries(rows, batch_size=3)
+
+        self.assertEqual(result.created, 10)
+        self.assertEqual(FuelEntry.objects.count(), 10)
+
+
+def _sheet_config(key, default=None, **kwargs):
+    """Stand-in for decouple.config with a real-looking sheet range"""
+    return {"GOOGLE_SHEET_RANGE": "Form Responses 1!A2:E"}.get(key, "test-value")
+
+
+def _whole_sheet_config(key, default=None, **kwargs):
+    """Stand-in for decouple.config with a range that has no start row, so every sync reads all of it"""
+    return {"GOOGLE_SHEET_RANGE": "Form Responses 1"}.get(key, "test-value")
+
+
+def _sheet_row(day, liters="3.0"):
+    return [f"01/{day:02d}/2025 10:00:00", str(1000 + day * 50), liters, "1.80", "5.40"]
+
+
+class IncrementalSyncTest(TestCase):
+    """Tests for cursor-based incremental sync"""
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+
+    def _sync(self, mock_build, *responses):
+        """Run one sync where successive API calls return the given row lists"""
+        values = mock_build.return_value.spreadsheets().values()
+        values.get().execute.side_effect = [{"values": rows} for rows in responses]
+        values.get.reset_mock()
+        return GoogleSheetsService().sync_from_sheets(), values.get
+
+    @patch("moped.services.config", side_effect=_sheet_config)
+    @patch("moped.sheets.build_from_document")
+    @patch("moped.sheets.service_account.Credentials.from_service_account_file")
+    def test_only_new_rows_are_fetched(self, mock_creds, mock_build, mock_config):
+        """After a full sync, only the tail and anything after it is requested"""
+        rows = [_sheet_row(day) for day in range(1, 8)]
+        self._sync(mock_build, rows)
+
+        new_row = _sheet_row(8)
+        result, get = self._sync(mock_build, rows[2:] + [new_row])
+
+        get.assert_called_once_with(spreadsheetId="test-value", range="Form Responses 1!A4:E")
+        self.assertEqual(result.created, 1)
+        self.assertEqual(result.total, 1)
+        self.assertEqual(FuelEntry.objects.count(), 8)
+
+        self.assertEqual(SyncCursor.objects.get().rows_ingested, 8)
+
+    @patch("moped.services.config", side_effect=_sheet_config)
+    @patch("moped.sheets.build_from_document")
+    @patch("moped.sheets.service_account.Credentials.from_service_account_file")
+    def test_edited_tail_triggers_full_resync(self, mock_creds, mock_build, mock_config):
+        """If already-ingested rows changed, the whole range is fetched again"""
+        rows = [_sheet_row(day) for day in range(1, 8)]
+        self._sync(mock_build, rows)
+
+        edited = rows[:6] + [_sheet_row(7, liters="3.3")]
+        result, get = self._sync(mock_build, edited[2:], edited)
+
+        self.assertEqual(get.call_count, 2)
+        self.assertEqual(get.call_args.kwargs["range"], "Form Responses 1!A2:E")
+        self.assertEqual((result.updated, result.unchanged), (1, 6))
+
+    @patch("moped.services.config", side_effect=_whole_sheet_config)
+    @patch("moped.sheets.build_from_document")
+    @patch("moped.sheets.service_account.Credentials.from_service_account_file")
+    def test_unchanged_range_is_skipped_after_fetch(self, mock_creds, mock_build, mock_config):
+        """A range read in full whose digest matches the last sync is neither parsed nor written"""
+        rows = [_sheet_row(day) for day in range(1, 8)]
+        self._sync(mock_build, rows)
+
+        with patch("moped.services.upsert_entries") as upsert:
+            result, get = self._sync(mock_build, [list(row) for row in rows])
+
+        get.assert_called_once()
+        upsert.assert_not_called()
+        self.assertEqual(result.as_dict(), {"created": 0, "updated": 0, "unchanged": 0})
+
+        edited = rows[:3] + [_sheet_row(4, liters="3.3")] + rows[4:]
+        result, _ = self._sync(mock_build, edited)
+        self.assertEqual(result.as_dict(), {"created": 0, "updated": 1, "unchanged": 6})
+
+    def test_content_hash_tracks_saved_values(self):
+        """An entry edited outside a sync is rewritten when the sheet row still differs from it"""
+        row = {
+            "timestamp": datetime(2025, 1, 10, 10, 0),
+            "odometer_km": 1000,
+            "fuel_liters": 3.0,
+            "cost_per_liter": 1.8,
+            "total_spend": 5.4,
+            "notes": "",
+        }
+        upsert_entries([row])
+        entry = FuelEntry.objects.get()
+        self.assertEqual(upsert_entries([row]).unchanged, 1)
+
+        entry.fuel_liters = 4.0
+        entry.save(update_fields=["fuel_liters"])
+        self.assertEqual(upsert_entries([row]).updated, 1)
+        self.assertEqual(FuelEntry.objects.get().fuel_liters, 3.0)
+
+
+class MultiSheetSyncTest(TestCase):
+    """Tests for syncing several spreadsheets and ranges"""
+
+    SOURCES = [
+        ("vehicle-a", "Form Responses 1!A2:E"),
+        ("vehicle-a", "Archive!A2:E"),
+        ("vehicle-b", "Form Responses 1!A2:E"),
+    ]
+
+    def _service(self, client):
+        return GoogleSheetsService(service=client, sources=[SheetSource(*source) for source in self.SOURCES])
+
+    def _sheets(self):
+        return {
+            ("vehicle-a", "Form Responses 1"): [_sheet_row(day) for day in range(1, 8)],
+            ("vehicle-a", "Archive"): [_sheet_row(day) for day in range(8, 12)],
+            ("vehicle-b", "Form Responses 1"): [_sheet_row(day) for day in range(12, 15)],
+        }
+
+    def test_ranges_sharing_a_spreadsheet_use_batch_get(self):
+        client = StubSheetsClient(self._sheets())
+        result = self._service(client).sync_from_sheets()
+
+        self.assertCountEqual(
+            client.calls,
+            [
+                ("batchGet", "vehicle-a", ["Form Responses 1!A2:E", "Archive!A2:E"]),
+                ("get", "vehicle-b", ["Form Responses 1!A2:E"]),
+            ],
+        )
+        self.assertEqual(result.created, 14)
+        self.assertEqual(FuelEntry.objects.count(), 14)
+        self.assertEqual(
+            sorted(SyncCursor.objects.values_list("spreadsheet_id", "range_name", "rows_ingested")),
+            [
+                ("vehicle-a", "Archive!A2:E", 4),
+                ("vehicle-a", "Form Responses 1!A2:E", 7),
+                ("vehicle-b", "Form Responses 1!A2:E", 3),
+            ],
+        )
+
+    def test_each_source_syncs_incrementally(self):
+        sheets = self._sheets()
+        client = StubSheetsClient(sheets)
+        service = self._service(client)
+        service.sync_from_sheets()
+
+        sheets[("vehicle-a", "Archive")].append(_sheet_row(20))
+        client.calls.clear()
+        result = service.sync_from_sheets()
+
+        self.assertCountEqual(
+            client.calls,
+            [
+                ("batchGet", "vehicle-a", ["Form Responses 1!A4:E", "Archive!A2:E"]),
+                ("get", "vehicle-b", ["Form Responses 1!A2:E"]),
+            ],
+        )
+        self.assertEqual(result.total, 1)
+        self.assertEqual(result.created, 1)
+
+    def test_spreadsheets_are_fetched_concurrently(self):
+        """Both spreadsheets' requests must be in flight at once to get past the barrier"""
+        barrier = threading.Barrier(2, timeout=5)
+
+        class BarrierClient(StubSheetsClient):
+            def respond(self, method, spreadsheet_id, ranges):
+                barrier.wait()
+                return super().respond(method, spreadsheet_id, ranges)
+
+        result = self._service(BarrierClient(self._sheets())).sync_from_sheets()
+
+        self.assertEqual(result.created, 14)
+
+    def test_sync_that_fails_part_way_is_caught_up(self):
+        """Rows written before another spreadsheet failed get their derived rows from the next sync"""
+        written = threading.Event()
+
+        class FailingClient(StubSheetsClient):
+            fail = True
+
+            def respond(self, method, spreadsheet_id, ranges):
+                if spreadsheet_id == "vehicle-b" and self.fail:
+                    # Fail only once vehicle-a's rows have been written
+                    written.wait(timeout=5)
+                    raise ConnectionError("vehicle-b is unreachable")
+                return super().respond(method, spreadsheet_id, ranges)
+
+        def upsert_then_signal(*args, **kwargs):
+            result = upsert_entries(*args, **kwargs)
+            written.set()
+            return result
+
+        client = FailingClient(self._sheets())
+        service = self._service(client)
+        with patch("moped.services.upsert_entries", side_effect=upsert_then_signal), self.assertRaises(ConnectionError):
+            service.sync_from_sheets()
+        self.assertEqual(FuelEntry.objects.count(), 11)
+        self.assertFalse(FillupSegment.objects.exists())
+
+        client.fail = False
+        result = service.sync_from_sheets()
+
+        self.assertEqual((result.created, result.unchanged), (3, 11))
+        self.assertEqual(
+            [segment.as_pair() for segment in FillupSegment.objects.all()],
+            fillup_pairs(FuelEntry.objects.all()),
+        )
+        self.assertEqual(EntryPrefix.objects.count(), 14)
+        self.assertEqual(MonthlyRollup.objects.count(), FuelEntry.objects.dates("timestamp", "month").count())
+        self.assertEqual(sum(MonthlyRollup.objects.values_list("segment_count", flat=True)), 13)
+        self.assertIsNone(SyncGeneration.objects.get().stale_from_km)
+
+    def test_parse_sources(self):
+        self.assertEqual(
+            parse_sources("abc:Form Responses 1!A2:E; def:Archive!A2:E;"),
+            [SheetSource("abc", "Form Responses 1!A2:E"), SheetSource("def", "Archive!A2:E")],
+        )
+        with self.assertRaises(ValueError):
+            parse_sources("abc")
+
+
+class _SheetsStubHandler(BaseHTTPRequestHandler):
+    """Answers values.get and values.batchGet from `server.sheets`, keyed by (spreadsheet_id, range)"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        _, _, rest = url.path.partition("/v4/spreadsheets/")
+        spreadsheet_id, _, call = rest.partition("/values")
+        self.server.seen.append((self.client_address, self.headers.get("Authorization")))
+        if call == ":batchGet":
+            ranges = parse_qs(url.query)["ranges"]
+            sheets = self.server.sheets
+            body = {"valueRanges": [{"range": name, "values": sheets[(spreadsheet_id, name)]} for name in ranges]}
+        else:
+            name = unquote(call.lstrip("/"))
+            body = {"range": name, "values": self.server.sheets[(spreadsheet_id, name)]}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class SheetsClientTest(TestCase):
+    """Tests for the shared, pooled Sheets API client"""
+
+    def setUp(self):
+        reset_clients()
+        self.addCleanup(reset_clients)
+
+    @patch("moped.services.config", return_value="test-value")
+    @patch("moped.sheets.build_from_document")
+    @patch("moped.sheets.service_account.Credentials.from_service_account_file")
+    def test_client_is_built_once_per_process(self, mock_creds, mock_build, mock_config):
+        first = GoogleSheetsService()
+        second = GoogleSheetsService()
+
+        self.assertIs(first.client, second.client)
+        mock_creds.assert_called_once()
+        mock_build.assert_called_once()
+
+    def test_syncs_against_a_local_server_over_one_connection(self):
+        """The whole request path, with a refreshed token and a kept-alive connection shared by both syncs"""
+
+        class FakeCredentials(Credentials):
+            refreshes = 0
+
+            def refresh(self, request):
+                self.refreshes += 1
+                self.token = f"token-{self.refreshes}"
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _SheetsStubHandler)
+        server.seen = []
+        server.sheets = {
+            ("vehicle", "Form Responses 1!A2:E"): [_sheet_row(day) for day in range(1, 4)],
+            ("vehicle", "Archive!A2:E"): [_sheet_row(day) for day in range(10, 13)],
+        }
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        credentials = FakeCredentials()
+        client = SheetsClient(credentials, api_root=f"http://127.0.0.1:{server.server_port}/")
+        sources = [SheetSource("vehicle", "Form Responses 1!A2:E"), SheetSource("vehicle", "Archive!A2:E")]
+
+        first = GoogleSheetsService(client=client, sources=sources).sync_from_sheets()
+        second = GoogleSheetsService(client=client, sources=sources).sync_from_sheets()
+
+        self.assertEqual((first.created, second.total), (6, 0))
+        self.assertEqual(credentials.refreshes, 1)
+        self.assertEqual(len(server.seen), 2)
+        self.assertEqual({address for address, _ in server.seen}, {server.seen[0][0]})
+        self.assertEqual({auth for _, auth in server.seen}, {"Bearer token-1"})
+
+
+class RowParserTest(TestCase):
+    """Tests for timestamp format detection and row parsing"""
+
+    def test_detects_month_first_sheets(self):
+        us_rows = [["01/05/2025 10:00:00"], ["01/20/2025 10:00:00"]]
+        uk_rows = [["05/01/2025 10:00:00"], ["20/01/2025 10:00:00"]]
+        ambiguous = [["05/01/2025 10:00:00"]]
+
+        self.assertEqual(detect_timestamp_format(us_rows), "%m/%d/%Y %H:%M:%S")
+        self.assertEqual(detect_timestamp_format(uk_rows), "%d/%m/%Y %H:%M:%S")
+        self.assertEqual(detect_timestamp_format(ambiguous), "%d/%m/%Y %H:%M:%S")
+
+    def test_ambiguous_dates_follow_the_sheet_format(self):
+        parser = RowParser.for_rows([["01/05/2025 10:00:00"], ["01/20/2025 10:00:00"]])
+
+        self.assertEqual(parser.parse_timestamp("01/05/2025 10:00:00"), datetime(2025, 1, 5, 10, 0))
+        # A timestamp that only fits the other format is still read
+        self.assertEqual(parser.parse_timestamp("20/01/2025 10:00:00"), datetime(2025, 1, 20, 10, 0))
+        self.assertIsNone(parser.parse_timestamp("30/02/2025 10:00:00"))
+
+    def test_malformed_rows_are_counted_by_reason(self):
+        parser = RowParser()
+        parsed = list(
+            parser.parse(
+                [
+                    ["01/10/2025 10:00:00", "1000", "3.0", "1.80", "5.40"],
+                    ["01/10/2025 10:00:00", "1000"],
+                    ["bad-date", "1050", "2.5"],
+                    ["02/10/2025 10:00:00", "nope", "2.5"],
+                    ["03/10/2025 10:00:00", "1100", "2.5", "", "abc"],
+                ],
+                chunk_size=2,
+            )
+        )
+
+        self.assertEqual(len(parsed), 1)
+        self.assertEqual(parsed[0]["total_spend"], 5.40)
+        self.assertEqual(parser.rejected, {"too_short": 1, "invalid_timestamp": 1, "invalid_number": 2})
+
+    def test_sync_exports_rejected_rows_and_keeps_the_format(self):
+        def rejected():
+            return REGISTRY.get_sample_value("moped_sync_rows_rejected_total", {"reason": "invalid_timestamp"}) or 0
+
+        before = rejected()
+        rows = [["01/20/2025 10:00:00", "1000", "3.0"], ["not a date", "1010", "1.0"]]
+        rows += [[f"01/{day:02d}/2025 10:00:00", str(1000 + day * 10), "3.0"] for day in range(1, 6)]
+        client = StubSheetsClient(rows)
+        service = GoogleSheetsService(service=client, spreadsheet_id="sheet", range_name="Form Responses 1!A2:E")
+        service.sync_from_sheets()
+
+        self.assertEqual(rejected() - before, 1)
+        self.assertEqual(SyncCursor.objects.get().timestamp_format, "%m/%d/%Y %H:%M:%S")
+
+        # The tail fetch alone is ambiguous, but is read with the stored format
+        rows.append(["02/03/2025 10:00:00", "1100", "3.0"])
+        service.sync_from_sheets()
+
+        self.assertEqual(client.requests[-1], "Form Responses 1!A4:E")
+
+        self.assertTrue(FuelEntry.objects.filter(timestamp__month=2, timestamp__day=3).exists())
+
 
 class CalculationTest(TestCase):
     """Tests for the calculation engine"""
@@ -204,8 +757,6 @@ class CalculationTest(TestCase):
 
     def test_service_status(self):
         """Should report km remaining until next service"""
-        from .calculations import service_status
-
         # Odometer at 1120km, service every 3000km
         # Next service at 3000km → 1880km remaining
         result = service_status(1120.0)
@@ -218,33 +769,24 @@ class CalculationTest(TestCase):
         self.assertEqual(oil["interval_km"], 1000)
         self.assertEqual(oil["km_remaining"], 880.0)
 
-
     def test_fuel_efficiency(self):
         """l/100km: (6.0L / 120km) * 100 = 5.0"""
-        from .calculations import fuel_efficiency
-
         result = fuel_efficiency(self.qs)
         self.assertEqual(result, 5.0)
 
     def test_fuel_efficiency_not_enough_data(self):
         """Should return None with fewer than 2 entries"""
-        from .calculations import fuel_efficiency
-
         FuelEntry.objects.filter(pk__in=[self.entry2.pk, self.entry3.pk]).delete()
         result = fuel_efficiency(self.qs)
         self.assertIsNone(result)
 
     def test_cost_per_km(self):
         """cost/km: (4.63 + 6.65) / 120 = 0.094"""
-        from .calculations import cost_per_km
-
         result = cost_per_km(self.qs)
         self.assertAlmostEqual(result, 0.094, places=3)
 
     def test_fillup_pairs(self):
         """Should return per-segment analysis"""
-        from .calculations import fillup_pairs
-
         pairs = fillup_pairs(self.qs)
         self.assertEqual(len(pairs), 2)
 
@@ -262,8 +804,6 @@ class CalculationTest(TestCase):
 
     def test_monthly_summary(self):
         """Should group by month"""
-        from .calculations import monthly_summary
-
         summary = monthly_summary(self.qs)
         self.assertEqual(len(summary), 1)  # all in January
         jan = summary[0]
@@ -271,3 +811,1051 @@ class CalculationTest(TestCase):
         self.assertEqual(jan["total_distance_km"], 120.0)
         self.assertEqual(jan["total_fuel_liters"], 6.0)
         self.assertAlmostEqual(jan["total_cost"], 11.28, places=2)
+
+    def test_entry_totals_single_query(self):
+        """Distance, liters and spend should come from one aggregate query"""
+        with self.assertNumQueries(1):
+            totals = entry_totals(self.qs)
+        self.assertEqual(totals["distance_km"], 120.0)
+        self.assertEqual(totals["fuel_liters"], 6.0)
+        self.assertAlmostEqual(totals["total_spend"], 11.28, places=2)
+
+    def test_cost_per_km_ignores_missing_spend(self):
+        """Entries without total_spend add nothing to the cost"""
+        self.entry3.total_spend = None
+        self.entry3.save()
+        self.assertAlmostEqual(cost_per_km(self.qs), round(4.63 / 120, 3), places=3)
+
+
+def _parsed_row(day, odometer_km, fuel_liters, total_spend=5.40):
+    return {
+        "timestamp": datetime(2025, 1, day, 10, 0),
+        "odometer_km": odometer_km,
+        "fuel_liters": fuel_liters,
+        "cost_per_liter": 1.80,
+        "total_spend": total_spend,
+        "notes": "",
+    }
+
+
+def _three_months_of_rows():
+    """Fillups every 10 days from 2025-01-01 to 2025-03-22, with varying fuel and spend"""
+    return [
+        _parsed_row(1, 1000.0 + i * 60, 2.5 + (i % 3) * 0.4, 4.5 + i * 0.1)
+        | {"timestamp": datetime(2025, 1, 1, 10, 0) + timedelta(days=10 * i)}
+        for i in range(9)
+    ]
+
+
+def _ingest(rows):
+    """Write parsed rows the way a sync does, including derived tables"""
+    result = upsert_entries(rows)
+    refresh_derived()
+    return result
+
+
+class FillupSegmentTest(MopedAPITestCase):
+    """Tests for the materialized per-segment table"""
+
+    def _assert_matches_entries(self):
+        self.assertEqual(
+            [segment.as_pair() for segment in FillupSegment.objects.all()],
+            fillup_pairs(FuelEntry.objects.all()),
+        )
+
+    def test_segments_follow_sync(self):
+        """Segments should match fillup_pairs after each sync"""
+        _ingest([_parsed_row(10, 1000.0, 3.0), _parsed_row(15, 1050.0, 2.5, 4.63)])
+        self._assert_matches_entries()
+
+        _ingest([_parsed_row(20, 1120.0, 3.5, 6.65)])
+        self._assert_matches_entries()
+
+    def test_inserted_entry_splits_segment(self):
+        """An entry arriving between two others should replace their segment with two"""
+        _ingest([_parsed_row(10, 1000.0, 3.0), _parsed_row(20, 1120.0, 3.5, 6.65)])
+        _ingest([_parsed_row(15, 1050.0, 2.5, 4.63)])
+
+        self.assertEqual(FillupSegment.objects.count(), 2)
+        self._assert_matches_entries()
+
+    def test_only_neighbouring_segments_are_rewritten(self):
+        """An edited entry should only rewrite the segments around it"""
+        _ingest([_parsed_row(day, 1000.0 + day * 50, 3.0) for day in range(1, 21)])
+        self.assertEqual(refresh_segments(1500.0, 1500.0)[0], 2)
+
+    def test_fillups_endpoint_reads_segments(self):
+        """GET /fillups/ should serve the stored segments, optionally paginated"""
+        _ingest([_parsed_row(10, 1000.0, 3.0), _parsed_row(15, 1050.0, 2.5), _parsed_row(20, 1120.0, 3.5)])
+
+        response = self.client.get("/api/moped-entries/fillups/")
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response.data[0]["distance_km"], 50.0)
+
+        response = self.client.get("/api/moped-entries/fillups/", {"page": 1})
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(response.data["results"][1]["distance_km"], 70.0)
+
+    def test_fillups_ignore_keyset_paging(self):
+        """Keyset paging is for entries only; on fillups the page-number response is served instead"""
+        _ingest([_parsed_row(10, 1000.0, 3.0), _parsed_row(15, 1050.0, 2.5), _parsed_row(20, 1120.0, 3.5)])
+
+        for params in ({"page": 1, "pagination": "cursor"}, {"page": 1, "cursor": "abc"}):
+            response = self.client.get("/api/moped-entries/fillups/", params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["count"], 2)
+
+
+class MonthlyRollupTest(MopedAPITestCase):
+    """Tests for the per-month rollup table"""
+
+    def setUp(self):
+        _ingest(_three_months_of_rows())
+
+    def test_monthly_matches_full_recalculation(self):
+        """GET /monthly/ should match monthly_summary over all entries"""
+        response = self.client.get("/api/moped-entries/monthly/")
+        self.assertEqual(response.data, monthly_summary(FuelEntry.objects.all()))
+        self.assertEqual([m["month"] for m in response.data], ["2025-01", "2025-02", "2025-03"])
+
+    def test_efficiency_month_matches_filtered_entries(self):
+        """GET /efficiency/?month= should match the calculation over that month's entries"""
+        february = FuelEntry.objects.filter(timestamp__year=2025, timestamp__month=2)
+        response = self.client.get("/api/moped-entries/efficiency/", {"month": "2025-02"})
+        self.assertEqual(response.data["l_per_100km"], fuel_efficiency(february))
+        self.assertEqual(response.data["cost_per_km"], cost_per_km(february))
+
+        response = self.client.get("/api/moped-entries/efficiency/", {"month": "2024-12"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_sync_only_touches_changed_months(self):
+        """Appending a March fillup should leave January and February alone"""
+        before = {r.month: r.cost for r in MonthlyRollup.objects.all()}
+        MonthlyRollup.objects.filter(month__in=["2025-01", "2025-02"]).update(cost=0)
+
+        _ingest([_parsed_row(30, 1600.0, 3.0) | {"timestamp": datetime(2025, 3, 30, 10, 0)}])
+
+        after = {r.month: r.cost for r in MonthlyRollup.objects.all()}
+        self.assertEqual(after["2025-01"], 0)
+        self.assertEqual(after["2025-02"], 0)
+        self.assertEqual(after["2025-03"], before["2025-03"] + Decimal("5.40"))
+
+
+class DateRangeTest(MopedAPITestCase):
+    """Tests for ?from=&to= on the analytics endpoints"""
+
+    def setUp(self):
+        _ingest(_three_months_of_rows())
+        self.range = {"from": "2025-01-11T10:00:00", "to": "2025-02-20"}
+
+    def _in_range(self):
+        return FuelEntry.objects.filter(
+            timestamp__gte=datetime(2025, 1, 11, 10, tzinfo=dt_timezone.utc),
+            timestamp__lt=datetime(2025, 2, 20, tzinfo=dt_timezone.utc),
+        )
+
+    def test_efficiency_uses_half_open_range(self):
+        response = self.client.get("/api/moped-entries/efficiency/", self.range)
+
+        self.assertEqual(self._in_range().count(), 4)  # the fillup on the `to` date is excluded
+        self.assertEqual(response.data["l_per_100km"], fuel_efficiency(self._in_range()))
+
+    def test_fillups_and_monthly_select_segments_ending_in_range(self):
+        # Segments ending on an entry in the range; the first one starts just before it
+        pairs = fillup_pairs(FuelEntry.objects.all())[0:4]
+
+        response = self.client.get("/api/moped-entries/fillups/", self.range)
+        self.assertEqual(response.data, pairs)
+
+        response = self.client.get("/api/moped-entries/monthly/", self.range)
+        self.assertEqual(response.data, summarise_months(pairs))
+        self.assertEqual([month["month"] for month in response.data], ["2025-01", "2025-02"])
+
+    def test_open_ended_and_invalid_ranges(self):
+        response = self.client.get("/api/moped-entries/fillups/", {"from": "2025-03-01"})
+        self.assertEqual([pair["date"] for pair in response.data], ["2025-03-02", "2025-03-12", "2025-03-22"])
+
+        for endpoint in ("efficiency", "fillups", "monthly"):
+            response = self.client.get(f"/api/moped-entries/{endpoint}/", {"to": "next tuesday"})
+            self.assertEqual(response.status_code, 400)
+
+    def test_range_queries_use_indexes(self):
+        """EXPLAIN QUERY PLAN for what the range endpoints run must not scan the entry, segment or prefix tables"""
+        with CaptureQueriesContext(connection) as queries:
+            for endpoint in ("efficiency", "fillups", "monthly"):
+                response = self.client.get(f"/api/moped-entries/{endpoint}/", self.range)
+                self.assertEqual(response.status_code, 200)
+
+        tables = ('FROM "moped_fuelentry"', 'FROM "moped_fillupsegment"', 'FROM "moped_entryprefix"')
+        range_queries = [query["sql"] for query in queries if any(table in query["sql"] for table in tables)]
+        self.assertTrue(range_queries)
+        for sql in range_queries:
+            # Segments carry their own timestamp, so selecting them never joins the entries
+            if 'FROM "moped_fillupsegment"' in sql:
+                self.assertNotIn('JOIN "moped_fuelentry"', sql)
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+                plan = [row[-1] for row in cursor.fetchall()]
+            self.assertFalse([step for step in plan if step.startswith("SCAN")], plan)
+            self.assertTrue([step for step in plan if "USING" in step and "INDEX" in step], plan)
+
+
+class EntryPrefixTest(MopedAPITestCase):
+    """Tests for running totals and odometer/date window efficiency"""
+
+    def setUp(self):
+        populate(60)
+
+    def _prefixes(self):
+        return list(EntryPrefix.objects.values_list("entry_id", "cumulative_fuel_liters", "cumulative_spend"))
+
+    def test_km_window_matches_entry_totals(self):
+        entries = FuelEntry.objects.filter(odometer_km__gte=1000, odometer_km__lte=4000)
+        response = self.client.get("/api/moped-entries/efficiency/", {"from_km": "1000", "to_km": "4000"})
+
+        self.assertEqual(response.data["l_per_100km"], fuel_efficiency(entries))
+        self.assertEqual(response.data["cost_per_km"], cost_per_km(entries))
+
+        response = self.client.get("/api/moped-entries/efficiency/", {"from_km": "a lot"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_date_window_matches_entry_totals(self):
+        """?from=&to= gives the aggregate's answer, also when a reading is out of time order"""
+        timestamps = list(FuelEntry.objects.order_by("timestamp").values_list("timestamp", flat=True))
+        start, end = timestamps[10], timestamps[30]
+        params = {"from": start.isoformat(), "to": end.isoformat()}
+        entries = FuelEntry.objects.filter(timestamp__gte=start, timestamp__lt=end)
+
+        def assert_matches():
+            response = self.client.get("/api/moped-entries/efficiency/", params)
+            self.assertEqual(response.data["l_per_100km"], fuel_efficiency(entries))
+            self.assertEqual(response.data["cost_per_km"], cost_per_km(entries))
+
+        assert_matches()
+
+        # A later, corrected reading that falls between readings inside the range
+        inside = entries.order_by("odometer_km").values_list("odometer_km", flat=True)
+        _ingest([_parsed_row(1, (inside[5] + inside[6]) / 2, 9.5, 20.0)])
+        assert_matches()
+
+    def test_random_windows_match_entry_totals(self):
+        """Differences of running totals agree with summing the window's entries, however far into the table.
+        40 km legs with two-decimal liters put many windows' l/100km exactly on a rounding tie."""
+        FuelEntry.objects.all().delete()
+        rng = random.Random(1)
+        rows = []
+        for index in range(400):
+            liters = rng.randint(50, 250) / 100
+            rows.append(
+                {
+                    "timestamp": datetime(2024, 1, 1, 8, 0) + timedelta(days=index),
+                    "odometer_km": 40.0 * index,
+                    "fuel_liters": liters,
+                    "cost_per_liter": 1.85,
+                    "total_spend": round(liters * 1.85, 2),
+                    "notes": "",
+                }
+            )
+        upsert_entries(rows)
+        refresh_derived(full=True)
+
+        timestamps = list(FuelEntry.objects.order_by("timestamp").values_list("timestamp", flat=True))
+        for _ in range(200):
+            low, high = sorted(rng.sample(range(len(timestamps)), 2))
+            params = {"from": timestamps[low].isoformat(), "to": timestamps[high].isoformat()}
+            entries = FuelEntry.objects.filter(timestamp__gte=timestamps[low], timestamp__lt=timestamps[high])
+            response = self.client.get("/api/moped-entries/efficiency/", params)
+            self.assertEqual(response.data["l_per_100km"], fuel_efficiency(entries), params)
+            self.assertEqual(response.data["cost_per_km"], cost_per_km(entries), params)
+
+    def test_sync_keeps_running_totals_in_step(self):
+        """Appends and edits of early entries leave the same totals as a rebuild"""
+        rows = synthetic_rows(65)
+        _ingest(rows[60:])
+        _ingest([dict(rows[3], fuel_liters=rows[3]["fuel_liters"] + 1, total_spend=9.99)])
+        incremental = self._prefixes()
+
+        rebuild_prefixes()
+        self.assertEqual(len(incremental), 65)
+        self.assertEqual(incremental, self._prefixes())
+
+
+class RollingEfficiencyTest(MopedAPITestCase):
+    """Tests for the window-function rolling efficiency stream"""
+
+    def setUp(self):
+        populate(40)
+
+    def _rows(self, params):
+        response = self.client.get("/api/moped-entries/rolling/", params)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_fillup_window_sums_the_last_n_segments(self):
+        pairs = fillup_pairs(FuelEntry.objects.all())
+        rows = self._rows({"fillups": 4})
+
+        self.assertEqual(len(rows), len(pairs) - 3)
+        for row, end in zip(rows, range(3, len(pairs))):
+            window = pairs[end - 3 : end + 1]
+            self.assertEqual(row["date"], window[-1]["date"])
+            self.assertAlmostEqual(row["distance_km"], sum(pair["distance_km"] for pair in window), places=1)
+            self.assertAlmostEqual(row["fuel_liters"], sum(pair["fuel_liters"] for pair in window), places=2)
+
+    def test_day_window_matches_entry_totals(self):
+        rows = self._rows({"days": 10})
+        entries = list(FuelEntry.objects.order_by("odometer_km"))
+
+        self.assertEqual(len(rows), len(entries) - 1)
+        for row, entry in zip(rows, entries[1:]):
+            window = FuelEntry.objects.filter(
+                timestamp__gte=entry.timestamp - timedelta(days=10), timestamp__lte=entry.timestamp
+            )
+            totals = entry_totals(window)
+            self.assertEqual(row["odometer_km"], entry.odometer_km)
+            self.assertEqual(row["distance_km"], round(totals["distance_km"], 1))
+            self.assertEqual(row["fuel_liters"], round(totals["fuel_liters"], 2))
+
+    def test_csv_and_invalid_windows(self):
+        response = self.client.get("/api/moped-entries/rolling/", {"format": "csv"})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "date,odometer_km,distance_km,fuel_liters,l_per_100km")
+        self.assertEqual(len(lines), 1 + 40 - 5)
+
+        for params in ({"fillups": "0"}, {"days": "week"}, {"days": "7", "fillups": "3"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get("/api/moped-entries/rolling/", params).status_code, 400)
+
+
+class DashboardTest(MopedAPITestCase):
+    """Tests for the combined one-pass dashboard"""
+
+    ENDPOINTS = {
+        "last_fillup": "last-fillup",
+        "efficiency": "efficiency",
+        "fillups": "fillups",
+        "monthly": "monthly",
+        "service_status": "service-status",
+    }
+
+    def setUp(self):
+        populate(60)
+
+    def test_sections_match_their_endpoints(self):
+        dashboard = self.client.get("/api/moped-entries/dashboard/").json()
+
+        self.assertEqual(list(dashboard), list(self.ENDPOINTS))
+        for section, path in self.ENDPOINTS.items():
+            with self.subTest(section=section):
+                self.assertEqual(dashboard[section], self.client.get(f"/api/moped-entries/{path}/").json())
+
+    def test_fields_select_sections(self):
+        response = self.client.get("/api/moped-entries/dashboard/", {"fields": "monthly,efficiency"})
+        self.assertEqual(list(response.json()), ["monthly", "efficiency"])
+
+        self.assertEqual(self.client.get("/api/moped-entries/dashboard/", {"fields": "monthly,nope"}).status_code, 400)
+
+    def test_entries_are_read_once(self):
+        # The sync generation, then the pass over the entries and/or the newest entry
+        for fields, queries in (("", 3), ("efficiency,monthly", 2), ("last_fillup,service_status", 2)):
+            caches[settings.MOPED_RESPONSE_CACHE].clear()
+            with self.subTest(fields=fields), self.assertNumQueries(queries):
+                self.client.get("/api/moped-entries/dashboard/", {"fields": fields} if fields else {})
+
+    def test_empty_sections_are_null(self):
+        FuelEntry.objects.all().delete()
+        dashboard = self.client.get("/api/moped-entries/dashboard/").json()
+        self.assertEqual(
+            dashboard,
+            {"last_fillup": None, "efficiency": None, "fillups": [], "monthly": [], "service_status": None},
+        )
+
+
+class SQLiteProfileTest(SimpleTestCase):
+    """Tests for the per-connection SQLite pragmas, against a real database file"""
+
+    def _connection(self, path):
+        wrapper = DatabaseWrapper({**connections["default"].settings_dict, "NAME": path}, alias="profile-test")
+        wrapper.connect()  # fires connection_created, which applies the profile
+        self.addCleanup(wrapper.close)
+        return wrapper.connection
+
+    def test_reads_keep_succeeding_during_a_long_write(self):
+        path = f"{tempfile.mkdtemp()}/profile.sqlite3"
+        writer = self._connection(path)
+        writer.executescript(
+            "CREATE TABLE entry (id INTEGER PRIMARY KEY, km REAL);INSERT INTO entry (km) VALUES (1), (2), (3);"
+        )
+        self.assertEqual(writer.execute("PRAGMA journal_mode").fetchone(), ("wal",))
+        self.assertEqual(writer.execute("PRAGMA synchronous").fetchone(), (1,))  # NORMAL
+
+        writing = threading.Event()
+        finish = threading.Event()
+
+        def long_sync():
+            writer.execute("BEGIN IMMEDIATE")
+            writer.executemany("INSERT INTO entry (km) VALUES (?)", [(km,) for km in range(1000)])
+            writing.set()
+            finish.wait(timeout=10)
+            writer.execute("COMMIT")
+
+        thread = threading.Thread(target=long_sync)
+        thread.start()
+        self.assertTrue(writing.wait(timeout=10))
+
+        # Without WAL these would wait on (and then fail with) "database is locked"
+        reader = sqlite3.connect(path, timeout=0, check_same_thread=False)
+        self.addCleanup(reader.close)
+        counts = [reader.execute("SELECT COUNT(*) FROM entry").fetchone()[0] for _ in range(20)]
+
+        finish.set()
+        thread.join()
+        self.assertEqual(counts, [3] * 20)  # the last committed state, not the half-written one
+        self.assertEqual(reader.execute("SELECT COUNT(*) FROM entry").fetchone()[0], 1003)
+
+
+class ResponseCacheTest(MopedAPITestCase):
+    """Tests for generation-keyed response caching"""
+
+    def setUp(self):
+        _ingest([_parsed_row(10, 1000.0, 3.0), _parsed_row(15, 1050.0, 2.5), _parsed_row(20, 1120.0, 3.5)])
+
+    def test_repeat_request_served_from_cache(self):
+        """A second identical request should only look up the sync generation"""
+        first = self.client.get("/api/moped-entries/efficiency/")
+        with self.assertNumQueries(1):
+            second = self.client.get("/api/moped-entries/efficiency/")
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second["ETag"], first["ETag"])
+
+    def test_if_none_match_returns_304(self):
+        """Clients presenting the current ETag should get an empty 304"""
+        etag = self.client.get("/api/moped-entries/monthly/")["ETag"]
+        response = self.client.get("/api/moped-entries/monthly/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_sync_with_changes_invalidates(self):
+        """Writing new entries should move to a new ETag and fresh data"""
+        first = self.client.get("/api/moped-entries/last-fillup/")
+        _ingest([_parsed_row(25, 1180.0, 3.0)])
+        response = self.client.get("/api/moped-entries/last-fillup/", HTTP_IF_NONE_MATCH=first["ETag"])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertEqual(response.data["odometer_km"], 1180.0)
+
+    def test_unchanged_sync_keeps_etag(self):
+        """A sync that writes nothing should not invalidate cached responses"""
+        etag = self.client.get("/api/moped-entries/fillups/")["ETag"]
+        _ingest([_parsed_row(20, 1120.0, 3.5)])
+        self.assertEqual(self.client.get("/api/moped-entries/fillups/")["ETag"], etag)
+
+    def test_hand_edits_invalidate(self):
+        """Entries saved or deleted through the ORM (as the admin does) should refresh derived data on commit"""
+        etag = self.client.get("/api/moped-entries/fillups/")["ETag"]
+        entry = FuelEntry.objects.get(odometer_km=1050.0)
+        entry.odometer_km = 1150.0
+        entry.timestamp = entry.timestamp.replace(day=25)
+        with self.captureOnCommitCallbacks(execute=True):
+            entry.save()
+
+        response = self.client.get("/api/moped-entries/fillups/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([fillup["distance_km"] for fillup in response.data], [120.0, 30.0])
+        self.assertEqual(
+            [segment.as_pair() for segment in FillupSegment.objects.all()], fillup_pairs(FuelEntry.objects.all())
+        )
+        self.assertIsNone(SyncGeneration.objects.get().stale_from_km)
+
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            FuelEntry.objects.get(odometer_km=1120.0).delete()
+        response = self.client.get("/api/moped-entries/fillups/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual([fillup["distance_km"] for fillup in response.data], [150.0])
+        self.assertEqual(EntryPrefix.objects.count(), 2)
+
+    def test_reads_never_write_the_generation(self):
+        """Without the generation row, reads fall back to a constant key; the next bump recreates the row"""
+        SyncGeneration.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get("/api/moped-entries/efficiency/")
+            self.client.get("/metrics")
+        self.assertFalse([query["sql"] for query in queries if not query["sql"].startswith("SELECT")])
+        self.assertEqual(self.client.get("/api/moped-entries/efficiency/")["ETag"], first["ETag"])
+
+        _ingest([_parsed_row(25, 1180.0, 3.0)])
+        self.assertEqual(SyncGeneration.objects.get().value, 1)
+        self.assertNotEqual(self.client.get("/api/moped-entries/efficiency/")["ETag"], first["ETag"])
+
+
+class VectorizedEngineTest(TestCase):
+    """The NumPy engine must give exactly the same results as the Python one"""
+
+    def setUp(self):
+        rows = synthetic_rows(400, seed=3)
+        rows[10]["total_spend"] = None  # missing spend
+        rows[20]["odometer_km"] = rows[19]["odometer_km"]  # zero-distance segment
+        rows[30]["timestamp"] = rows[29]["timestamp"] - timedelta(days=40)  # backdated entry
+        _ingest(rows)
+        self.qs = FuelEntry.objects.all()
+
+    def _both_engines(self, function):
+        with self.settings(MOPED_CALCULATION_ENGINE="python"):
+            expected = function(self.qs)
+        with self.settings(MOPED_CALCULATION_ENGINE="numpy"):
+            actual = function(self.qs)
+        return expected, actual
+
+    def test_fillup_pairs_match(self):
+        if not vectorized.available():
+            self.skipTest("NumPy is not installed")
+        expected, actual = self._both_engines(fillup_pairs)
+        self.assertEqual(actual, expected)
+        self.assertEqual(json.dumps(actual), json.dumps(expected))
+
+    def test_monthly_summary_match(self):
+        if not vectorized.available():
+            self.skipTest("NumPy is not installed")
+        expected, actual = self._both_engines(monthly_summary)
+        self.assertEqual(json.dumps(actual), json.dumps(expected))
+
+    def test_entry_pass_matches(self):
+        if not vectorized.available():
+            self.skipTest("NumPy is not installed")
+        for want_pairs in (True, False):
+            expected, actual = self._both_engines(lambda qs: entry_pass(qs, want_pairs=want_pairs))
+            self.assertEqual(json.dumps(actual), json.dumps(expected))
+        expected, actual = self._both_engines(lambda qs: entry_pass(qs.filter(pk=qs.first().pk)))
+        self.assertEqual(actual, expected)
+
+    def test_rebuilds_match(self):
+        """Full rebuilds of the segments and monthly rollups should write the same rows with either engine"""
+        if not vectorized.available():
+            self.skipTest("NumPy is not installed")
+
+        def rebuild(qs):
+            rebuild_segments()
+            rebuild_rollups()
+            return (
+                list(FillupSegment.objects.values_list("end_entry", *SEGMENT_FIELDS)),
+                list(MonthlyRollup.objects.values_list("month", "segment_count", "distance_km", "fuel_liters", "cost")),
+            )
+
+        expected, actual = self._both_engines(rebuild)
+        self.assertEqual(actual, expected)
+
+    def test_falls_back_without_numpy(self):
+        """Selecting the NumPy engine without NumPy installed should use the Python engine"""
+        with self.settings(MOPED_CALCULATION_ENGINE="numpy"), patch("moped.vectorized.np", None):
+            with self.assertLogs("moped.calculations", level="WARNING"):
+                pairs = fillup_pairs(self.qs)
+        self.assertEqual(len(pairs), 399)
+
+
+class FastSerializationTest(MopedAPITestCase):
+    """The values() read path and the orjson renderer must produce exactly the bytes the DRF path does"""
+
+    def setUp(self):
+        rows = [
+            _parsed_row(10, 1000.0, 3.0),
+            dict(_parsed_row(15, 1050.5, 2.25, 4.63), cost_per_liter=2.06, notes="Kahvila \u2028 ☕"),
+            dict(_parsed_row(20, 1120.0, 3.5), total_spend=None),
+        ]
+        _ingest(rows)
+
+    def _drf_json(self, data):
+        return JSONRenderer().render(data)
+
+    def test_values_serializer_matches_model_serializer(self):
+        values = ValuesSerializer(FuelEntrySerializer)
+        fast = values.many(values.rows(FuelEntry.objects.all()))
+        slow = FuelEntrySerializer(FuelEntry.objects.all(), many=True).data
+
+        self.assertEqual(self._drf_json(fast), self._drf_json(slow))
+        self.assertEqual([list(row) for row in fast], [list(row) for row in slow])
+
+    def test_list_and_export_bodies_are_unchanged(self):
+        entries = FuelEntry.objects.order_by("-timestamp", "-id")
+        expected = FuelEntrySerializer(entries, many=True).data
+
+        self.assertEqual(self.client.get("/api/moped-entries/").json()["results"], expected)
+        self.assertEqual(self.client.get("/api/moped-entries/", {"pagination": "cursor"}).json()["results"], expected)
+        response = self.client.get("/api/moped-entries/export/")
+        exported = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(exported, [json.dumps(row, cls=JSONEncoder) for row in expected])
+
+    def test_orjson_renderer_is_byte_identical(self):
+        if orjson is None:
+            self.skipTest("orjson is not installed")
+
+        list_body = self.client.get("/api/moped-entries/").content
+        samples = [
+            json.loads(list_body),
+            {"error": ErrorDetail("Not enough data", code="invalid"), "ratio": 2.675, "big": 10**20},
+            {"when": timezone.now(), "spend": Decimal("4.63"), 3: ["\u2029", None, True]},
+            [],
+        ]
+        for data in samples:
+            with self.subTest(data=data), self.settings(MOPED_JSON_ENGINE="orjson"):
+                self.assertEqual(FastJSONRenderer().render(data), self._drf_json(data))
+
+        with self.settings(MOPED_JSON_ENGINE="orjson"):
+            self.assertEqual(self.client.get("/api/moped-entries/").content, list_body)
+
+
+class MetricsCollectorTest(TestCase):
+    """Tests for the scrape-time Prometheus collector"""
+
+    def setUp(self):
+        self.collector = MopedCollector()
+        _ingest([_parsed_row(10, 1000.0, 3.0), _parsed_row(15, 1050.0, 2.5, 4.63), _parsed_row(20, 1120.0, 3.5, 6.65)])
+
+    def _samples(self):
+        return {
+            (sample.name, tuple(sample.labels.values())): sample.value
+            for family in self.collector.collect()
+            for sample in family.samples
+        }
+
+    def test_describe_does_not_query(self):
+        """Registering the collector must not touch the database"""
+        with self.assertNumQueries(0):
+            self.collector.describe()
+
+    def test_values_computed_at_scrape(self):
+        samples = self._samples()
+        self.assertEqual(samples[("moped_current_odometer_km", ())], 1120.0)
+        self.assertAlmostEqual(samples[("moped_cost_per_km", ())], 0.094, places=3)
+        self.assertEqual(samples[("moped_km_until_service", ("oil_change",))], 880.0)
+        self.assertIn(("moped_days_since_last_fueling", ()), samples)
+
+    def test_values_cached_until_generation_changes(self):
+        """Repeat scrapes reuse the values; a sync with changes refreshes them"""
+        self._samples()
+        with self.assertNumQueries(1):  # sync generation lookup only
+            self._samples()
+
+        _ingest([_parsed_row(25, 1180.0, 3.0)])
+        self.assertEqual(self._samples()[("moped_current_odometer_km", ())], 1180.0)
+
+    def test_no_entries(self):
+        """With an empty table the data gauges are simply absent"""
+        FuelEntry.objects.all().delete()
+        self.collector = MopedCollector()
+        self.assertEqual(self._samples(), {})
+
+
+class InstrumentationTest(MopedAPITestCase):
+    """Tests for the sync phase, calculation and per-request query histograms"""
+
+    def _sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_sync_phases_are_timed(self):
+        sheets = {("a", "Form Responses 1"): [_sheet_row(1), _sheet_row(2)], ("b", "Form Responses 1"): [_sheet_row(3)]}
+        service = GoogleSheetsService(
+            service=StubSheetsClient(sheets),
+            sources=[SheetSource("a", "Form Responses 1!A2:E"), SheetSource("b", "Form Responses 1!A2:E")],
+        )
+        phases = {"fetch": 2, "parse": 2, "write": 2, "refresh": 1}  # fetch per spreadsheet, parse/write per source
+        before = {phase: self._sample("moped_sync_phase_seconds_count", phase=phase) for phase in phases}
+        service.sync_from_sheets()
+
+        for phase, observations in phases.items():
+            with self.subTest(phase=phase):
+                after = self._sample("moped_sync_phase_seconds_count", phase=phase)
+                self.assertEqual(after - before[phase], observations)
+
+    def test_calculations_are_timed(self):
+        before = self._sample("moped_calculation_seconds_count", function="entry_totals")
+        entry_totals(FuelEntry.objects.all())
+        self.assertEqual(self._sample("moped_calculation_seconds_count", function="entry_totals") - before, 1)
+
+    def test_request_queries_are_observed_per_action(self):
+        populate(20)
+        caches[settings.MOPED_RESPONSE_CACHE].clear()
+        before = self._sample("moped_request_db_queries_sum", action="efficiency")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/moped-entries/efficiency/")
+
+        self.assertEqual(self._sample("moped_request_db_queries_sum", action="efficiency") - before, len(queries))
+        self.assertGreater(self._sample("moped_request_db_seconds_sum", action="efficiency"), 0)
+
+    def test_streamed_queries_are_observed_once_sent(self):
+        populate(20)
+        before = self._sample("moped_request_db_queries_count", action="export")
+        response = self.client.get("/api/moped-entries/export/")
+        self.assertEqual(self._sample("moped_request_db_queries_count", action="export"), before)
+
+        b"".join(response.streaming_content)
+        self.assertEqual(self._sample("moped_request_db_queries_count", action="export") - before, 1)
+        self.assertGreaterEqual(self._sample("moped_request_db_queries_sum", action="export"), 1)
+
+
+@override_settings(MOPED_PROFILING=True)
+class ProfilingTest(MopedAPITestCase):
+    """Tests for the on-demand profiling middleware and the admin-only profile downloads"""
+
+    def setUp(self):
+        self.staff = User.objects.create_user("staff", password="pw", is_staff=True)
+        _ingest([_parsed_row(10, 1000.0, 3.0), _parsed_row(15, 1050.0, 2.5, 4.63)])
+
+    def _download(self, response):
+        profile = RequestProfile.objects.get(pk=response["X-Moped-Profile-Id"])
+        self.client.force_login(self.staff)
+        download = self.client.get(f"/api/profiles/{profile.pk}/download/")
+        self.assertEqual(download.status_code, 200)
+        return profile, download.content
+
+    def test_disabled_middleware_removes_itself(self):
+        with override_settings(MOPED_PROFILING=False), self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+
+    def test_staff_request_stores_a_pstats_profile(self):
+        self.client.force_login(self.staff)
+        response = self.client.get("/api/moped-entries/efficiency/", HTTP_X_MOPED_PROFILE="1")
+        self.assertEqual(response.status_code, 200)
+
+        profile, content = self._download(response)
+        self.assertEqual((profile.trigger, profile.format, profile.status_code), ("requested", "pstats", 200))
+        with tempfile.NamedTemporaryFile(suffix=".prof") as f:
+            f.write(content)
+            f.flush()
+            functions = {name for _, _, name in pstats.Stats(f.name).stats}
+        self.assertIn("efficiency", functions)
+
+    def test_only_staff_can_ask(self):
+        self.client.get("/api/moped-entries/efficiency/?profile=1")
+        self.client.force_login(User.objects.create_user("driver", password="pw"))
+        response = self.client.get("/api/moped-entries/efficiency/?profile=1")
+
+        self.assertNotIn("X-Moped-Profile-Id", response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(MOPED_PROFILE_SAMPLE_RATE=1.0, MOPED_PROFILER="sampler", MOPED_PROFILES_KEPT=2)
+    def test_sampled_requests_store_collapsed_stacks(self):
+        for _ in range(3):
+            response = self.client.get("/api/moped-entries/")
+
+        profile, content = self._download(response)
+        self.assertEqual((profile.trigger, profile.format), ("sampled", "collapsed"))
+        for line in content.decode().splitlines():
+            stack, count = line.rsplit(" ", 1)
+            self.assertTrue(stack and int(count) > 0)
+        # The download request was sampled too; only the newest PROFILES_KEPT remain
+        self.assertEqual(RequestProfile.objects.count(), 2)
+
+    def test_stack_sampler_records_the_calling_thread(self):
+        def slow_calculation():
+            time.sleep(0.05)
+            return 42
+
+        sampler = StackSampler(interval=0.002)
+        self.assertEqual(sampler.runcall(slow_calculation), 42)
+        self.assertIn("slow_calculation", sampler.dump().decode())
+
+    def test_profiles_are_admin_only(self):
+        self.assertEqual(self.client.get("/api/profiles/").status_code, 403)
+        self.client.force_login(User.objects.create_user("driver", password="pw"))
+        self.assertEqual(self.client.get("/api/profiles/").status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get("/api/profiles/").status_code, 200)
+
+
+class QueryBudgetTest(MopedAPITestCase):
+    """Query counts per endpoint must not grow with the number of entries (catches N+1 regressions)"""
+
+    # (path, query params) -> queries with a cold response cache
+    BUDGETS = {
+        ("/api/moped-entries/", ()): 2,
+        ("/api/moped-entries/", (("pagination", "cursor"),)): 1,
+        ("/api/moped-entries/export/", ()): 1,
+        ("/api/moped-entries/export/", (("format", "csv"),)): 1,
+        ("/api/moped-entries/last-fillup/", ()): 2,
+        ("/api/moped-entries/efficiency/", ()): 2,
+        ("/api/moped-entries/efficiency/", (("month", "2000-01"),)): 2,
+        ("/api/moped-entries/efficiency/", (("from", "2000-01-10"), ("to", "2000-02-01"))): 4,
+        ("/api/moped-entries/efficiency/", (("from_km", "100"), ("to_km", "900"))): 3,
+        ("/api/moped-entries/monthly/", (("from", "2000-01-10"),)): 2,
+        ("/api/moped-entries/rolling/", ()): 1,
+        ("/api/moped-entries/rolling/", (("days", "30"),)): 1,
+        ("/api/moped-entries/fillups/", ()): 2,
+        ("/api/moped-entries/fillups/", (("page", "1"),)): 3,
+        ("/api/moped-entries/monthly/", ()): 2,
+        ("/api/moped-entries/service-status/", ()): 2,
+        ("/api/moped-entries/dashboard/", ()): 3,
+    }
+
+    def _consume(self, response):
+        if response.streaming:
+            b"".join(response.streaming_content)
+
+    def test_endpoint_budgets(self):
+        for count in (20, 80):
+            populate(count)
+            for (path, params), budget in self.BUDGETS.items():
+                with self.subTest(count=count, path=path, params=params):
+                    caches[settings.MOPED_RESPONSE_CACHE].clear()
+                    with self.assertNumQueries(budget):
+                        self._consume(self.client.get(path, dict(params)))
+
+    def test_sync_budget(self):
+        """A sync with nothing new reads the cursor, finds nothing stale and writes the cursor back,
+        whatever the sheet size"""
+        for count in (20, 80):
+            stub = StubSheetsClient(sheet_rows(synthetic_rows(count)))
+            service = GoogleSheetsService(service=stub, spreadsheet_id="budget", range_name="Form Responses 1!A2:E")
+            service.sync_from_sheets(full=True)
+            with self.subTest(count=count), self.assertNumQueries(3):
+                service.sync_from_sheets()
+            self.assertEqual(stub.requests[-1], f"Form Responses 1!A{count - 3}:E")
+
+
+class BenchmarkCommandTest(SimpleTestCase):
+    def test_refuses_the_live_database(self):
+        """The benchmark holds the write lock for minutes, so it only runs in a new database"""
+        with self.assertRaisesMessage(CommandError, "must not be the live database"):
+            call_command("benchmark", "--database", settings.DATABASES["default"]["NAME"], stdout=StringIO())
+        with tempfile.NamedTemporaryFile(suffix=".sqlite3") as existing:
+            with self.assertRaisesMessage(CommandError, "already exists"):
+                call_command("benchmark", "--database", existing.name, stdout=StringIO())
+
+
+@patch("moped.jobs._executor")
+class SyncJobTest(MopedAPITestCase):
+    """Tests for background sync jobs"""
+
+    def test_post_starts_job(self, mock_executor):
+        """POST /sync/ should queue a job and point at its status URL"""
+        response = self.client.post("/api/moped-entries/sync/")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["status"], "pending")
+        self.assertTrue(response["Location"].endswith(f"/api/moped-entries/sync/{response.data['id']}/"))
+        mock_executor.submit.assert_called_once()
+
+    def test_concurrent_triggers_join_running_job(self, mock_executor):
+        """A second trigger while a job is in flight should get the same job back"""
+        first = self.client.post("/api/moped-entries/sync/")
+        second = self.client.post("/api/moped-entries/sync/?full=true")
+        self.assertEqual(second.data["id"], first.data["id"])
+        mock_executor.submit.assert_called_once()
+
+    @patch("moped.jobs.GoogleSheetsService")
+    def test_job_records_result(self, mock_service, mock_executor):
+        """Running the job should record the sync counts, visible on the status endpoint"""
+        mock_service.return_value.sync_from_sheets.return_value = SyncResult(created=2, unchanged=1)
+        job_id = self.client.post("/api/moped-entries/sync/").data["id"]
+        run_job(job_id)
+
+        response = self.client.get(f"/api/moped-entries/sync/{job_id}/")
+        self.assertEqual(response.data["status"], "succeeded")
+        self.assertEqual((response.data["created"], response.data["unchanged"]), (2, 1))
+
+        # Finished jobs no longer block new ones
+        self.assertNotEqual(self.client.post("/api/moped-entries/sync/").data["id"], job_id)
+
+    @patch("moped.jobs.GoogleSheetsService")
+    def test_job_records_failure(self, mock_service, mock_executor):
+        mock_service.return_value.sync_from_sheets.side_effect = RuntimeError("quota exceeded")
+        job_id = self.client.post("/api/moped-entries/sync/").data["id"]
+        with self.assertLogs("moped.jobs", level="ERROR"):
+            run_job(job_id)
+
+        response = self.client.get(f"/api/moped-entries/sync/{job_id}/")
+        self.assertEqual(response.data["status"], "failed")
+        self.assertEqual(response.data["error"], "quota exceeded")
+
+    def test_abandoned_job_does_not_block(self, mock_executor):
+        """A job stuck in flight past the timeout should be failed and replaced"""
+        stuck = SyncJob.objects.create(status=SyncJob.Status.RUNNING)
+        SyncJob.objects.filter(pk=stuck.pk).update(created_at=datetime(2020, 1, 1, tzinfo=dt_timezone.utc))
+
+        response = self.client.post("/api/moped-entries/sync/")
+        self.assertNotEqual(response.data["id"], str(stuck.pk))
+        stuck.refresh_from_db()
+        self.assertEqual(stuck.status, SyncJob.Status.FAILED)
+
+    def test_claim_that_loses_a_race_joins_the_winner(self, mock_executor):
+        """When another process inserts its job between the check and the insert, that job is returned"""
+        other = SyncJob.objects.create(status=SyncJob.Status.RUNNING)
+        with patch("moped.jobs._active_job", side_effect=[None, other]):
+            self.assertEqual(claim_job(), (other, False))
+
+        # Another process holding SQLite's write lock counts as a claim in flight too
+        with (
+            patch("moped.jobs._active_job", side_effect=[None, other]),
+            patch("moped.jobs.SyncJob.objects.create", side_effect=OperationalError("database is locked")),
+        ):
+            self.assertEqual(claim_job(), (other, False))
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SyncJob.objects.create()
+
+    @patch("moped.jobs.GoogleSheetsService")
+    def test_sync_sheets_command_runs_as_a_job(self, mock_service, mock_executor):
+        """sync_sheets should record a job, and not sync while another job is in flight"""
+        mock_service.return_value.sync_from_sheets.return_value = SyncResult(created=2, unchanged=1)
+        out = StringIO()
+        call_command("sync_sheets", "--full", stdout=out)
+        self.assertIn("Synced 3 entries (2 created, 0 updated, 1 unchanged)", out.getvalue())
+        job = SyncJob.objects.get()
+        self.assertEqual((job.status, job.full), (SyncJob.Status.SUCCEEDED, True))
+
+        running = SyncJob.objects.create(status=SyncJob.Status.RUNNING)
+        out = StringIO()
+        call_command("sync_sheets", stdout=out)
+        self.assertIn(f"Sync job {running.pk} is already running", out.getvalue())
+        mock_service.return_value.sync_from_sheets.assert_called_once()
+
+    def test_unknown_job(self, mock_executor):
+        response = self.client.get("/api/moped-entries/sync/00000000-0000-0000-0000-000000000000/")
+        self.assertEqual(response.status_code, 404)
+        for job_id in ("abc", "0-0", "00000000-0000-0000-0000-00000000000"):
+            with self.subTest(job_id=job_id):
+                self.assertEqual(self.client.get(f"/api/moped-entries/sync/{job_id}/").status_code, 404)
+
+
+@patch("moped.jobs.GoogleSheetsService")
+class SyncDaemonTest(TestCase):
+    """Tests for the resident sync loop"""
+
+    def _sample(self, name):
+        return REGISTRY.get_sample_value(name)
+
+    def test_interval_adapts_to_new_rows(self, mock_service):
+        schedule = PollSchedule(minimum=60, maximum=400, backoff_max=1800)
+        self.assertEqual([schedule.succeeded(found_rows=False) for _ in range(4)], [120, 240, 400, 400])
+        self.assertEqual(schedule.succeeded(found_rows=True), 60)
+
+    def test_backoff_grows_with_jitter(self, mock_service):
+        schedule = PollSchedule(minimum=60, maximum=400, backoff_max=300)
+        with patch("moped.daemon.random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual([schedule.failed() for _ in range(4)], [60, 120, 240, 300])
+            self.assertEqual(schedule.failed(wait_at_least=900), 900)
+        delay = schedule.failed()
+        self.assertTrue(150 <= delay <= 300)
+        schedule.succeeded(found_rows=False)
+        self.assertEqual(schedule.failures, 0)
+
+    def test_poll_runs_a_sync_job(self, mock_service):
+        mock_service.return_value.sync_from_sheets.return_value = SyncResult(created=2)
+        daemon = SyncDaemon()
+        daemon.schedule.interval = daemon.schedule.maximum
+
+        self.assertEqual(daemon.poll(), daemon.schedule.minimum)
+        self.assertEqual(SyncJob.objects.get().status, SyncJob.Status.SUCCEEDED)
+        self.assertAlmostEqual(self._sample("moped_sync_daemon_heartbeat_timestamp_seconds"), time.time(), delta=5)
+        self.assertEqual(self._sample("moped_sync_daemon_consecutive_failures"), 0)
+
+        # A job started from the API is left to finish
+        SyncJob.objects.create(status=SyncJob.Status.RUNNING)
+        self.assertEqual(daemon.poll(), daemon.schedule.minimum)
+        mock_service.return_value.sync_from_sheets.assert_called_once()
+
+    def test_quota_error_backs_off_for_retry_after(self, mock_service):
+        quota = HttpError(httplib2.Response({"status": 429, "retry-after": "600"}), b"Quota exceeded")
+        mock_service.return_value.sync_from_sheets.side_effect = quota
+        with self.assertLogs("moped", level="WARNING"):
+            delay = SyncDaemon().poll()
+
+        self.assertGreaterEqual(delay, 600)
+        self.assertEqual(SyncJob.objects.get().status, SyncJob.Status.FAILED)
+        self.assertEqual(self._sample("moped_sync_daemon_consecutive_failures"), 1)
+
+    def test_sigterm_stops_after_current_sync(self, mock_service):
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+
+        def sync(full=False):
+            os.kill(os.getpid(), signal.SIGTERM)
+            return SyncResult(unchanged=1)
+
+        mock_service.return_value.sync_from_sheets.side_effect = sync
+        daemon = SyncDaemon()
+        daemon.install_signal_handlers()
+        with patch.object(daemon.stopping, "wait") as wait:
+            daemon.run()
+
+        mock_service.return_value.sync_from_sheets.assert_called_once()
+        wait.assert_called_once()
+        self.assertEqual(signal.getsignal(signal.SIGTERM), signal.SIG_DFL)
+
+
+class ImportEntriesTest(MopedAPITestCase):
+    """Tests for `manage.py import_entries`"""
+
+    def _import(self, content, suffix, *args):
+        with tempfile.NamedTemporaryFile("w", suffix=suffix, encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            out = io.StringIO()
+            call_command("import_entries", f.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_is_validated_and_written_in_batches(self):
+        lines = ["Timestamp,Odometer,Liters,Cost per liter,Total,Notes"]
+        lines += [f"{day:02d}/01/2025 10:00:00,{1000 + day * 50},2.5,1.80,4.50,day {day}" for day in range(1, 8)]
+        lines.insert(3, "03/01/2025 11:00:00,broken,2.5")
+
+        with patch("moped.management.commands.import_entries.refresh_derived", wraps=refresh_derived) as refresh:
+            output = self._import("\n".join(lines) + "\n", ".csv", "--batch-size", "3", "--progress-every", "3")
+
+        self.assertEqual(FuelEntry.objects.count(), 7)
+        self.assertEqual(FuelEntry.objects.get(odometer_km=1200).notes, "day 4")
+        self.assertEqual(FillupSegment.objects.count(), 6)
+        refresh.assert_called_once()
+        self.assertIn("7 created", output)
+        self.assertIn("Skipped 1 rows: {'invalid_number': 1}", output)
+        self.assertIn("6 rows read", output)
+
+    def test_backfill_below_existing_entries_is_refreshed_in_batches(self):
+        """Older entries imported under a populated table are refreshed incrementally, a few segments at a time"""
+        rows = synthetic_rows(60)
+        populate_rows, backfill = rows[40:], rows[25:40]
+        upsert_entries(populate_rows)
+        refresh_derived(full=True)
+
+        csv_text = "".join(",".join(row) + "\n" for row in sheet_rows(backfill))
+        with patch("moped.derived.BATCH_SIZE", 4), patch("moped.derived.rebuild_segments") as rebuild:
+            self._import(csv_text, ".csv")
+
+        rebuild.assert_not_called()
+        self.assertEqual(FuelEntry.objects.count(), 35)
+        self.assertEqual(
+            [segment.as_pair() for segment in FillupSegment.objects.all()],
+            fillup_pairs(FuelEntry.objects.all()),
+        )
+        prefixes = EntryPrefix.objects.values_list("entry_id", "cumulative_fuel_liters", "cumulative_spend")
+        incremental = list(prefixes)
+        rebuild_prefixes()
+        self.assertEqual(incremental, list(prefixes))
+
+    def test_export_round_trips(self):
+        populate(30)
+        FuelEntry.objects.filter(pk=FuelEntry.objects.first().pk).update(notes='Täydennys, "premium"', total_spend=None)
+        expected = [dict(row, id=None) for row in FuelEntrySerializer(FuelEntry.objects.all(), many=True).data]
+        export = b"".join(self.client.get("/api/moped-entries/export/").streaming_content).decode()
+
+        FuelEntry.objects.all().delete()
+        self._import(export, ".ndjson")
+
+        imported = [dict(row, id=None) for row in FuelEntrySerializer(FuelEntry.objects.all(), many=True).data]
+        self.assertEqual(imported, expected)
+
+    def test_ndjson_cell_arrays_and_bad_lines(self):
+        lines = [
+            json.dumps(["01/20/2025 10:00:00", "1000", "3.0"]),
+            "",
+            json.dumps(["01/25/2025 10:00:00", "1100", "2.5", "1.80", "4.50"]),
+            "{not json",
+            json.dumps(42),
+        ]
+        output = self._import("\n".join(lines), ".jsonl")
+
+        self.assertEqual(FuelEntry.objects.count(), 2)  # month-first dates detected
+        self.assertIn("Skipped 2 rows: {'too_short': 2}", output)
+
+    def test_unknown_format(self):
+        with self.assertRaises(CommandError):
+            self._import("", ".txt")
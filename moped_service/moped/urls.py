@@ -1,10 +1,11 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import FuelEntryViewSet
+from .views import FuelEntryViewSet, RequestProfileViewSet
 
 router = DefaultRouter()
 router.register(r"moped-entries", FuelEntryViewSet, basename="moped-entry")
+router.register(r"profiles", RequestProfileViewSet, basename="profile")
 
 urlpatterns = [
     path("", include("django_prometheus.urls")),  # Prometheus metrics endpoint
@@ -0,0 +1,175 @@
+"""NumPy implementations of the per-segment calculations.
+
+Selected with CALCULATION_ENGINE=numpy, and used wherever every entry is
+read: the dashboard's pass (calculations.entry_pass) and the full rebuild
+of fillup segments and monthly rollups in derived.py. Columns are fetched
+with values_list() instead of building model instances, and the
+differences, ratios and day counts are computed as array operations.
+Rounding is still done with Python's round() per value, and sums run in the
+same order as the pure-Python code, so results match calculations.py
+exactly. The columns are held in memory whole rather than read in chunks.
+
+NumPy is optional; when it is not installed calculations.py falls back to
+the pure-Python code.
+"""
+
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from .calculations import month_summary
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    np = None
+
+
+def available():
+    return np is not None
+
+
+def _naive_utc(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _columns(qs, *extra):
+    """Odometer, timestamp, fuel and spend columns in odometer order, followed by the values of any `extra` fields"""
+    fields = ["odometer_km", "timestamp", "fuel_liters", "total_spend", *extra]
+    rows = list(qs.order_by("odometer_km", "pk").values_list(*fields))
+    if len(rows) < 2:
+        return None
+    odometer, timestamps, fuel, spend, *rest = zip(*rows)
+    return (
+        np.array(odometer, dtype=np.float64),
+        np.array([_naive_utc(value) for value in timestamps], dtype="datetime64[us]"),
+        np.array(fuel, dtype=np.float64),
+        spend,
+        *rest,
+    )
+
+
+def _segments(columns):
+    """Per-segment arrays; index i describes the segment ending at entry i + 1"""
+    odometer, timestamps, fuel, spend = columns[:4]
+    distance = np.diff(odometer)
+    positive = distance > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        l_per_100km = np.where(positive, (fuel[1:] / distance) * 100, 0.0)
+    days = np.diff(timestamps) // np.timedelta64(1, "D")
+    dates = np.datetime_as_string(timestamps[1:].astype("datetime64[D]"))
+    return {
+        "distance": distance,
+        "positive": positive,
+        "fuel": fuel[1:],
+        "l_per_100km": l_per_100km,
+        "days": days,
+        "dates": dates,
+        "spend": spend[1:],
+    }
+
+
+def _pairs(seg):
+    """fillup_pairs() items for per-segment arrays"""
+    pairs = []
+    for date, distance, positive, fuel, l_per_100km, days, spend in zip(
+        seg["dates"].tolist(),
+        seg["distance"].tolist(),
+        seg["positive"].tolist(),
+        seg["fuel"].tolist(),
+        seg["l_per_100km"].tolist(),
+        seg["days"].tolist(),
+        seg["spend"],
+    ):
+        cost = float(spend) if spend else None
+        pairs.append(
+            {
+                "date": date,
+                "distance_km": round(distance, 1),
+                "fuel_liters": fuel,
+                "l_per_100km": round(l_per_100km, 2) if positive else 0,
+                "cost": cost,
+                "cost_per_km": round(cost / distance, 3) if positive and cost else None,
+                "days": days,
+            }
+        )
+    return pairs
+
+
+def fillup_pairs(qs):
+    """Vectorized calculations.fillup_pairs"""
+    columns = _columns(qs)
+    if columns is None:
+        return []
+    return _pairs(_segments(columns))
+
+
+def segment_rows(qs):
+    """What derived.rebuild_segments() writes: (start pk, end pk, end odometer_km, end timestamp, stats)
+    per segment in odometer order, with stats as calculations.segment_stats() returns them"""
+    columns = _columns(qs, "pk", "timestamp")
+    if columns is None:
+        return []
+    odometer, pks, timestamps = columns[0].tolist(), columns[4], columns[5]
+    return [
+        (pks[index], pks[index + 1], odometer[index + 1], timestamps[index + 1], pair)
+        for index, pair in enumerate(_pairs(_segments(columns)))
+    ]
+
+
+def entry_pass(qs, want_pairs=True):
+    """Vectorized calculations.entry_pass"""
+    columns = _columns(qs)
+    if columns is None:
+        return None, []
+    odometer, _, fuel, spend = columns
+    totals = None
+    distance = float(odometer[-1] - odometer[0])
+    if distance > 0:
+        cents = sum(int(value * 100) for value in spend[1:] if value)
+        totals = {
+            "distance_km": distance,
+            "fuel_liters": float(np.cumsum(fuel[1:])[-1]),
+            "total_spend": float(Decimal(cents).scaleb(-2)),
+        }
+    return totals, _pairs(_segments(columns)) if want_pairs else []
+
+
+def _month_sums(seg):
+    """(month, segments, distance, fuel, cost) per month, summed as calculations.month_totals() sums them"""
+    distance = np.array([round(value, 1) for value in seg["distance"].tolist()], dtype=np.float64)
+    cents = np.array([int(spend * 100) if spend else 0 for spend in seg["spend"]], dtype=np.int64)
+    months, group = np.unique(seg["dates"].astype("U7"), return_inverse=True)
+
+    # A stable sort keeps each month's segments in odometer order, so the
+    # running sums below add values in the same order as the Python engine
+    order = np.argsort(group, kind="stable")
+    bounds = np.flatnonzero(np.diff(group[order])) + 1
+    for month, indices in zip(months.tolist(), np.split(order, bounds)):
+        month_distance = float(np.cumsum(distance[indices])[-1])
+        month_fuel = float(np.cumsum(seg["fuel"][indices])[-1])
+        month_cost = Decimal(int(cents[indices].sum())).scaleb(-2)
+        yield month, len(indices), month_distance, month_fuel, month_cost
+
+
+def monthly_summary(qs):
+    """Vectorized calculations.monthly_summary"""
+    columns = _columns(qs)
+    if columns is None:
+        return []
+    return [
+        month_summary(month, distance, fuel, cost) for month, _, distance, fuel, cost in _month_sums(_segments(columns))
+    ]
+
+
+def month_segments(qs):
+    """calculations.month_totals() over the segments of `qs`, with each month's segment count:
+    {month: (count, sums)}"""
+    columns = _columns(qs)
+    if columns is None:
+        return {}
+    return {
+        month: (count, {"distance": distance, "fuel": fuel, "cost": cost})
+        for month, count, distance, fuel, cost in _month_sums(_segments(columns))
+    }
@@ -1,62 +1,210 @@
+import csv
+import itertools
+import json
+from datetime import datetime, time
+
+from django.db.models import Count, Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from rest_framework import status, viewsets
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from rest_framework.utils.encoders import JSONEncoder
 
-from .calculations import cost_per_km, fillup_pairs, fuel_efficiency, monthly_summary, service_status
-from .metrics import (
-    cost_per_km_gauge,
-    current_odometer,
-    days_since_last_fueling,
-    entries_synced_last,
-    km_until_service,
-    sync_operations_total,
+from .caching import cached_response
+from .calculations import (
+    DASHBOARD_SECTIONS,
+    cost_per_km_from_totals,
+    dashboard,
+    efficiency_from_totals,
+    entry_pass,
+    entry_totals,
+    month_summary,
+    rolling_efficiency,
+    rolling_row,
+    service_status,
+    summarise_months,
+    window_totals,
 )
-from .models import FuelEntry
-from .serializers import FuelEntrySerializer
-from .services import GoogleSheetsService
+from .jobs import start_sync
+from .metrics import QueryTracker
+from .models import EntryPrefix, FillupSegment, FuelEntry, MonthlyRollup, RequestProfile, SyncJob
+from .pagination import EntryPagination
+from .renderers import CSVRenderer, NDJSONRenderer
+from .serializers import FuelEntrySerializer, RequestProfileSerializer, SyncJobSerializer, ValuesSerializer
+
+# Rows fetched per database round trip while streaming an export
+EXPORT_CHUNK_SIZE = 2000
+
+# A SyncJob id as str(uuid) writes it; anything else 404s instead of failing the UUID lookup
+UUID_PATTERN = "[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+
+DEFAULT_ROLLING_FILLUPS = 5
+ROLLING_FIELDS = ["date", "odometer_km", "distance_km", "fuel_liters", "l_per_100km"]
+
+# Dashboard sections computed from a pass over every entry; the others only need the newest one
+DASHBOARD_PASS_SECTIONS = {"efficiency", "fillups", "monthly"}
+
+RANGE_ERROR = "Invalid range. Use ?from= and ?to= with ISO dates (YYYY-MM-DD) or datetimes"
+KM_RANGE_ERROR = "Invalid range. Use numeric ?from_km= and ?to_km="
+
+
+def _range_bound(value):
+    """Aware datetime for an ISO date (midnight) or datetime query value"""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = datetime.combine(day, time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def timestamp_range(params, field="timestamp"):
+    """Filters for the half-open range ?from= (inclusive) to ?to= (exclusive).
+
+    Plain comparisons on the column, rather than __year/__month/__date
+    lookups, so the timestamp index can be used. Raises ValueError for
+    unparseable bounds."""
+    filters = {}
+    if params.get("from"):
+        filters[f"{field}__gte"] = _range_bound(params["from"])
+    if params.get("to"):
+        filters[f"{field}__lt"] = _range_bound(params["to"])
+    return filters
+
+
+class _Echo:
+    """File-like object for csv.writer that hands each line back instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def _tracked(content, tracker):
+    """Streamed content that stops `tracker` once it is consumed or closed"""
+    try:
+        yield from content
+    finally:
+        tracker.stop()
 
 
 class FuelEntryViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API endpoints for moped fuel tracking
 
-    GET /api/moped-entries/ - List all entries
+    GET /api/moped-entries/ - List all entries (?pagination=cursor for keyset paging)
+    GET /api/moped-entries/export/?format=csv - Stream all entries as NDJSON or CSV
     GET /api/moped-entries/{id}/ - Get specific entry
-    POST /api/moped-entries/sync/ - Sync from Google Sheets
+    POST /api/moped-entries/sync/ - Start a background sync from Google Sheets (?full=true to re-read everything)
+    GET /api/moped-entries/sync/{job_id}/ - Sync job status
     GET /api/moped-entries/last-fillup/ - Get last fuel entry
-    GET /api/moped-entries/efficiency/?month=2025-01 - Fuel efficiency
-    GET /api/moped-entries/fillups/ - Per-segment analysis
+    GET /api/moped-entries/efficiency/?month=2025-01 - Fuel efficiency (also ?from_km=&to_km=)
+    GET /api/moped-entries/fillups/?page=1 - Per-segment analysis
     GET /api/moped-entries/monthly/ - Monthly summaries
+    GET /api/moped-entries/rolling/?fillups=5 - Stream rolling l/100km (or ?days=30)
+    (efficiency, fillups and monthly also take ?from=2025-01-01&to=2025-04-01, a half-open timestamp range)
     GET /api/moped-entries/service-status/ - Service reminders
+    GET /api/moped-entries/dashboard/?fields=efficiency,monthly - Several of the above in one response (default all)
 
     """
 
     queryset = FuelEntry.objects.all()
     serializer_class = FuelEntrySerializer
+    pagination_class = EntryPagination
+
+    def dispatch(self, request, *args, **kwargs):
+        """Handle a request, observing its database queries per action (see metrics.QueryTracker).
+        A streamed response is tracked until its content has been sent."""
+        method = request.method.lower()
+        tracker = QueryTracker(self.action_map.get(method, method)).start()
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except BaseException:
+            tracker.stop()
+            raise
+        if response.streaming:
+            response.streaming_content = _tracked(response.streaming_content, tracker)
+        else:
+            tracker.stop()
+        return response
 
     @action(detail=False, methods=["post"])
     def sync(self, request):
-        """Sync data from Google Sheets"""
+        """Start a background sync from Google Sheets, or join the one already running"""
+        job, started = start_sync(full=request.query_params.get("full") == "true")
+        response = Response(SyncJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        response["Location"] = reverse("moped-entry-sync-status", kwargs={"job_id": job.pk}, request=request)
+        return response
+
+    @action(detail=False, methods=["get"], url_path=rf"sync/(?P<job_id>{UUID_PATTERN})", url_name="sync-status")
+    def sync_status(self, request, job_id):
+        """Status of a sync job"""
+        job = get_object_or_404(SyncJob, pk=job_id)
+        return Response(SyncJobSerializer(job).data)
+
+    def _stream(self, request, rows, fieldnames, filename):
+        """Stream dict rows as NDJSON, or CSV when that renderer was negotiated"""
+        if request.accepted_renderer.format == "csv":
+            writer = csv.DictWriter(_Echo(), fieldnames=list(fieldnames))
+            lines = itertools.chain([writer.writeheader()], (writer.writerow(row) for row in rows))
+            filename = f"{filename}.csv"
+        else:
+            lines = (json.dumps(row, cls=JSONEncoder) + "\n" for row in rows)
+            filename = f"{filename}.ndjson"
+
+        response = StreamingHttpResponse(lines, content_type=request.accepted_renderer.media_type)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        """List entries, serialized straight from database rows (see ValuesSerializer)"""
+        values = ValuesSerializer(self.get_serializer_class())
+        rows = values.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(values.many(page))
+        return Response(values.many(rows))
+
+    @action(detail=False, methods=["get"], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """Stream every entry, newest first, as NDJSON (default) or CSV (?format=csv)"""
+        values = ValuesSerializer(self.get_serializer_class())
+        entries = values.rows(self.get_queryset().order_by("-timestamp", "-id")).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        return self._stream(request, map(values.to_representation, entries), values.names, "moped-entries")
+
+    def _rolling_window(self, params):
+        """{"fillups": N} or {"days": N} from the query, or None if invalid"""
+        if "days" in params and "fillups" in params:
+            return None
+        name = "days" if "days" in params else "fillups"
         try:
-            sheets_service = GoogleSheetsService()
-            count = sheets_service.sync_from_sheets()
-            sync_operations_total.labels(status="success").inc()
-            entries_synced_last.set(count)
-            last_entry = FuelEntry.objects.first()
-            if last_entry:
-                current_odometer.set(last_entry.odometer_km)
-                days = (timezone.now() - last_entry.timestamp).days
-                days_since_last_fueling.set(days)
-            cost = cost_per_km(FuelEntry.objects.all())
-            if cost is not None:
-                cost_per_km_gauge.set(cost)
-            return Response({"status": "success", "entries_synced": count})
-        except Exception as e:
-            sync_operations_total.labels(status="error").inc()
-            return Response({"status": "error", "message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            size = int(params.get(name, DEFAULT_ROLLING_FILLUPS))
+        except ValueError:
+            return None
+        return {name: size} if size > 0 else None
+
+    @action(detail=False, methods=["get"], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def rolling(self, request):
+        """Stream rolling l/100km per fillup, in odometer order, as NDJSON (default) or CSV.
+        ?fillups=N (default 5) averages over the last N fillups, ?days=N over the last N days."""
+        window = self._rolling_window(request.query_params)
+        if window is None:
+            return Response(
+                {"error": "Use one of ?fillups=N or ?days=N with a positive whole number"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        values = rolling_efficiency(self.get_queryset(), **window).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        return self._stream(request, map(rolling_row, values), ROLLING_FIELDS, "moped-rolling")
 
     @action(detail=False, methods=["get"], url_path="last-fillup")
+    @cached_response
     def last_fillup(self, request):
         """Get the most recent fuel entry"""
         last_entry = FuelEntry.objects.first()  # Already ordered by -timestamp
@@ -65,47 +213,126 @@ class FuelEntryViewSet(viewsets.ReadOnlyModelViewSet):
             return Response(serializer.data)
         return Response({"message": "No fuel entries found"}, status=status.HTTP_404_NOT_FOUND)
 
+    def _range_filters(self, field="timestamp"):
+        """timestamp_range() for this request, or None if a bound is invalid"""
+        try:
+            return timestamp_range(self.request.query_params, field)
+        except ValueError:
+            return None
+
+    def _range_error(self, message=RANGE_ERROR):
+        return Response({"error": message}, status=status.HTTP_400_BAD_REQUEST)
+
+    def _km_window(self, params):
+        """First and last EntryPrefix rows with from_km <= odometer <= to_km (either bound optional)"""
+        prefixes = EntryPrefix.objects.all()
+        if params.get("from_km"):
+            prefixes = prefixes.filter(odometer_km__gte=float(params["from_km"]))
+        if params.get("to_km"):
+            prefixes = prefixes.filter(odometer_km__lte=float(params["to_km"]))
+        return (
+            prefixes.order_by("odometer_km", "entry_id").first(),
+            prefixes.order_by("-odometer_km", "-entry_id").first(),
+        )
+
+    def _date_window(self, filters):
+        """Lowest and highest EntryPrefix rows by odometer in a timestamp range, or None if their running
+        totals would not cover exactly the entries in the range.
+
+        That happens when readings are out of time order (e.g. a corrected
+        reading): an entry from outside the range whose reading falls between
+        the two would be counted too, so the caller aggregates instead."""
+        prefixes = EntryPrefix.objects.filter(**filters)
+        start = prefixes.order_by("odometer_km", "entry_id").first()
+        end = prefixes.order_by("-odometer_km", "-entry_id").first()
+        if start is None:
+            return start, end
+
+        # Every entry in the range lies in the spanned stretch, so equal counts mean the same entries
+        spanned = EntryPrefix.objects.filter(
+            Q(odometer_km__gt=start.odometer_km) | Q(odometer_km=start.odometer_km, entry_id__gte=start.entry_id),
+            Q(odometer_km__lt=end.odometer_km) | Q(odometer_km=end.odometer_km, entry_id__lte=end.entry_id),
+        ).aggregate(spanned=Count("pk"), in_range=Count("pk", filter=Q(**filters)))
+        if spanned["spanned"] != spanned["in_range"]:
+            return None
+        return start, end
+
     @action(detail=False, methods=["get"])
+    @cached_response
     def efficiency(self, request):
-        """Get fuel efficiency stats"""
-        qs = self.get_queryset()
-        month_str = request.query_params.get("month")
+        """Get fuel efficiency stats (?month=YYYY-MM, ?from=&to= for any date range,
+        or ?from_km=&to_km= for an odometer range). Ranges are read from running totals
+        in a few index lookups, however many entries they span; a date range whose
+        readings are out of time order is aggregated instead."""
+        params = request.query_params
+        month_str = params.get("month")
+        filters = self._range_filters()
+        if filters is None:
+            return self._range_error()
 
         if month_str:
             try:
                 year, month = map(int, month_str.split("-"))
-                qs = qs.filter(timestamp__year=year, timestamp__month=month)
             except ValueError:
                 return Response(
                     {"error": "Invalid month format. Use YYYY-MM"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
+            rollup = MonthlyRollup.objects.filter(month=f"{year:04d}-{month:02d}").first()
+            totals = rollup.entry_totals() if rollup else None
+        elif params.get("from_km") or params.get("to_km"):
+            try:
+                totals = window_totals(*self._km_window(params))
+            except ValueError:
+                return self._range_error(KM_RANGE_ERROR)
+        elif filters:
+            window = self._date_window(filters)
+            totals = window_totals(*window) if window else entry_totals(self.get_queryset().filter(**filters))
+        else:
+            totals = entry_totals(self.get_queryset())
 
-        result = fuel_efficiency(qs)
+        result = efficiency_from_totals(totals)
         if result is None:
             return Response(
                 {"error": "Not enough data"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        cost = cost_per_km(qs)
+        cost = cost_per_km_from_totals(totals)
         return Response({"l_per_100km": result, "km_per_liter": round(100 / result, 2), "cost_per_km": cost})
 
     @action(detail=False, methods=["get"])
+    @cached_response
     def fillups(self, request):
-        """Get per-segment fillup analysis"""
-        qs = self.get_queryset()
-        pairs = fillup_pairs(qs)
-        return Response(pairs)
+        """Get per-segment fillup analysis (pass ?page=N for paginated results).
+        ?from=&to= select segments by the timestamp of the fillup that ends them."""
+        filters = self._range_filters()
+        if filters is None:
+            return self._range_error()
+        segments = FillupSegment.objects.filter(**filters)
+        if "page" in request.query_params:
+            page = self.paginate_queryset(segments)
+            return self.get_paginated_response([segment.as_pair() for segment in page])
+        return Response([segment.as_pair() for segment in segments])
 
     @action(detail=False, methods=["get"])
+    @cached_response
     def monthly(self, request):
-        """Get monthly fuel summary"""
-        qs = self.get_queryset()
-        summary = monthly_summary(qs)
+        """Get monthly fuel summary.
+        With ?from=&to=, only segments ending in the range count, so months at either end may be partial."""
+        filters = self._range_filters()
+        if filters is None:
+            return self._range_error()
+        if filters:
+            segments = FillupSegment.objects.filter(**filters)
+            return Response(summarise_months(segment.as_pair() for segment in segments))
+
+        rollups = MonthlyRollup.objects.filter(segment_count__gt=0)
+        summary = [month_summary(r.month, r.distance_km, r.fuel_liters, r.cost) for r in rollups]
         return Response(summary)
 
     @action(detail=False, methods=["get"], url_path="service-status")
+    @cached_response
     def service_reminder(self, request):
         """Get service reminders based on current odometer reading
         (requires at least one fuel entry to determine current odometer)"""
@@ -116,7 +343,61 @@ class FuelEntryViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_404_NOT_FOUND,
             )
         result = service_status(last_entry.odometer_km)
-        for item in result:
-            km_until_service.labels(service_type=item["service"]).set(item["km_remaining"])
+        return Response(result)
 
+    @action(detail=False, methods=["get"])
+    @cached_response
+    def dashboard(self, request):
+        """last-fillup, efficiency, fillups, monthly and service-status in one response:
+        one ordered read of the entries feeds every per-entry figure, plus an index lookup
+        for the newest entry. ?fields= picks sections (comma-separated).
+        Sections without enough data are null rather than errors."""
+        fields = request.query_params.get("fields")
+        sections = [field.strip() for field in fields.split(",")] if fields else list(DASHBOARD_SECTIONS)
+        unknown = set(sections) - set(DASHBOARD_SECTIONS)
+        if unknown:
+            return Response(
+                {"error": f"Unknown fields: {', '.join(sorted(unknown))}. Use any of {', '.join(DASHBOARD_SECTIONS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        totals, pairs = None, []
+        if DASHBOARD_PASS_SECTIONS.intersection(sections):
+            totals, pairs = entry_pass(self.get_queryset(), want_pairs="fillups" in sections or "monthly" in sections)
+        newest = None
+        if "last_fillup" in sections or "service_status" in sections:
+            newest = FuelEntry.objects.first()
+
+        result = dashboard(totals, pairs, newest, sections)
+        if result.get("last_fillup") is not None:
+            result["last_fillup"] = self.get_serializer(result["last_fillup"]).data
         return Response(result)
+
+
+class RequestProfileViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Request profiles captured by moped.profiling (admin users only)
+
+    GET /api/profiles/ - List profiles, newest first
+    GET /api/profiles/{id}/ - Profile details
+    GET /api/profiles/{id}/download/ - The profile: a pstats file, or collapsed stacks for a flame graph
+
+    """
+
+    queryset = RequestProfile.objects.defer("data")
+    serializer_class = RequestProfileSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    DOWNLOADS = {
+        RequestProfile.Format.PSTATS: ("application/octet-stream", "prof"),
+        RequestProfile.Format.COLLAPSED: ("text/plain; charset=utf-8", "collapsed.txt"),
+    }
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        """The raw profile, as an attachment"""
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        content_type, extension = self.DOWNLOADS[profile.format]
+        response = HttpResponse(bytes(profile.data), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="profile-{profile.pk}.{extension}"'
+        return response
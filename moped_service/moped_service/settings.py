@@ -48,6 +48,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "moped.profiling.ProfilingMiddleware",  # removes itself unless PROFILING is on
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "django_prometheus.middleware.PrometheusAfterMiddleware",
@@ -84,6 +85,41 @@ DATABASES = {
     }
 }
 
+# Applied to every new SQLite connection (see moped/db.py). WAL lets API reads and metric scrapes
+# carry on while a sync is writing; busy_timeout makes a second writer wait instead of failing.
+MOPED_SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": config("SQLITE_MMAP_SIZE", default=256 * 1024 * 1024, cast=int),
+    "cache_size": -config("SQLITE_CACHE_SIZE_KB", default=64 * 1024, cast=int),  # negative: KiB, not pages
+    "busy_timeout": config("SQLITE_BUSY_TIMEOUT_MS", default=5000, cast=int),
+}
+
+# Optionally send reads made outside a transaction to a separate read-only connection
+MOPED_READ_DATABASE = "read" if config("SQLITE_READ_CONNECTION", default=False, cast=bool) else None
+if MOPED_READ_DATABASE:
+    DATABASES[MOPED_READ_DATABASE] = {**DATABASES["default"], "TEST": {"MIRROR": "default"}}
+    DATABASE_ROUTERS = ["moped.db.ReadRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "moped": {
+        # Use django.core.cache.backends.filebased.FileBasedCache with a directory LOCATION to share between workers
+        "BACKEND": config("MOPED_CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("MOPED_CACHE_LOCATION", default="moped-responses"),
+        "TIMEOUT": None,
+        "OPTIONS": {
+            "MAX_ENTRIES": config("MOPED_CACHE_MAX_ENTRIES", default=1000, cast=int),
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -128,11 +164,62 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "moped.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 100,
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
+# Moped sync
+# Extra sheets to sync instead of GOOGLE_SHEET_ID/GOOGLE_SHEET_RANGE: "spreadsheet_id:range" entries separated by ";"
+MOPED_SHEET_SOURCES = config("GOOGLE_SHEET_SOURCES", default="")
+
+# Base URL for Sheets API requests; empty for Google's. Point it at a local stub server for testing.
+MOPED_SHEETS_API_ROOT = config("SHEETS_API_ROOT", default="")
+
+# Spreadsheets fetched concurrently during a sync (ranges within one spreadsheet share a batchGet request)
+MOPED_SHEETS_FETCH_WORKERS = config("SHEETS_FETCH_WORKERS", default=4, cast=int)
+
+# Rows written per bulk upsert batch (and per transaction) during a sync
+MOPED_SYNC_BATCH_SIZE = config("SYNC_BATCH_SIZE", default=500, cast=int)
+
+# Seconds after which a pending/running background sync job is considered abandoned
+MOPED_SYNC_JOB_TIMEOUT = config("SYNC_JOB_TIMEOUT_SECONDS", default=15 * 60, cast=int)
+
+# sync_daemon polling: the interval drops to the minimum after a sync that found new rows and doubles after each
+# one that did not, up to the maximum. Failed syncs back off exponentially (with jitter) up to SYNC_BACKOFF_MAX.
+MOPED_SYNC_POLL_MIN = config("SYNC_POLL_MIN_SECONDS", default=60, cast=int)
+MOPED_SYNC_POLL_MAX = config("SYNC_POLL_MAX_SECONDS", default=15 * 60, cast=int)
+MOPED_SYNC_BACKOFF_MAX = config("SYNC_BACKOFF_MAX_SECONDS", default=30 * 60, cast=int)
+# Port the daemon serves its Prometheus metrics on (it runs outside the web process); 0 to not serve them
+MOPED_SYNC_DAEMON_METRICS_PORT = config("SYNC_DAEMON_METRICS_PORT", default=9101, cast=int)
+
+# "python" or "numpy" (vectorized fillup_pairs/monthly_summary; falls back to python if NumPy is missing)
+MOPED_CALCULATION_ENGINE = config("CALCULATION_ENGINE", default="python")
+
+# "json" or "orjson" (faster JSON responses with the same bytes; falls back to json if orjson is missing)
+MOPED_JSON_ENGINE = config("JSON_ENGINE", default="json")
+
+# Seconds the scrape-time Prometheus gauges are reused for (a sync that changes data refreshes them sooner)
+MOPED_METRICS_TTL = config("METRICS_TTL_SECONDS", default=60, cast=int)
+
+# Request profiling (moped/profiling.py). Off by default, and then the middleware is not loaded at all.
+MOPED_PROFILING = config("PROFILING", default=False, cast=bool)
+# Fraction of requests profiled without being asked, from 0 to 1
+MOPED_PROFILE_SAMPLE_RATE = config("PROFILE_SAMPLE_RATE", default=0.0, cast=float)
+# "cprofile" (pstats download) or "sampler" (collapsed stacks, for flame graphs)
+MOPED_PROFILER = config("PROFILER", default="cprofile")
+MOPED_PROFILE_SAMPLER_INTERVAL = config("PROFILE_SAMPLER_INTERVAL_MS", default=5, cast=int) / 1000
+# Profiles kept; older ones are deleted as new ones are stored
+MOPED_PROFILES_KEPT = config("PROFILES_KEPT", default=50, cast=int)
+
+# Cache alias for analytics responses. Entries are keyed by sync generation, so they never need a timeout;
+# the local-memory backend evicts least recently used entries past MAX_ENTRIES.
+MOPED_RESPONSE_CACHE = "moped"
+
 
 LOGGING = {
     "version": 1,